@@ -0,0 +1,118 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from rummy import CARDS, MELDS, Card, Meld, MeldType, RummyGame, card_points, cards_in, classify_meld, mask_of, meld_order
+
+CACHE_SIZE = 4096  # analyses remembered, least recently used evicted first
+
+# How much melding a card raises a player's score: it stops counting against them and starts counting for them
+_GAIN = {
+    ace_high: [card_points(card, ace_high) + card_points(card) for card in CARDS]
+    for ace_high in (False, True)
+}
+
+
+@dataclass
+class HandAnalysis:
+    """The best way to lay down a hand."""
+    melds: List[Meld]  # the hand's cards, grouped as they would be melded
+    plays: List[List[Card]]  # what to pass to play_meld for each meld, including any table cards it extends
+    deadwood: List[Card]  # cards left in hand
+    score: int  # meld points minus deadwood points, as _calculate_player_score counts them
+
+
+def analyze_hand(hand: List[Card], set_mask: int = 0, run_mask: int = 0, high_ace_mask: int = 0) -> HandAnalysis:
+    """
+    Find the partition of a hand into melds that scores the most points.
+
+    Melds may extend those already on the table, following the same rules
+    as RummyGame.play_meld.
+
+    Args:
+        hand: The cards in the hand
+        set_mask: Cards on the table in sets
+        run_mask: Cards on the table in runs
+        high_ace_mask: Aces on the table that count high
+
+    Returns:
+        The best melds, the plays that make them, and the remaining deadwood
+    """
+    hand_mask = mask_of(hand)
+    _, plays = _best_plays(hand_mask, set_mask, run_mask, high_ace_mask)
+    melds = []
+    selections = []
+    melded = 0
+    for selection, meld_type, ace_high in plays:
+        new = selection & hand_mask
+        melds.append(Meld(meld_order(cards_in(new), ace_high), meld_type, ace_high))
+        selections.append(meld_order(cards_in(selection), ace_high))
+        melded |= new
+    deadwood = [card for card in hand if not card.mask & melded]
+    score = sum(card_points(card, meld.ace_high) for meld in melds for card in meld.cards)
+    score -= sum(card_points(card) for card in deadwood)
+    return HandAnalysis(melds, selections, deadwood, score)
+
+
+def hand_score(hand_mask: int, set_mask: int = 0, run_mask: int = 0, high_ace_mask: int = 0) -> int:
+    """The score of a hand (as a card bitset) if its best melds are laid down, without building the melds."""
+    gain, _ = _best_plays(hand_mask, set_mask, run_mask, high_ace_mask)
+    return gain - sum(card_points(card) for card in cards_in(hand_mask))
+
+
+def analyze_player(game: RummyGame, player_id: str) -> HandAnalysis:
+    """Analyze a player's hand against the melds on the table."""
+    return analyze_hand(game.players_hands[player_id], game.set_mask, game.run_mask, game.high_ace_mask)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _best_plays(hand_mask: int, set_mask: int, run_mask: int, high_ace_mask: int) -> Tuple[int, Tuple[Tuple[int, MeldType, bool], ...]]:
+    """
+    Search for the highest-scoring set of disjoint melds.
+
+    Returns:
+        The score gained over leaving every card in hand, and the melds as
+        (selection bitset, meld type, ace high) in the order to play them
+    """
+    available = hand_mask | set_mask | run_mask
+
+    # The best meld for each group of hand cards that can be laid down together
+    options: Dict[int, Tuple[int, int, MeldType, bool]] = {}
+    for mask in MELDS:
+        new = mask & hand_mask
+        if not new or mask & ~available:
+            continue
+        meld_type, ace_high = classify_meld(mask, set_mask, run_mask, high_ace_mask)
+        if meld_type == MeldType.NONE:
+            continue
+        gain = sum(_GAIN[ace_high][card.id] for card in cards_in(new))
+        if new not in options or gain > options[new][0]:
+            options[new] = (gain, mask, meld_type, ace_high)
+
+    groups_with: Dict[int, List[int]] = {}
+    for group in options:
+        for card in cards_in(group):
+            groups_with.setdefault(card.id, []).append(group)
+
+    memo: Dict[int, Tuple[int, Tuple[int, ...]]] = {}
+
+    def best(remaining: int) -> Tuple[int, Tuple[int, ...]]:
+        # Decide the lowest remaining card: leave it in hand, or meld it with one of its groups
+        if not remaining:
+            return 0, ()
+        if remaining in memo:
+            return memo[remaining]
+        low = remaining & -remaining
+        result = best(remaining ^ low)
+        for group in groups_with.get(low.bit_length() - 1, ()):
+            if group & ~remaining:
+                continue
+            gain, groups = best(remaining & ~group)
+            gain += options[group][0]
+            if gain > result[0]:
+                result = (gain, (group,) + groups)
+        memo[remaining] = result
+        return result
+
+    gain, groups = best(hand_mask)
+    return gain, tuple(options[group][1:] for group in groups)
@@ -0,0 +1,345 @@
+"""
+Statistics over a season of recorded games, for seeing how the game plays:
+how long rounds last, how deep players dig into the discard pile, which
+melds get played, how rounds score and whether going first pays.
+
+Reads archives of finished games (the file the server appends to as
+ARCHIVE), single recordings (.nrr) and server databases (whose games are
+read as far as their last snapshot).  Nothing is loaded whole: recordings
+are read one at a time and their moves streamed through a GameTracker,
+which follows only the cards (hands and piles as bitsets, the same way
+rummy.py indexes them) instead of building a RummyGame.  Archives are split
+into chunks of recordings that a pool of processes works through, and the
+chunks' tallies are added together at the end.  Prints JSON.
+
+    python analytics.py season.nrra game.nrr --workers 8
+"""
+import argparse
+import base64
+import json
+import random
+import sqlite3
+import struct
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, fields
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from recording import MAGIC, BadRecording, Recording, archive_offsets, read_archive
+from rummy import ACE_MASK, CARDS, RECORDED_MOVES, MeldType, card_points, classify_meld
+
+POINTS = [card_points(card) for card in CARDS]  # card id -> points in hand, or in a meld with aces low
+HIGH_POINTS = [card_points(card, True) for card in CARDS]  # card id -> points in a meld with aces high
+HAND_SIZE = 10
+TARGET = 500  # a game ends when one player alone reaches this
+
+Task = Tuple[str, Optional[int], Optional[int]]  # (file, offset of the first recording, how many) for one worker
+
+
+@dataclass
+class Stats:
+    """Tallies over some games; tallies of different games add up with merge."""
+    games: int = 0
+    finished: int = 0  # games someone won
+    moves: int = 0
+    rounds: int = 0  # rounds that ended with someone going out
+    round_moves: int = 0  # moves made in those rounds
+    round_turns: int = 0  # turns taken in those rounds (draws, strictly)
+    stack_draws: int = 0
+    pickups: Counter = field(default_factory=Counter)  # cards taken in one draw from the discard pile -> how many such draws
+    melds: Counter = field(default_factory=Counter)  # "set"/"run" played new or added to -> how many
+    round_scores: Counter = field(default_factory=Counter)  # a player's points for a round -> how often
+    final_scores: Counter = field(default_factory=Counter)  # a player's total at the end of a won game -> how often
+    seated_rounds: Counter = field(default_factory=Counter)  # table size -> rounds played out at it
+    starter_out: Counter = field(default_factory=Counter)  # table size -> rounds the player who led went out in
+    starter_points: Counter = field(default_factory=Counter)  # table size -> points scored by whoever led each round
+    seated_games: Counter = field(default_factory=Counter)  # table size -> games won at it
+    first_seat_won: Counter = field(default_factory=Counter)  # table size -> games won by the player who led the first round
+    damaged: int = 0  # recordings that couldn't be read or didn't play back
+
+    def merge(self, other: "Stats") -> "Stats":
+        for f in fields(self):
+            mine = getattr(self, f.name)
+            if isinstance(mine, Counter):
+                mine.update(getattr(other, f.name))  # not +, which would drop negative point totals
+            else:
+                setattr(self, f.name, mine + getattr(other, f.name))
+        return self
+
+    def report(self) -> Dict:
+        """The tallies and what they show, as JSON-ready values."""
+        def ratio(a: float, b: float) -> Optional[float]:
+            return round(a / b, 4) if b else None
+        discard_draws = sum(self.pickups.values())
+        deep = sum(count for depth, count in self.pickups.items() if depth > 1)
+        by_size = {}
+        for size in sorted(set(self.seated_rounds) | set(self.seated_games)):
+            by_size[size] = {
+                "rounds": self.seated_rounds[size],
+                "leader_went_out": ratio(self.starter_out[size], self.seated_rounds[size]),
+                "leader_mean_round_score": ratio(self.starter_points[size], self.seated_rounds[size]),
+                "expected_if_fair": round(1 / size, 4),
+                "games": self.seated_games[size],
+                "first_seat_won": ratio(self.first_seat_won[size], self.seated_games[size]),
+            }
+        return {
+            "games": self.games,
+            "finished_games": self.finished,
+            "damaged_recordings": self.damaged,
+            "moves": self.moves,
+            "rounds": self.rounds,
+            "mean_round_moves": ratio(self.round_moves, self.rounds),
+            "mean_round_turns": ratio(self.round_turns, self.rounds),
+            "discard_draws": discard_draws,
+            "deep_pickups": deep,  # draws taking more than the top card
+            "deep_pickup_rate": ratio(deep, discard_draws),
+            "deep_pickups_per_draw": ratio(deep, discard_draws + self.stack_draws),
+            "pickup_depths": dict(sorted(self.pickups.items())),
+            "melds": dict(sorted(self.melds.items())),
+            "round_scores": dict(sorted(self.round_scores.items())),
+            "mean_round_score": ratio(sum(score * n for score, n in self.round_scores.items()), sum(self.round_scores.values())),
+            "final_scores": dict(sorted(self.final_scores.items())),
+            "first_player_advantage": by_size,
+        }
+
+
+def moves_of(recording: Recording) -> Iterator[Tuple[int, str, int]]:
+    """A recording's moves as (seat, one of RECORDED_MOVES, card bitset), unpacked as they're needed."""
+    for (record,) in struct.iter_unpack("<Q", recording.moves):
+        yield record >> 56, RECORDED_MOVES[(record >> 52) & 0xF], record & ((1 << len(CARDS)) - 1)
+
+
+class GameTracker:
+    """
+    Follows a recorded game through its moves, keeping only what the
+    statistics need, and tallies it into a Stats.
+
+    Only moves that changed the game are recorded, so each is one the engine
+    either made or answered with a complaint (drawing twice, discarding
+    before drawing, an invalid meld); the tracker tells the two apart the way
+    RummyGame does.  Moves after the game is won are ignored.
+    """
+
+    def __init__(self, recording: Recording, stats: Stats):
+        self.seats = len(recording.player_ids)
+        self.seed = recording.seed
+        self.stats = stats
+        self.scores = [0] * self.seats
+        self.round = 0
+        self.current = 0  # seat of the player whose turn it is
+        self.over = False
+        self._deal()
+
+    def _deal(self) -> None:
+        """Shuffle and deal the round's cards exactly as RummyGame does."""
+        self.stack = list(range(len(CARDS)))
+        random.Random(self.seed << 16 | self.round).shuffle(self.stack)
+        self.hands = [0] * self.seats
+        for _ in range(HAND_SIZE):
+            for seat in range(self.seats):
+                if self.stack:
+                    self.hands[seat] |= 1 << self.stack.pop()
+        self.discards = [self.stack.pop()] if self.stack else []
+        self.melded = [0] * self.seats  # points each player has melded this round
+        self.set_mask = self.run_mask = self.high_ace_mask = 0
+        self.has_drawn = False
+        self.leader = self.current
+        self.moves = self.turns = 0
+
+    def play(self, seat: int, kind: str, mask: int) -> None:
+        if self.over:
+            return
+        self.moves += 1
+        if kind == "draw-stack":
+            if not self.has_drawn:
+                self.hands[seat] |= 1 << self.stack.pop()
+                self.has_drawn = True
+                self.turns += 1
+                self.stats.stack_draws += 1
+        elif kind == "draw-discard":
+            if not self.has_drawn:
+                index = self.discards.index(mask.bit_length() - 1)
+                for card_id in self.discards[index:]:
+                    self.hands[seat] |= 1 << card_id
+                self.stats.pickups[len(self.discards) - index] += 1
+                del self.discards[index:]
+                self.has_drawn = True
+                self.turns += 1
+        elif kind == "play-meld":
+            meld_type, ace_high = classify_meld(mask, self.set_mask, self.run_mask, self.high_ace_mask)
+            if meld_type != MeldType.NONE:
+                new = mask & self.hands[seat]
+                self.hands[seat] &= ~new
+                if meld_type == MeldType.SET:
+                    self.set_mask |= new
+                else:
+                    self.run_mask |= new
+                if ace_high:
+                    self.high_ace_mask |= new & ACE_MASK
+                points = HIGH_POINTS if ace_high else POINTS
+                self.melded[seat] += sum(points[card_id] for card_id in bit_ids(new))
+                self.stats.melds[f"{meld_type.name.lower()} {'played' if new == mask else 'added to'}"] += 1
+                if not self.hands[seat]:
+                    self._end_round(seat)
+        elif kind == "discard":
+            if self.has_drawn:
+                self.hands[seat] &= ~mask
+                self.discards.append(mask.bit_length() - 1)
+                if not self.hands[seat]:
+                    self._end_round(seat)
+                else:
+                    self.has_drawn = False
+                    self.current = (self.current + 1) % self.seats
+
+    def _end_round(self, out: int) -> None:
+        """Score a round someone went out of, as RummyGame._end_game does, then end the game or deal again."""
+        stats = self.stats
+        stats.rounds += 1
+        stats.round_moves += self.moves
+        stats.round_turns += self.turns
+        stats.seated_rounds[self.seats] += 1
+        stats.starter_out[self.seats] += out == self.leader
+        best, tied = TARGET - 1, False
+        for seat in range(self.seats):
+            score = self.melded[seat] - sum(POINTS[card_id] for card_id in bit_ids(self.hands[seat]))
+            stats.round_scores[score] += 1
+            if seat == self.leader:
+                stats.starter_points[self.seats] += score
+            self.scores[seat] += score
+            if self.scores[seat] > best:
+                best, tied = self.scores[seat], False
+            elif self.scores[seat] == best:
+                tied = True
+        if best >= TARGET and not tied:
+            self.over = True
+            stats.finished += 1
+            stats.seated_games[self.seats] += 1
+            stats.first_seat_won[self.seats] += self.scores.index(max(self.scores)) == 0
+            stats.final_scores.update(self.scores)
+            return
+        self.round += 1
+        self.current = self.round % self.seats
+        self._deal()
+
+
+def bit_ids(mask: int) -> Iterator[int]:
+    """The card ids in a bitset."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def tally(recordings: Iterator[Recording], stats: Stats) -> Stats:
+    """Stream recordings through trackers into stats."""
+    for recording in recordings:
+        tracker = GameTracker(recording, stats)
+        moves = 0
+        try:
+            for seat, kind, mask in moves_of(recording):
+                tracker.play(seat, kind, mask)
+                moves += 1
+        except (IndexError, ValueError, KeyError):
+            stats.damaged += 1  # a move the game couldn't have made; its tallies so far stand
+        stats.games += 1
+        stats.moves += moves
+    return stats
+
+
+def database_recordings(path: str) -> Iterator[Recording]:
+    """The recordings in a server database's snapshots (moves journaled since a game's last snapshot aren't included)."""
+    from store import unpack_game  # only databases need the store's format
+
+    connection = sqlite3.connect(path)
+    try:
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "games" in tables:
+            for (snapshot,) in connection.execute("SELECT snapshot FROM games"):
+                state = json.loads(snapshot)
+                if state.get("recording") is not None:
+                    yield recording_of(state)
+        if "shared_games" in tables:
+            for (data,) in connection.execute("SELECT data FROM shared_games"):
+                game = unpack_game(data)
+                if game.recording is not None:
+                    yield Recording.of(game)
+    finally:
+        connection.close()
+
+
+def recording_of(state: Dict) -> Recording:
+    """The recording in a game snapshot, without restoring the game."""
+    return Recording(state["seed"], state["player_names"], state["player_ids"], base64.b64decode(state["recording"]))
+
+
+def run(task: Task) -> Stats:
+    """Tally one task; what each worker process runs."""
+    path, offset, count = task
+    stats = Stats()
+    try:
+        if offset is not None:
+            return tally(read_archive(path, offset, count), stats)
+        with open(path, "rb") as f:
+            head = f.read(4)
+        if head == MAGIC:
+            with open(path, "rb") as f:
+                return tally(iter([Recording.from_bytes(f.read())]), stats)
+        return tally(database_recordings(path), stats)
+    except (BadRecording, sqlite3.DatabaseError) as e:
+        print(f"{path}: {e}", file=sys.stderr)
+        stats.damaged += 1
+        return stats
+
+
+def tasks(paths: List[str], chunk: int) -> Iterator[Task]:
+    """Split the sources into work for the pool: archives in chunks of recordings, anything else whole."""
+    for path in paths:
+        with open(path, "rb") as f:
+            head = f.read(16)
+        # An archive starts with a length, then a recording
+        if len(head) >= 8 and head[4:8] == MAGIC:
+            try:
+                for position, offset in enumerate(archive_offsets(path)):
+                    if position % chunk == 0:
+                        yield path, offset, chunk
+            except BadRecording as e:
+                # Most likely a server stopped partway through appending; everything before counts
+                print(e, file=sys.stderr)
+        else:
+            yield path, None, None
+
+
+def sum_stats(parts: Iterator[Stats]) -> Stats:
+    total = Stats()
+    for part in parts:
+        total.merge(part)
+    return total
+
+
+def analyze(paths: List[str], workers: Optional[int] = None, chunk: int = 2000) -> Stats:
+    """
+    Tally every game in the given sources across a pool of processes.
+
+    Args:
+        paths: Archives, recordings and databases
+        workers: Processes to use (default: one per core); 1 works in this process
+        chunk: Recordings from an archive given to a worker at a time
+    """
+    if workers == 1:
+        return sum_stats(run(task) for task in tasks(paths, chunk))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return sum_stats(pool.map(run, tasks(paths, chunk)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Statistics over archived and recorded games")
+    parser.add_argument("sources", nargs="+", help="archives, recordings (.nrr) or server databases")
+    parser.add_argument("--workers", type=int, default=None, help="processes to use (default: one per core)")
+    parser.add_argument("--chunk", type=int, default=2000, help="recordings per task")
+    args = parser.parse_args()
+    print(json.dumps(analyze(args.sources, args.workers, max(args.chunk, 1)).report(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
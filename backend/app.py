@@ -1,22 +1,97 @@
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify, make_response, Response
 from flask_cors import CORS
-from rummy import RummyGame, Card, Suit, Rank, MeldType
+from rummy import RummyGame, Card, Place
+from analysis import analyze_player
+from bots import GreedyStrategy, decide, make_strategy, view_for
+from persistence import GameJournal
+from store import MemoryStore, Player, SqliteStore, Store, StoreConflict
+from matchmaking import Matchmaker, TABLE_SIZES
+from metrics import COUNT_BUCKETS, SIZE_BUCKETS, Counter, Gauge, Histogram, Registry
+from profiling import make_profiler
+from moves import KINDS, IllegalMove, TURN_KINDS
+from recording import Recording, archive
+from wire import FORMATS, MSGPACK, InvalidCard, convert_card, encode_hand, encode_members, encode_object, encode_response, msgpack, parse_card, public_members
+from concurrent.futures import Future, ProcessPoolExecutor
 import uuid
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import atexit
+import hmac
 import json
+import multiprocessing
+import random
+import threading
+import time
 
 app = Flask(__name__)
 CORS(app)
 
+# Defaults, overridable with RUMMY_-prefixed environment variables (values are parsed as JSON)
+app.config.update(
+    BOT_THINK_SECONDS={"easy": 0.1, "medium": 0.5, "hard": 2.0},  # time a bot spends on each decision, by difficulty
+    BOT_TAKEOVER_DIFFICULTY="medium",  # difficulty of the bot that takes over when a player quits
+    BOT_WORKERS=None,  # processes working out bot moves (default: one per core)
+    STORE="memory",  # "memory" to keep games in this process, "sqlite" to share them between worker processes through DATABASE
+    DATABASE=None,  # SQLite file games are saved to (default: kept in memory only, or rummy.db for the shared store)
+    SNAPSHOT_EVERY=20,  # moves journaled for a game between snapshots of it, in the memory store
+    STORE_POLL_SECONDS=0.5,  # how often waiting clients check for changes made by other processes, in the shared store
+    PLAYER_TTL_SECONDS=600,  # players who send no request for this long are taken out as if they had quit
+    GAME_TTL_SECONDS=3600,  # games nobody has played or looked at for this long are dropped
+    FINISHED_GAME_TTL_SECONDS=300,  # how long a finished game stays for its players to see the result
+    MAX_GAMES=10000,  # most games kept at once; beyond this the least recently active are dropped
+    REAP_INTERVAL_SECONDS=30,  # how often to look for idle players and games
+    MATCHMAKING=False,  # let players joining with "match" be seated automatically (matched among those who joined through this process)
+    MATCH_RELAX_SECONDS=30,  # how long a player waits for their preferred table size before taking any
+    ARCHIVE=None,  # file the recordings of dropped games are appended to, for analytics.py (default: not kept)
+    PROFILE_SAMPLE_RATE=0.0,  # fraction of requests to PROFILE_ROUTES that are profiled (see profiling.py)
+    PROFILE_ROUTES=["/game", "/game_state", "/turn"],
+    PROFILER="cprofile",  # "cprofile" for function timings (pstats), or "stack" for sampled call stacks (collapsed, for flame graphs)
+    PROFILE_STACK_INTERVAL=0.005,  # seconds between looks at the stacks, for the "stack" profiler
+    ADMIN_TOKEN=None,  # secret the /admin routes want in an X-Admin-Token header (default: they are turned off)
+)
+app.config.from_prefixed_env("RUMMY")
+
 # Enable CORS for all routes
 from flask_cors import cross_origin
 
-# Global game state management
-waiting_players: List[Dict[str, str]] = []  # List of waiting players with their IDs and names
-active_games: Dict[str, RummyGame] = {}  # Game ID -> RummyGame instance
-player_games: Dict[str, str] = {}  # Player ID -> Game ID
-player_names: Dict[str, str] = {}  # Player ID -> Player Name
-# player_connections: Dict[str, str] = {}  # Player ID -> Socket session ID
+# Global game state management: games, players and the waiting room live in the store
+def open_store() -> Store:
+    if app.config["STORE"] == "sqlite":
+        return SqliteStore(app.config["DATABASE"] or "rummy.db")
+    if app.config["DATABASE"]:
+        return MemoryStore(GameJournal(app.config["DATABASE"], app.config["SNAPSHOT_EVERY"]))
+    return MemoryStore()
+
+store = open_store()
+atexit.register(store.close)
+bot_turns: Set[str] = set()  # Game IDs with a bot move being worked out in this process
+bot_pool: Optional[ProcessPoolExecutor] = None
+matchmaker = Matchmaker(app.config["MATCH_RELAX_SECONDS"])
+waiting_room_cache: Tuple[int, List[Dict[str, str]]] = (-1, [])  # (lobby version, waiting room as sent to clients)
+public_states: Dict[str, Tuple[int, Dict[Tuple[str, bool], Tuple[bytes, int]]]] = {}  # Game ID -> (version, (card format, MessagePack?) -> the part of its state every player sees, encoded, and its member count)
+
+# Change notification for long-polling and streaming clients in this process
+# (clients of the shared store also poll it for changes made by other processes)
+game_updates: Dict[str, threading.Condition] = {}  # Game ID -> the game's lock, notified whenever the game changes
+lobby_updates = threading.Condition()  # notified whenever the waiting room changes
+update_listeners: List[Callable[[str], None]] = []  # also told the ID of each game that changes, or "lobby" (see asgi.py)
+
+profiler = make_profiler(app.config["PROFILER"], app.config["PROFILE_STACK_INTERVAL"])
+
+# What /metrics reports (see metrics.py)
+metrics = Registry()
+request_seconds = metrics.add(Histogram("rummy_request_seconds", "Time to answer a request (to the start of a stream), by route", ("route", "method")))
+responses = metrics.add(Counter("rummy_responses_total", "Responses sent, by route and status", ("route", "status")))
+move_seconds = metrics.add(Histogram("rummy_move_seconds", "Time to make a client's move and build the state sent back, by kind of move", ("move",)))
+state_bytes = metrics.add(Histogram("rummy_game_state_bytes", "Size of the game states sent to players, by card format and encoding", ("format", "encoding"), SIZE_BUCKETS))
+event_log_events = metrics.add(Histogram("rummy_event_log_events", "Events in a game's log each time its state is sent", (), COUNT_BUCKETS))
+errors = metrics.add(Counter("rummy_errors_total", "Exceptions caught, by route (or background task) and type", ("where", "exception")))
+metrics.add(Gauge("rummy_games", "Games in play", lambda: len(store.game_ids())))
+metrics.add(Gauge("rummy_waiting_players", "Players in the waiting room", lambda: len(store.waiting_players())))
+metrics.add(Gauge("rummy_matchmaking_players", "Players queued for matchmaking in this process", lambda: len(matchmaker)))
+metrics.add(Gauge("rummy_bot_turns", "Bot moves being worked out in this process", lambda: len(bot_turns)))
+
+MAX_WAIT_SECONDS = 25  # longest a long-poll request is held open
+STREAM_KEEPALIVE_SECONDS = 15  # how often an idle stream sends a comment to keep proxies from closing it
 
 def generate_player_id() -> str:
     """Generate a unique player ID."""
@@ -26,10 +101,217 @@ def generate_game_id() -> str:
     """Generate a unique game ID."""
     return str(uuid.uuid4())
 
+def get_bot_pool() -> ProcessPoolExecutor:
+    """
+    The process pool bots think in, so their searches never hold up request threads.
+
+    It is started on demand, by which time this process has other threads
+    running (holding locks a forked child would inherit stuck), so its
+    workers are started from a fresh process rather than forked from this one.
+    """
+    global bot_pool
+    if bot_pool is None:
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        bot_pool = ProcessPoolExecutor(max_workers=app.config["BOT_WORKERS"], mp_context=multiprocessing.get_context(method))
+    return bot_pool
+
+def game_condition(game_id: str) -> threading.Condition:
+    """
+    The game's lock, which is also the condition notified whenever the game changes in this process.
+
+    Moves, and reads of the game for clients, happen while holding it, so no
+    one sees (or makes) a move half made.  It is reentrant.
+    """
+    condition = game_updates.get(game_id)
+    if condition is None:
+        condition = game_updates.setdefault(game_id, threading.Condition(threading.RLock()))
+    return condition
+
+def schedule_bot_turn(game_id: str) -> None:
+    """If it is a bot's turn in this game, start working out its next move."""
+    with game_condition(game_id):
+        game = store.get_game(game_id)
+        if game is None:
+            game_updates.pop(game_id, None)
+            return
+        if game.winner is not None or game_id in bot_turns:
+            return
+        player_id = game.get_current_player()
+        player = store.get_player(player_id)
+        if player is None or player.bot is None:
+            return
+        difficulty = player.bot
+        strategy = make_strategy(difficulty, app.config["BOT_THINK_SECONDS"][difficulty])
+        phase = "play" if game.current_player_has_drawn else "draw"
+        version = game.version
+        if not store.claim_bot_turn(game_id, version):
+            return  # another worker process is working it out
+        bot_turns.add(game_id)
+        future = get_bot_pool().submit(decide, strategy, view_for(game, player_id), phase)
+    future.add_done_callback(lambda f: finish_bot_move(game_id, player_id, phase, version, f))
+
+def finish_bot_move(game_id: str, player_id: str, phase: str, version: int, future: Future) -> None:
+    """Apply a bot's move once worked out, then schedule the next one."""
+    condition = game_condition(game_id)
+    with condition:
+        bot_turns.discard(game_id)
+        player = store.get_player(player_id)
+        if player is None or player.bot is None:
+            return
+        game = store.get_game(game_id)
+        # If the game moved on while the bot was thinking, think again
+        if game is not None and game.version == version and game.get_current_player() == player_id:
+            try:
+                decision = future.result()
+            except Exception as e:
+                count_error(e, "bot")
+                print(f"Bot move failed, falling back to a greedy one: {str(e)}")
+                decision = decide(GreedyStrategy(), view_for(game, player_id), phase)
+            try:
+                store.make_move(game_id, player_id, f"bot-{phase}", decision, expected_version=version)
+            except StoreConflict as e:
+                count_error(e, "bot")
+                print(f"Bot move dropped: {str(e)}")
+            condition.notify_all()
+            notify_listeners(game_id)
+    schedule_bot_turn(game_id)
+
+def notify_lobby_updated() -> None:
+    """Bump the waiting room version and wake every client waiting on it."""
+    with lobby_updates:
+        store.touch_lobby()
+        lobby_updates.notify_all()
+    notify_listeners("lobby")
+
+def notify_listeners(key: str) -> None:
+    """Pass on that a game (or with key "lobby", the waiting room) changed to waiters other than the conditions'."""
+    for listener in update_listeners:
+        listener(key)
+
+def get_human(player_id: str) -> Optional[Player]:
+    """A player, unless there is no such player or the computer now plays their seat."""
+    player = store.get_player(player_id)
+    return player if player is not None and player.bot is None else None
+
+def check_in(player_id: str) -> Optional[Player]:
+    """get_human for a request from the player, noting that they (and so their game) are still around."""
+    player = get_human(player_id)
+    if player is not None:
+        now = time.time()
+        store.touch_player(player_id, now)
+        if player.game_id is not None:
+            store.touch_game(player.game_id, now)
+    return player
+
+def waiting_room() -> List[Dict[str, str]]:
+    """The waiting players, with their IDs and names, as sent to clients (listed once per lobby version)."""
+    global waiting_room_cache
+    version = store.lobby_version()  # read first, so a listing cached under it is never older than it
+    if waiting_room_cache[0] != version:
+        waiting_room_cache = (version, [{"id": player.player_id, "name": player.name} for player in store.waiting_players()])
+    return waiting_room_cache[1]
+
+def state_marker(player_id: str) -> Tuple[str, int]:
+    """What a player currently sees: their game and its version, or the waiting room and its version."""
+    player = get_human(player_id)
+    if player is not None and player.game_id is not None:
+        return player.game_id, store.game_version(player.game_id)
+    return "lobby", store.lobby_version()
+
+def client_marker(player: Player, data: Dict) -> Tuple[str, Optional[int]]:
+    """The state marker for what a /game_state request says the client already has."""
+    if player.game_id is not None:
+        return player.game_id, data.get("version")
+    return "lobby", data.get("lobby_version")
+
+def wait_for_update(player_id: str, marker: Tuple[str, int], timeout: float) -> bool:
+    """
+    Block until what the player sees differs from marker, or until timeout passes.
+
+    Returns:
+        True if the state changed, False on timeout
+    """
+    player = get_human(player_id)
+    if player is None:
+        return True
+    condition = game_condition(player.game_id) if player.game_id else lobby_updates
+    def changed() -> bool:
+        return get_human(player_id) is None or state_marker(player_id) != marker
+    # Changes made in this process notify the condition; the shared store is also polled for the rest
+    poll = app.config["STORE_POLL_SECONDS"] if store.shared else None
+    deadline = time.monotonic() + timeout
+    with condition:
+        while not changed():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            condition.wait(min(remaining, poll) if poll else remaining)
+        return True
+
 @app.route("/")
 def hello_world():
     return '<p>This is the backend to National Recording Rummy.  For the frontend, click <a href="https://nationalrecordingregistry.net/games/rummy/index.html">here</a></p>'
 
+def route_label() -> str:
+    """The route a request matched, as a metrics label."""
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+def count_error(e: Exception, where: Optional[str] = None) -> None:
+    """Count an exception that was caught rather than let through (by default, in the current request's route)."""
+    errors.inc(where or route_label(), type(e).__name__)
+
+@app.before_request
+def start_timing() -> None:
+    g.request_started = time.perf_counter()
+    rate = app.config["PROFILE_SAMPLE_RATE"]
+    if rate and route_label() in app.config["PROFILE_ROUTES"] and random.random() < rate:
+        g.profile = profiler.start(route_label())
+
+@app.teardown_request
+def stop_profiling(exception: Optional[BaseException]) -> None:
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profiler.stop(route_label(), profile)
+
+@app.after_request
+def record_request(response: Response) -> Response:
+    route = route_label()
+    request_seconds.observe(time.perf_counter() - g.request_started, route, request.method)
+    responses.inc(route, str(response.status_code))
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """This process's metrics, in Prometheus's text format."""
+    return Response(metrics.render(), 200, mimetype="text/plain; version=0.0.4")
+
+def is_admin() -> bool:
+    """Whether the request carries the admin token (never, if none is set)."""
+    token = app.config["ADMIN_TOKEN"]
+    return bool(token) and hmac.compare_digest(request.headers.get("X-Admin-Token", "").encode(), str(token).encode())
+
+@app.route("/admin/profile", methods=["GET"])
+def get_profile():
+    """
+    Download what the profiler has gathered: a pstats file from the "cprofile"
+    profiler, collapsed stacks from the "stack" one.  Admins only.
+
+    Query parameters:
+        route: Only requests to this route (default: all of PROFILE_ROUTES together)
+        reset: "1" to start gathering afresh afterwards
+    """
+    if not is_admin():
+        return jsonify({"success": False, "message": "Not found"}), 404
+    route = request.args.get("route")
+    data = profiler.dump(route, request.args.get("reset") == "1")
+    if data is None:
+        return jsonify({"success": False, "message": "Nothing has been profiled yet"}), 404
+    name = (route or "all").strip("/").replace("/", "-") or "root"
+    extension = "pstats" if app.config["PROFILER"] == "cprofile" else "folded"
+    response = Response(data, 200, mimetype="application/octet-stream" if extension == "pstats" else "text/plain")
+    response.headers["Content-Disposition"] = f"attachment; filename=profile-{name}.{extension}"
+    return response
+
 @app.route("/join", methods=["POST"])
 @cross_origin()
 def join_game():
@@ -38,7 +320,9 @@ def join_game():
     
     Expected JSON:
     {
-        "name": "Player Name"
+        "name": "Player Name",
+        "match": true,  (optional; seat the player automatically once enough others are waiting, if matchmaking is on)
+        "seats": 3  (optional, with "match"; the table size they would like, 2-4)
     }
     
     Returns:
@@ -65,30 +349,41 @@ def join_game():
                 "message": "Name cannot be empty"
             }), 400
         
-        # Check if player is already waiting
-        for player in waiting_players:
-            if player['name'].lower() == player_name.lower():
-                return jsonify({
-                    "success": False,
-                    "message": "A player with this name is already waiting"
-                }), 400
+        match = bool(data.get('match'))
+        seats = data.get('seats')
+        if match and not app.config["MATCHMAKING"]:
+            return jsonify({
+                "success": False,
+                "message": "Matchmaking is not enabled"
+            }), 400
+        if seats is not None and seats not in TABLE_SIZES:
+            return jsonify({
+                "success": False,
+                "message": "Tables have 2-4 seats"
+            }), 400
         
-        # Generate player ID and add to waiting list
+        # Generate player ID and add to waiting list, unless the name is taken
         player_id = generate_player_id()
-        player_names[player_id] = player_name
-        waiting_players.append({
-            "id": player_id,
-            "name": player_name
-        })
+        if not store.join_lobby(Player(player_id, player_name)):
+            return jsonify({
+                "success": False,
+                "message": "A player with this name is already waiting"
+            }), 400
+        notify_lobby_updated()
+        if match:
+            table = matchmaker.add(player_id, seats, time.time())
+            if table is not None:
+                seat_table(table)
 
         return jsonify({
             "success": True,
             "player_id": player_id,
-            "waiting_players": waiting_players.copy(),
+            "waiting_players": waiting_room(),
             "message": f"Successfully joined as {player_name}"
         })
         
     except Exception as e:
+        count_error(e)
         return jsonify({
             "success": False,
             "message": f"Error joining game: {str(e)}"
@@ -102,7 +397,8 @@ def start_game():
     
     Expected JSON:
     {
-        "player_names": ["Player1", "Player2", "Player3"]
+        "player_names": ["Player1", "Player2", "Player3"],
+        "bots": ["easy", "hard"]  (optional; difficulties of computer players to fill the other seats)
     }
     
     Returns:
@@ -122,117 +418,359 @@ def start_game():
             }), 400
         
         player_names_list = data['player_names']
-        if not isinstance(player_names_list, list) or len(player_names_list) < 2 or len(player_names_list) > 4:
+        bot_difficulties = data.get('bots', [])
+        if not isinstance(player_names_list, list) or not isinstance(bot_difficulties, list) or len(player_names_list) < 1 or not 2 <= len(player_names_list) + len(bot_difficulties) <= 4:
+            return jsonify({
+                "success": False,
+                "message": "Must specify 2-4 players, at least one of them human"
+            }), 400
+        unknown_difficulties = [d for d in bot_difficulties if d not in app.config["BOT_THINK_SECONDS"]]
+        if unknown_difficulties:
             return jsonify({
                 "success": False,
-                "message": "Must specify 2-4 player names"
+                "message": f"Unknown bot difficulty: {', '.join(map(str, unknown_difficulties))}"
             }), 400
         
         # Check if all players are in the waiting list
-        waiting_player_names = [p['name'] for p in waiting_players]
-        missing_players = [name for name in player_names_list if name not in waiting_player_names]
+        waiting = [store.waiting_player(str(name)) for name in player_names_list]
+        missing_players = [str(name) for name, player in zip(player_names_list, waiting) if player is None]
         if missing_players:
             return jsonify({
                 "success": False,
                 "message": f"Players not found in waiting room: {', '.join(missing_players)}"
             }), 400
+        if len({player.player_id for player in waiting}) < len(waiting):
+            return jsonify({
+                "success": False,
+                "message": "Each player can only take one seat"
+            }), 400
         
-        # Create the game
-        game_id = generate_game_id()
-        player_ids = []
-        for player_name in player_names_list:
-            # Find the player ID for this name
-            for player in waiting_players:
-                if player['name'] == player_name:
-                    player_games[player['id']] = game_id
-                    player_ids.append(player['id'])
-                    break
-
-        game = RummyGame(len(player_names_list), player_names_list, player_ids)
-        active_games[game_id] = game
-        
-        # Remove players from waiting list
-        waiting_players[:] = [p for p in waiting_players if p['name'] not in player_names_list]
-        
-        # # Notify all players in the game via WebSocket
-        # for player_name in player_names_list:
-        #     # Find the player ID for this name from the original waiting list
-        #     for player_id, name in player_names.items():
-        #         if name == player_name and player_id in player_connections:
-        #             game_state = get_game_for_player(game_id, player_id)
-        #             socketio.emit('game_started', {
-        #                 'success': True,
-        #                 'game_state': game_state,
-        #                 'message': f"Game started with players: {', '.join(player_names_list)}"
-        #             }, room=player_connections[player_id])
-        #             break
+        # Create the game, unless another request got to one of the players first
+        seat_names = open_game(waiting, bot_difficulties)
+        if seat_names is None:
+            return jsonify({
+                "success": False,
+                "message": "Players not found in waiting room"
+            }), 400
         
         return jsonify({
             "success": True,
-            "message": f"Game started with players: {', '.join(player_names_list)}"
+            "message": f"Game started with players: {', '.join(seat_names)}"
         })
         
     except Exception as e:
+        count_error(e)
         return jsonify({
             "success": False,
             "message": f"Error starting game: {str(e)}"
         }), 500
 
-def convert_card(card: Card) -> Dict:
-    return {"suit": card.suit.value, "rank": card.rank.name, "meld_type": card.meld_type.name}
+def open_game(humans: List[Player], bot_difficulties: List[str]) -> Optional[List[str]]:
+    """
+    Seat waiting players (and bots of the given difficulties) at a new game.
+
+    Returns:
+        The names of the game's seats, or None (starting nothing) if one of the players is no longer waiting
+    """
+    game_id = generate_game_id()
+    players = [Player(player.player_id, player.name, game_id) for player in humans]
+    for i, difficulty in enumerate(bot_difficulties):
+        players.append(Player(generate_player_id(), f"{difficulty.capitalize()} Bot {i + 1}", game_id, difficulty))
+    seat_names = [player.name for player in players]
+
+    game = RummyGame(len(players), seat_names, [player.player_id for player in players])
+    game_condition(game_id)
+    # Moves players out of the waiting room, unless another request got to one of them first
+    if not store.start_game(game_id, game, players):
+        game_updates.pop(game_id, None)
+        return None
+    for player in humans:
+        matchmaker.remove(player.player_id)
 
-def convert_card_back(data: Dict) -> Card:
-    try:
-        c = Card(suit=Suit(data["suit"]), rank=Rank(int(data["rank"])), meld_type=MeldType[data["meld_type"]])
-        return c
-    except:
-        print("Received invalid card description from client")
-        return Card(Suit.SPADES, Rank.ACE, MeldType.NONE)
-
-def get_game_for_player(game_id: str, player_id: str) -> Dict:
-    """Helper function to get the game state for a specific player."""
-    game = active_games[game_id]
-    gameState = dict({
-        "gameID": game_id,
-        "playerNames": game.player_names,
-        "playerScores": [game.scores[i] for i in game.player_ids],
-        "hand": [convert_card(card) for card in game.players_hands[player_id]],
-        "handCts": [len(game.players_hands[i]) for i in game.player_ids],
-        "melds": [[[convert_card(card) for card in meld.cards] for meld in p] for p in [game.players_melds[i] for i in game.player_ids]],
-        "discards": [convert_card(card) for card in game.discard_pile],
-        "stack": len(game.stack), 
-        "activePlayerName": game.player_names[game.current_player], 
-        "playerCount": game.num_players,
-        "gameOver": game.is_game_over(),
-        "eventLog": game.event_log
-    })
-    return gameState
+    # Players waiting on the lobby wake up, see they are in a game and fetch it
+    notify_lobby_updated()
+    schedule_bot_turn(game_id)
+    return seat_names
+
+def seat_table(player_ids: List[str]) -> None:
+    """Start a game for a table the matchmaker filled, queueing its players again if one of them has gone."""
+    players = [store.get_player(player_id) for player_id in player_ids]
+    waiting = [player for player in players if player is not None and player.game_id is None]
+    if len(waiting) == len(player_ids) and open_game(waiting, []) is not None:
+        return
+    now = time.time()
+    for player in waiting:
+        table = matchmaker.add(player.player_id, None, now)
+        if table is not None:
+            seat_table(table)
+
+def match_forever() -> None:
+    """Matchmaking thread: seat players who have waited too long for their preferred table size at any table."""
+    while True:
+        time.sleep(1)
+        try:
+            for table in matchmaker.relax(time.time()):
+                seat_table(table)
+        except Exception as e:
+            count_error(e, "matchmaker")
+            print(f"Error matching players: {str(e)}")
+
+def convert_table_card(game: RummyGame, card: Card) -> Dict:
+    """Convert a card wherever it is in the game, marking it as melded if it is."""
+    location = game.get_card_location(card)
+    if location.place == Place.MELD:
+        return convert_card(card, game.players_melds[location.player_id][location.meld_index])
+    return convert_card(card)
+
+def response_encoding(data: Dict) -> Tuple[str, bool]:
+    """
+    The card format a request asks for, and whether to answer in MessagePack
+    (if the client accepts it and msgpack is installed).
+
+    Raises:
+        ValueError: If the format is unknown
+    """
+    card_format = data.get("format") or "verbose"
+    if card_format not in FORMATS:
+        raise ValueError(f"Unknown format: {card_format} (expected one of {', '.join(FORMATS)})")
+    binary = msgpack is not None and request.accept_mimetypes.best_match(["application/json", MSGPACK]) == MSGPACK
+    return card_format, binary
+
+def respond(payload: Dict, binary: bool, status: int = 200) -> Response:
+    """Answer with a payload as JSON or MessagePack."""
+    if binary:
+        return Response(msgpack.packb(payload), status, mimetype=MSGPACK)
+    return make_response(jsonify(payload), status)
+
+def public_state(game_id: str, game: RummyGame, card_format: str, binary: bool) -> Tuple[bytes, int]:
+    """
+    The members of a game's state that are the same for every player, encoded
+    by wire.encode_members, and how many there are (for encode_object); built
+    once per version of the game and encoding.
+    """
+    cached = public_states.get(game_id)
+    if cached is None or cached[0] != game.version:
+        if len(public_states) > 2 * app.config["MAX_GAMES"]:
+            public_states.clear()  # entries for games dropped by other processes
+        cached = public_states[game_id] = (game.version, {})
+    encoded = cached[1].get((card_format, binary))
+    if encoded is None:
+        members = public_members(game_id, game, card_format)
+        encoded = cached[1][(card_format, binary)] = (encode_members(members, binary), len(members))
+    return encoded
+
+def game_state_body(game_id: str, player_id: str, event_cursor: int = 0, card_format: str = "verbose", binary: bool = False,
+                    game: Optional[RummyGame] = None) -> Tuple[bytes, int]:
+    """
+    The response body carrying a player's game state: the shared public part
+    with the player's hand and events spliced in.
+
+    Only the events after event_cursor are included; "eventCursor" is the
+    cursor to send next time, and "eventFrom" is the one this slice starts
+    after so the client can splice it onto what it already has.  That is
+    later than event_cursor when the game no longer holds the events
+    between (as after being restored from a snapshot), so the client can
+    tell its log has a hole in it.
+
+    Args:
+        game: The game, if the caller has already read it (and checked it is still there)
+
+    Returns:
+        The body, and the event cursor to send from next time
+    """
+    if game is None:
+        game = store.get_game(game_id)
+    event_cursor = int(event_cursor)
+    cursor = game.event_log.cursor
+    events = game.event_log.since(event_cursor)
+    event_from = events[0].seq - 1 if events else event_cursor
+    public, public_count = public_state(game_id, game, card_format, binary)
+    private = {"eventLog": [game.describe_event(event) for event in events], "eventFrom": event_from, "eventCursor": cursor}
+    game_state = encode_object([public,
+                                encode_hand(game.players_hands[player_id], card_format, binary),  # one member, "hand"
+                                encode_members(private, binary)], public_count + 1 + len(private), binary)
+    body = encode_response(game_state, binary)
+    state_bytes.observe(len(body), card_format, "msgpack" if binary else "json")
+    event_log_events.observe(cursor)
+    return body, cursor
+
+def game_etag(game_id: str, version: int, card_format: str = "verbose", binary: bool = False) -> str:
+    """ETag for a game's state at a version, in an encoding."""
+    return f"{game_id}-{version}-{card_format}{'-msgpack' if binary else ''}"
 
 @app.route("/game_state", methods=["POST"])
 @cross_origin()
 def get_game_state() -> Dict:
+    """
+    Get the game state for a player, or the waiting room if they are not in a game.
+
+    Expected JSON:
+    {
+        "player_id": "unique_player_id",
+        "version": 12,  (optional; the version of the game state the client already has)
+        "lobby_version": 3,  (optional; the version of the waiting room the client already has)
+        "event_cursor": 40,  (optional; only events after this one are returned)
+        "wait": 20,  (optional; long-poll for up to this many seconds until something changes)
+        "format": "compact"  (optional; how cards are written, see wire.py)
+    }
+
+    An If-None-Match header carrying the ETag of an earlier response works too,
+    and is answered with an empty 304.  A matching "version" is answered with
+    {"success": true, "not_modified": true, "version": 12} instead, since fetch
+    clients cannot read the body of a 304.  Clients sending
+    Accept: application/msgpack are answered in MessagePack, if the server has it.
+    """
     try:
         data = request.get_json()
         if not "player_id" in data:
             return jsonify({ "success": False, "message": "no_player_id" })
         player_id = data["player_id"]
-        if (player_id in player_games):
-            return jsonify({"success": True, "game_state": get_game_for_player(player_games[player_id], player_id)}), 200
-        elif (player_id in player_names):
-            return jsonify({ "success": True, "waiting_players": waiting_players })
+        wait = min(float(data.get("wait") or 0), MAX_WAIT_SECONDS)
+        try:
+            card_format, binary = response_encoding(data)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        player = check_in(player_id)
+        if wait > 0 and player is not None:
+            wait_for_update(player_id, client_marker(player, data), wait)
+            player = get_human(player_id)
+        if player is not None and player.game_id is not None:
+            game_id = player.game_id
+            # The version, ETag and body all come from the one read of the game
+            with game_condition(game_id):
+                game = store.get_game(game_id)
+                if game is None:
+                    return jsonify({"success": False, "message": "Game not found"}), 400
+                etag = game_etag(game_id, game.version, card_format, binary)
+                if request.if_none_match.contains(etag):
+                    response = make_response('', 304)
+                    response.set_etag(etag)
+                    return response
+                if data.get("version") == game.version:
+                    return respond({"success": True, "not_modified": True, "version": game.version}, binary)
+                body, _ = game_state_body(game_id, player_id, data.get("event_cursor", 0), card_format, binary, game)
+            response = Response(body, 200, mimetype=MSGPACK if binary else "application/json")
+            response.set_etag(etag)
+            response.vary.add("Accept")
+            return response
+        elif player is not None:
+            lobby_version = store.lobby_version()
+            if data.get("lobby_version") == lobby_version:
+                return respond({"success": True, "not_modified": True, "lobby_version": lobby_version}, binary)
+            return respond({ "success": True, "waiting_players": waiting_room(), "lobby_version": lobby_version }, binary)
         else:
-            return jsonify({ "success": False, "message": f"Invalid player_id: {player_id}", "info": player_names })
+            return jsonify({ "success": False, "message": f"Invalid player_id: {player_id}" })
     except Exception as e:
+        count_error(e)
         return jsonify({"success": False, "message": f"Aaaauuugh {str(e)}"}), 500
 
+def stream_payload(player_id: str, marker: Tuple[str, int], event_cursor: int, card_format: str = "verbose") -> Tuple[str, int]:
+    """
+    What a stream sends a player for a state marker.
+
+    Returns:
+        The event's data as JSON, and the event cursor to send from next time
+    """
+    if marker[0] == "lobby":
+        return json.dumps({"success": True, "waiting_players": waiting_room(), "lobby_version": marker[1]}), event_cursor
+    with game_condition(marker[0]):
+        game = store.get_game(marker[0])
+        if game is None:
+            return json.dumps({"success": False, "message": "Game not found"}), event_cursor
+        body, event_cursor = game_state_body(marker[0], player_id, event_cursor, card_format, game=game)
+    return body.decode(), event_cursor
+
+@app.route("/game_state/stream", methods=["GET"])
+@cross_origin()
+def stream_game_state():
+    """
+    Stream a player's state as Server-Sent Events.
+
+    Query parameters:
+        player_id: the player's unique ID
+        event_cursor: (optional) only events after this one are sent in the first event
+        format: (optional) how cards are written, see wire.py
+
+    Each event's data is the same JSON /game_state would return, sent once on
+    connect and again every time the player's game (or the waiting room, before
+    they are in a game) changes.  The stream ends when the player quits.
+    """
+    player_id = request.args.get("player_id", "")
+    event_cursor = request.args.get("event_cursor", 0, type=int)
+    card_format = request.args.get("format", "verbose")
+    if card_format not in FORMATS:
+        return jsonify({ "success": False, "message": f"Unknown format: {card_format}" }), 400
+    if get_human(player_id) is None:
+        return jsonify({ "success": False, "message": f"Invalid player_id: {player_id}" }), 400
+
+    def events():
+        nonlocal event_cursor
+        marker = None
+        while check_in(player_id) is not None:
+            current = state_marker(player_id)
+            if current != marker:
+                marker = current
+                payload, event_cursor = stream_payload(player_id, marker, event_cursor, card_format)
+                yield f"data: {payload}\n\n"
+            elif not wait_for_update(player_id, marker, STREAM_KEEPALIVE_SECONDS):
+                yield ": keepalive\n\n"
+
+    return Response(events(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 
 
+@app.route("/hint", methods=["POST"])
+@cross_origin()
+def get_hint():
+    """
+    Suggest the best melds a player can lay down from their hand.
+
+    Expected JSON:
+    {
+        "player_id": "unique_player_id"
+    }
+
+    Returns:
+    {
+        "success": true/false,
+        "plays": [[card, ...], ...],  (the selections to play as melds, in order, including any table cards they extend)
+        "deadwood": [card, ...],  (the cards that would be left in hand)
+        "score": 35  (the hand's score if those melds are played)
+    }
+    """
+    try:
+        data = request.get_json()
+        if not data or 'player_id' not in data:
+            return jsonify({"success": False, "message": "player_id is required"}), 400
+        player_id = data['player_id']
+        player = check_in(player_id)
+        if player is None or player.game_id is None:
+            return jsonify({"success": False, "message": "Player is not in a game"}), 400
+        with game_condition(player.game_id):
+            game = store.get_game(player.game_id)
+            if game is None:
+                return jsonify({"success": False, "message": "Player is not in a game"}), 400
+            analysis = analyze_player(game, player_id)
+            plays = [[convert_table_card(game, card) for card in play] for play in analysis.plays]
+        return jsonify({
+            "success": True,
+            "plays": plays,
+            "deadwood": [convert_card(card) for card in analysis.deadwood],
+            "score": analysis.score
+        })
+    except Exception as e:
+        count_error(e)
+        return jsonify({"success": False, "message": f"Error getting hint: {str(e)}"}), 500
+
 @app.route("/waiting-players", methods=["GET"])
 def get_waiting_players():
     """Get list of players waiting for a game."""
     return jsonify({
         "success": True,
-        "waiting_players": waiting_players
+        "waiting_players": waiting_room()
     })
 
 @app.route("/game", methods=["POST"])
@@ -244,33 +782,175 @@ def game_move():
         if not data or 'game_id' not in data or 'player_id' not in data or 'move' not in data:
             return jsonify({"success": False, "message": "game_id, player_id, and move are required"}), 400
         game_id = data['game_id']
-        game = active_games[game_id]
-        if game is None:
-            return jsonify({"success": False, "message": "Game not found"}), 400
         player_id = data['player_id']
         move = data['move']
-        if move == "draw-stack":
-            game.draw_from_stack(player_id)
-        elif move == "draw-discard":
-            card = convert_card_back(data['data']['card'])
-            game.draw_from_discard(player_id, card)
-        elif move == "play-meld":
-            cards = [convert_card_back(card) for card in data['data']['cards']]
-            game.play_meld(player_id, cards)
-        elif move == "discard":
-            card = convert_card_back(data['data']['card'])
-            game.discard_card(player_id, card)
-        elif move == "sort":
-            game.sort_hand(player_id)
-        # for player_id in game.player_ids:
-        #     game_state = get_game_for_player(game_id, player_id)
-        #     socketio.emit('game_updated', {
-        #         'success': True,
-        #         'game_state': get_game_for_player(game_id, player_id)
-        #     }, room=player_connections[player_id])
-        return jsonify({"success": True, "game_state": get_game_for_player(game_id, player_id)}), 200
+        event_cursor = data.get('event_cursor', 0)
+        try:
+            card_format, binary = response_encoding(data)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        return client_move(game_id, player_id, move, client_move_data(move, data.get('data')), event_cursor, card_format, binary)
+    except StoreConflict as e:
+        return jsonify({"success": False, "message": f"Game is busy, try again: {str(e)}"}), 409
+    except InvalidCard as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        count_error(e)
+        return jsonify({"success": False, "message": f"Error handling game move: {str(e)}"}), 500
+
+@app.route("/turn", methods=["POST"])
+@cross_origin()
+def game_turn():
+    """
+    Make several moves of a player's turn at once: all of them, or none if any can't be made.
+
+    Expected JSON:
+    {
+        "game_id": "unique_game_id",
+        "player_id": "unique_player_id",
+        "moves": [
+            {"move": "draw-discard", "data": {"card": card}},
+            {"move": "play-meld", "data": {"cards": [card, ...]}},
+            {"move": "discard", "data": {"card": card}}
+        ],  (in order; each as /game takes it, one of draw-stack, draw-discard, play-meld, discard and sort)
+        "event_cursor": 40,  (optional)
+        "format": "compact"  (optional)
+    }
+
+    Returns the game state after the moves, like /game.  If a move can't be
+    made (including one made out of turn), nothing is, and the answer is a 400
+    with "failed_move", the index of that move.
+    """
+    try:
+        data = request.get_json()
+        if not data or 'game_id' not in data or 'player_id' not in data or not isinstance(data.get('moves'), list):
+            return jsonify({"success": False, "message": "game_id, player_id, and a list of moves are required"}), 400
+        try:
+            card_format, binary = response_encoding(data)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        moves = []
+        for index, move in enumerate(data['moves']):
+            kind = move.get('move') if isinstance(move, dict) else None
+            if kind not in TURN_KINDS:
+                return jsonify({"success": False, "message": f"Move {index + 1} is not a move a turn can have", "failed_move": index}), 400
+            try:
+                moves.append([kind, client_move_data(kind, move.get('data'))])
+            except InvalidCard as e:
+                return jsonify({"success": False, "message": f"Move {index + 1}: {str(e)}", "failed_move": index}), 400
+            except (KeyError, TypeError):
+                return jsonify({"success": False, "message": f"Move {index + 1} is missing its cards", "failed_move": index}), 400
+        return client_move(data['game_id'], data['player_id'], "turn", moves, data.get('event_cursor', 0), card_format, binary)
+    except IllegalMove as e:
+        return jsonify({"success": False, "message": str(e), "failed_move": e.index}), 400
+    except StoreConflict as e:
+        return jsonify({"success": False, "message": f"Game is busy, try again: {str(e)}"}), 409
     except Exception as e:
-        return jsonify({"success": False, "message": f"Error handling game move: {str(e)}"}), 
+        count_error(e)
+        return jsonify({"success": False, "message": f"Error handling turn: {str(e)}"}), 500
+
+def client_move_data(move: str, data: Optional[Dict]) -> Any:
+    """
+    The data a move takes (see moves.py), from what a client sent with it.
+
+    Raises:
+        InvalidCard: If a card in it doesn't exist
+    """
+    if move in ("draw-discard", "discard"):
+        return parse_card(data['card']).id
+    elif move == "play-meld":
+        return [parse_card(card).id for card in data['cards']]
+    return None
+
+def client_move(game_id: str, player_id: str, move: str, move_data: Any, event_cursor: int, card_format: str, binary: bool) -> Response:
+    """Make a client's move, waking everyone watching the game, and answer with the player's state after it."""
+    condition = game_condition(game_id)
+    with condition, move_seconds.time(move if move in KINDS else "other"):
+        game = store.make_move(game_id, player_id, move, move_data)
+        if game is None:
+            game_updates.pop(game_id, None)
+            return make_response(jsonify({"success": False, "message": "Game not found"}), 400)
+        condition.notify_all()
+        notify_listeners(game_id)
+        store.touch_player(player_id, time.time())
+        body, _ = game_state_body(game_id, player_id, event_cursor, card_format, binary, game)
+    schedule_bot_turn(game_id)
+    return Response(body, 200, mimetype=MSGPACK if binary else "application/json")
+
+def remove_human(player_id: str) -> None:
+    """
+    Take a player out of the server, as when they quit.
+
+    A bot takes over their seat if other people are still playing; otherwise
+    the game goes too.
+    """
+    player = get_human(player_id)
+    if player is None:
+        return
+    if player.game_id is None:
+        # Remove players from waiting list
+        matchmaker.remove(player_id)
+        store.remove_player(player_id)
+        notify_lobby_updated()
+        return
+    game_id = player.game_id
+    condition = game_condition(game_id)
+    with condition:
+        game = store.make_move(game_id, player_id, "left")
+        others = [store.get_player(pid) for pid in game.player_ids if pid != player_id] if game is not None else []
+        abandoned = not any(other is not None and other.bot is None for other in others)
+        if not abandoned:
+            # A bot takes over the seat so the others can play on
+            player.bot = app.config["BOT_TAKEOVER_DIFFICULTY"]
+            store.save_player(player)
+            condition.notify_all()
+            notify_listeners(game_id)
+        else:
+            drop_game(game_id)
+    if not abandoned:
+        schedule_bot_turn(game_id)
+
+def drop_game(game_id: str) -> None:
+    """Forget a game and everyone seated at it, waking anyone waiting on it."""
+    condition = game_condition(game_id)
+    with condition:
+        game = store.get_game(game_id)
+        store.remove_game(game_id)
+        game_updates.pop(game_id, None)
+        public_states.pop(game_id, None)
+        if game is not None:
+            game.event_log.close()
+        condition.notify_all()
+        notify_listeners(game_id)
+    if app.config["ARCHIVE"] and game is not None and game.recording:
+        archive(app.config["ARCHIVE"], Recording.of(game))
+
+def reap(now: float) -> None:
+    """
+    Remove players who have gone quiet (as if they had quit), and games that
+    are idle, long finished or over the cap; in the shared store, also pick
+    up bot turns no worker process is working out any more.
+    """
+    for player_id in store.idle_players(now - app.config["PLAYER_TTL_SECONDS"]):
+        remove_human(player_id)
+    games = store.games_by_activity()
+    excess = len(games) - app.config["MAX_GAMES"]
+    for position, (game_id, last_active, finished) in enumerate(games):
+        idle = now - last_active
+        if position < excess or idle > app.config["GAME_TTL_SECONDS"] or (finished and idle > app.config["FINISHED_GAME_TTL_SECONDS"]):
+            drop_game(game_id)
+        elif store.shared and not finished and game_id not in bot_turns:
+            schedule_bot_turn(game_id)  # in case the worker process that claimed its bot turn stopped before making it
+
+def reap_forever() -> None:
+    """Reaper thread: look for idle players and games every REAP_INTERVAL_SECONDS."""
+    while True:
+        time.sleep(app.config["REAP_INTERVAL_SECONDS"])
+        try:
+            reap(time.time())
+        except Exception as e:
+            count_error(e, "reaper")
+            print(f"Error removing idle players and games: {str(e)}")
 
 @app.route("/quit", methods=["POST"])
 @cross_origin()
@@ -285,22 +965,17 @@ def quit():
         
         if not data or 'player_id' not in data:
             return '', 204
-        player_id = data['player_id']
-        if player_id in player_names:
-            if player_id in player_games:
-                # destroy game
-                game_id = player_games[player_id]
-                game = active_games[game_id]
-                game.event_log.append(f"{player_names[player_id]} left the game.")
-                game.num_players -= 1
-                if (game.num_players == 0):
-                    active_games.pop(game_id)
-                player_games.pop(player_id)
-            else:
-                # Remove players from waiting list
-                waiting_players[:] = [p for p in waiting_players if p['id'] != player_id]
-            player_names.pop(player_id)
+        remove_human(data['player_id'])
     except Exception as e:
+        count_error(e)
         print(f"Exception: {str(e)}")
     finally:
         return '', 204
+
+# Pick up bot turns in games brought back from the database (each by whichever worker process claims it first)
+for saved_game_id in store.game_ids():
+    schedule_bot_turn(saved_game_id)
+
+threading.Thread(target=reap_forever, name="rummy-reaper", daemon=True).start()
+if app.config["MATCHMAKING"]:
+    threading.Thread(target=match_forever, name="rummy-matchmaker", daemon=True).start()
@@ -0,0 +1,258 @@
+"""
+The server as an ASGI application, for running under an asyncio server:
+
+    uvicorn asgi:application --workers 1
+
+It serves the same routes as app.py.  Clients holding a long-poll or a
+stream open wait on the event loop, costing a coroutine each instead of a
+thread each; everything else (and the response a long-poll finally gets)
+runs the Flask views in a thread pool, so the two entry points behave alike.
+"""
+import asyncio
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs
+
+import app as server
+
+# Threads running Flask views; none of them ever waits on a client
+views = ThreadPoolExecutor(max_workers=32, thread_name_prefix="rummy-view")
+
+
+class UpdateHub:
+    """
+    Wakes coroutines waiting on a game (or the waiting room) when it changes.
+
+    The server announces changes through app.update_listeners, from whichever
+    thread made them; the hub passes them to the event loop.
+    """
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.waiters: Dict[str, Set[asyncio.Event]] = {}
+
+    def attach(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self.loop is None:
+            self.loop = loop
+            server.update_listeners.append(self.changed)
+
+    def changed(self, key: str) -> None:
+        """Called from any thread when the game with ID key (or "lobby") changes."""
+        if key in self.waiters:
+            self.loop.call_soon_threadsafe(self._wake, key)
+
+    def _wake(self, key: str) -> None:
+        for event in self.waiters.get(key, ()):
+            event.set()
+
+    def register(self, key: str) -> asyncio.Event:
+        event = asyncio.Event()
+        self.waiters.setdefault(key, set()).add(event)
+        return event
+
+    def unregister(self, key: str, event: asyncio.Event) -> None:
+        waiters = self.waiters.get(key)
+        if waiters is not None:
+            waiters.discard(event)
+            if not waiters:
+                del self.waiters[key]
+
+
+hub = UpdateHub()
+
+
+async def in_thread(function: Callable, *args):
+    """Run blocking server code (the store, game locks) off the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(views, function, *args)
+
+
+async def wait_for_update(player_id: str, marker: Tuple[str, Optional[int]], timeout: float) -> bool:
+    """
+    Wait until what the player sees differs from marker, or until timeout passes; app.wait_for_update for coroutines.
+
+    Returns:
+        True if the state changed, False on timeout
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    poll = server.app.config["STORE_POLL_SECONDS"] if server.store.shared else None
+    def changed() -> bool:
+        return server.get_human(player_id) is None or server.state_marker(player_id) != marker
+    while True:
+        # Registered before checking, so a change between the check and the wait isn't missed
+        key = marker[0]
+        event = hub.register(key)
+        try:
+            if await in_thread(changed):
+                return True
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, poll) if poll else remaining)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            hub.unregister(key, event)
+
+
+def wsgi_environ(scope: Dict, body: bytes) -> Dict:
+    """The WSGI environ for an ASGI HTTP request."""
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def call_flask(scope: Dict, body: bytes) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    """Run a request through the Flask app; returns the status, headers and body."""
+    started = {}
+    def start_response(status: str, headers: List[Tuple[str, str]], exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+    result = server.app.wsgi_app(wsgi_environ(scope, body), start_response)
+    try:
+        content = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return started["status"], started["headers"], content
+
+
+async def send_flask(scope: Dict, body: bytes, send: Callable) -> None:
+    status, headers, content = await in_thread(call_flask, scope, body)
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
+
+
+async def read_body(receive: Callable) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return body
+
+
+async def game_state(scope: Dict, receive: Callable, send: Callable) -> None:
+    """
+    POST /game_state: long-polls wait here, then Flask answers without waiting.
+    """
+    body = await read_body(receive)
+    try:
+        data = json.loads(body)
+        wait = min(float(data.get("wait") or 0), server.MAX_WAIT_SECONDS)
+    except (ValueError, TypeError, AttributeError):
+        data, wait = None, 0
+    if wait > 0:
+        player = await in_thread(server.get_human, data.get("player_id"))
+        if player is not None:
+            await wait_for_update(player.player_id, server.client_marker(player, data), wait)
+        data["wait"] = 0
+        body = json.dumps(data).encode()
+    await send_flask(scope, body, send)
+
+
+async def stream(scope: Dict, receive: Callable, send: Callable) -> None:
+    """GET /game_state/stream, with the same events as app.stream_game_state."""
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    player_id = query.get("player_id", [""])[0]
+    try:
+        event_cursor = int(query.get("event_cursor", ["0"])[0])
+    except ValueError:
+        event_cursor = 0
+    card_format = query.get("format", ["verbose"])[0]
+    if card_format not in server.FORMATS or await in_thread(server.get_human, player_id) is None:
+        await send_flask(scope, b"", send)  # Flask answers with the error
+        return
+
+    await send({"type": "http.response.start", "status": 200, "headers": [
+        (b"content-type", b"text/event-stream; charset=utf-8"),
+        (b"cache-control", b"no-cache"),
+        (b"x-accel-buffering", b"no"),
+        (b"access-control-allow-origin", b"*"),
+    ]})
+
+    async def events() -> None:
+        nonlocal event_cursor
+        marker = None
+        while await in_thread(server.check_in, player_id) is not None:
+            current = await in_thread(server.state_marker, player_id)
+            if current != marker:
+                marker = current
+                payload, event_cursor = await in_thread(server.stream_payload, player_id, marker, event_cursor, card_format)
+                await send({"type": "http.response.body", "body": f"data: {payload}\n\n".encode(), "more_body": True})
+            elif not await wait_for_update(player_id, marker, server.STREAM_KEEPALIVE_SECONDS):
+                await send({"type": "http.response.body", "body": b": keepalive\n\n", "more_body": True})
+
+    async def disconnected() -> None:
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    # Stop as soon as either the player leaves or the client goes away
+    tasks = [asyncio.ensure_future(events()), asyncio.ensure_future(disconnected())]
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    if tasks[0] in done:
+        tasks[0].result()
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def lifespan(receive: Callable, send: Callable) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            hub.attach(asyncio.get_running_loop())
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            views.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope: Dict, receive: Callable, send: Callable) -> None:
+    """The ASGI application."""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    hub.attach(asyncio.get_running_loop())
+    route = (scope["method"], scope["path"])
+    if route == ("POST", "/game_state"):
+        await game_state(scope, receive, send)
+    elif route == ("GET", "/game_state/stream"):
+        await stream(scope, receive, send)
+    else:
+        await send_flask(scope, await read_body(receive), send)
@@ -0,0 +1,211 @@
+"""
+Benchmarks for the game engine and the HTTP hot paths.
+
+Every case is built from seeded inputs, so two runs (say, before and after a
+change) time the same work.  Results are written as JSON:
+
+    python benchmarks.py --out before.json
+    python benchmarks.py --out after.json --filter engine.
+
+Run from the backend folder.  The http.* cases need Flask.
+"""
+import argparse
+import copy
+import json
+import platform
+import random
+import statistics
+import time
+from typing import Callable, Dict, List, Optional
+
+from bots import GreedyStrategy, take_turn
+from rummy import CARDS, RummyGame, cards_in, forms_meld, MELDS
+
+PLAYER_IDS = ["p1", "p2", "p3", "p4"]
+PLAYER_NAMES = ["Ann", "Bob", "Cy", "Di"]
+
+
+def measure(run: Callable[[object], object], setup: Optional[Callable[[], object]] = None,
+            number: int = 1000, repeat: int = 5) -> Dict[str, float]:
+    """
+    Time a case.
+
+    Args:
+        run: The work being timed; called with whatever setup returned
+        setup: Builds a fresh input for each call, outside the timing
+        number: Calls per repeat
+        repeat: Repeats; the summary is over the per-call time of each repeat
+
+    Returns:
+        Per-call microseconds (min, median, mean over repeats) and calls per second
+    """
+    per_call = []
+    for _ in range(repeat):
+        if setup is None:
+            started = time.perf_counter()
+            for _ in range(number):
+                run(None)
+            elapsed = time.perf_counter() - started
+        else:
+            elapsed = 0.0
+            for _ in range(number):
+                arg = setup()
+                started = time.perf_counter()
+                run(arg)
+                elapsed += time.perf_counter() - started
+        per_call.append(elapsed / number * 1e6)
+    return {
+        "number": number,
+        "repeat": repeat,
+        "min_us": round(min(per_call), 3),
+        "median_us": round(statistics.median(per_call), 3),
+        "mean_us": round(statistics.mean(per_call), 3),
+        "ops_per_second": round(1e6 / min(per_call), 1),
+    }
+
+
+def new_game(seed: int, players: int = 4) -> RummyGame:
+    """A freshly dealt game from a fixed seed."""
+    return RummyGame(players, PLAYER_NAMES[:players], PLAYER_IDS[:players], seed=seed)
+
+
+def crowded_game(seed: int) -> RummyGame:
+    """A four-player game played by greedy bots until the table is full of melds."""
+    game = new_game(seed)
+    rng = random.Random(seed)
+    strategy = GreedyStrategy()
+    while sum(len(melds) for melds in game.players_melds.values()) < 8:
+        round_number = game.round
+        take_turn(game, strategy, rng)
+        if game.round != round_number:
+            game = new_game(rng.getrandbits(32))
+    return game
+
+
+def deep_discard_game(seed: int, depth: int = 30) -> RummyGame:
+    """A two-player game whose discard pile is depth cards deep."""
+    game = new_game(seed, players=2)
+    while len(game.discard_pile) < depth and game.stack:
+        game.discard_pile.append(game.stack.pop())
+    game._index_cards()
+    return game
+
+
+def engine_cases(seed: int, scale: float) -> Dict[str, Callable[[], Dict[str, float]]]:
+    rng = random.Random(seed)
+    melds = list(MELDS)
+    selections: List[list] = []
+    for _ in range(200):
+        if rng.random() < 0.5:
+            selections.append(cards_in(rng.choice(melds)))
+        else:
+            selections.append(rng.sample(CARDS, rng.randint(3, 6)))
+    selection_cycle = iter(lambda: selections[rng.randrange(len(selections))], None)
+
+    crowded = crowded_game(seed)
+    player_id = crowded.get_current_player()
+    crowded.current_player_has_drawn = True
+    extension = None
+    for mask in MELDS:
+        table = crowded.set_mask | crowded.run_mask
+        hand = crowded.hand_masks[player_id]
+        if mask & hand and mask & table and not mask & ~(hand | table):
+            extension = cards_in(mask)
+            break
+    hand_meld = next((cards_in(mask) for mask in MELDS if mask & crowded.hand_masks[player_id] == mask), None)
+    crowded_play = extension or hand_meld or crowded.players_hands[player_id][:3]
+
+    deep = deep_discard_game(seed)
+    deep_player = deep.get_current_player()
+
+    ending = new_game(seed)
+
+    def full_game(arg) -> None:
+        game = new_game(rng.getrandbits(32), players=2)
+        strategy = GreedyStrategy()
+        turns = 0
+        while game.winner is None and turns < 2000:
+            take_turn(game, strategy, rng)
+            turns += 1
+
+    n = lambda count: max(1, int(count * scale))
+    return {
+        "engine.forms_meld": lambda: measure(lambda arg: forms_meld(list(next(selection_cycle))), number=n(20000)),
+        "engine.play_meld_crowded_table": lambda: measure(
+            lambda game: game.play_meld(player_id, list(crowded_play)), lambda: copy.deepcopy(crowded), number=n(500)),
+        "engine.draw_from_discard_deep": lambda: measure(
+            lambda game: game.draw_from_discard(deep_player, game.discard_pile[0]), lambda: copy.deepcopy(deep), number=n(500)),
+        "engine.end_game_redeal": lambda: measure(lambda game: game._end_game(), lambda: copy.deepcopy(ending), number=n(500)),
+        "engine.full_game_greedy": lambda: measure(full_game, number=n(3), repeat=3),
+    }
+
+
+def http_cases(seed: int, scale: float) -> Dict[str, Callable[[], Dict[str, float]]]:
+    import app as server
+
+    random.seed(seed)
+    client = server.app.test_client()
+    ids = [client.post("/join", json={"name": name}).get_json()["player_id"] for name in PLAYER_NAMES]
+    client.post("/start-game", json={"player_names": PLAYER_NAMES})
+    game_id = server.store.get_player(ids[0]).game_id
+    viewer = ids[1]
+
+    def move(arg) -> None:
+        # Alternate draw and discard so the game keeps moving
+        game = server.store.get_game(game_id)
+        player_id = game.get_current_player()
+        if not game.current_player_has_drawn:
+            client.post("/game", json={"game_id": game_id, "player_id": player_id, "move": "draw-stack"})
+        else:
+            card = game.players_hands[player_id][0]
+            client.post("/game", json={"game_id": game_id, "player_id": player_id, "move": "discard",
+                                       "data": {"card": {"suit": card.suit.value, "rank": card.rank.value, "meld_type": "NONE"}}})
+        if not game.stack:
+            server.store.get_game(game_id)._end_game()
+
+    n = lambda count: max(1, int(count * scale))
+    return {
+        "http.game_state_body": lambda: measure(lambda arg: server.game_state_body(game_id, viewer), number=n(5000)),
+        "http.game_state_body_compact": lambda: measure(lambda arg: server.game_state_body(game_id, viewer, 0, "compact"), number=n(5000)),
+        "http.game_state": lambda: measure(lambda arg: client.post("/game_state", json={"player_id": viewer}), number=n(2000)),
+        "http.game_state_not_modified": lambda: measure(
+            lambda arg: client.post("/game_state", json={"player_id": viewer, "version": server.store.game_version(game_id)}), number=n(2000)),
+        "http.game_move": lambda: measure(move, number=n(2000)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the rummy engine and server")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every case's iteration count")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--out", help="write the JSON report here instead of to stdout")
+    args = parser.parse_args()
+
+    cases = engine_cases(args.seed, args.scale)
+    try:
+        cases.update(http_cases(args.seed, args.scale))
+    except ImportError as e:
+        print(f"Skipping HTTP cases: {str(e)}")
+
+    results = {}
+    for name, case in cases.items():
+        if args.filter in name:
+            results[name] = case()
+            print(f"{name:40} {results[name]['median_us']:>12.1f} us")
+    report = {
+        "seed": args.seed,
+        "scale": args.scale,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Computer opponents.
+
+A bot sees only what its seat could see (a PlayerView) and hands each
+decision to a Strategy.  Decisions are plain functions of the view, so the
+server can work them out in a process pool and apply them to the real game
+once they come back.
+"""
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+from analysis import analyze_hand, hand_score
+from rummy import ACE_MASK, CARDS, Card, MeldType, RummyGame, card_from_id, card_points, cards_in, classify_meld, mask_of
+
+FULL_DECK = (1 << len(CARDS)) - 1
+
+# A draw decision is the discard pile card to draw from (None for the stack);
+# a play decision is the melds to lay down, as card ids, and the card to discard.
+Decision = Union[Optional[int], Tuple[List[List[int]], Optional[int]]]
+
+
+@dataclass(frozen=True)
+class PlayerView:
+    """Everything one seat can see of a game."""
+    hand: Tuple[Card, ...]
+    discard_pile: Tuple[Card, ...]
+    set_mask: int
+    run_mask: int
+    high_ace_mask: int
+    stack_size: int
+
+    @property
+    def hand_mask(self) -> int:
+        return mask_of(self.hand)
+
+    @property
+    def unseen_mask(self) -> int:
+        """Cards this seat can't see: the stack and the other hands."""
+        return FULL_DECK & ~(self.hand_mask | mask_of(self.discard_pile) | self.set_mask | self.run_mask)
+
+    def score(self, hand_mask: int) -> int:
+        """What a hand would score against this table if its best melds were laid down."""
+        return hand_score(hand_mask, self.set_mask, self.run_mask, self.high_ace_mask)
+
+    def best_after_discard(self, hand_mask: int) -> int:
+        """The score of a hand once its least useful card is discarded."""
+        if hand_mask.bit_count() <= 1:
+            return 0
+        return max(self.score(hand_mask & ~card.mask) for card in cards_in(hand_mask))
+
+
+def view_for(game: RummyGame, player_id: str) -> PlayerView:
+    """What the given player can see of a game."""
+    return PlayerView(
+        tuple(game.players_hands[player_id]),
+        tuple(game.discard_pile),
+        game.set_mask,
+        game.run_mask,
+        game.high_ace_mask,
+        len(game.stack),
+    )
+
+
+class Strategy:
+    """
+    Decides a bot's moves.
+
+    Subclasses override choose_draw and choose_discard; by default a bot lays
+    down the best melds its hand analysis finds.
+    """
+
+    def choose_draw(self, view: PlayerView, rng: random.Random) -> Optional[Card]:
+        """The discard pile card to draw from (taking every card above it), or None to draw from the stack."""
+        raise NotImplementedError
+
+    def choose_plays(self, view: PlayerView, rng: random.Random) -> List[List[Card]]:
+        """The melds to lay down, each as the cards to pass to play_meld."""
+        return analyze_hand(list(view.hand), view.set_mask, view.run_mask, view.high_ace_mask).plays
+
+    def choose_discard(self, view: PlayerView, rng: random.Random) -> Card:
+        """The card to discard, from a hand whose melds are already laid down."""
+        raise NotImplementedError
+
+
+class RandomStrategy(Strategy):
+    """Draws from the stack and discards at random; a floor for comparing other strategies."""
+
+    def choose_draw(self, view: PlayerView, rng: random.Random) -> Optional[Card]:
+        if view.stack_size == 0:
+            return view.discard_pile[-1]
+        return None
+
+    def choose_discard(self, view: PlayerView, rng: random.Random) -> Card:
+        return rng.choice(view.hand)
+
+
+class GreedyStrategy(Strategy):
+    """Looks one move ahead: takes whatever improves the hand most now, and throws away what helps it least."""
+
+    def choose_draw(self, view: PlayerView, rng: random.Random) -> Optional[Card]:
+        hand_mask = view.hand_mask
+        best_card, best_value = None, view.best_after_discard(hand_mask)
+        if view.stack_size == 0:
+            best_card, best_value = view.discard_pile[-1], None
+        for depth in range(len(view.discard_pile)):
+            value = view.best_after_discard(hand_mask | mask_of(view.discard_pile[depth:]))
+            if best_value is None or value > best_value:
+                best_card, best_value = view.discard_pile[depth], value
+        return best_card
+
+    def choose_discard(self, view: PlayerView, rng: random.Random) -> Card:
+        hand_mask = view.hand_mask
+        return max(view.hand, key=lambda card: (view.score(hand_mask & ~card.mask), card_points(card), rng.random()))
+
+
+class MonteCarloStrategy(Strategy):
+    """
+    Determinized Monte Carlo search within a time budget.
+
+    Drawing from the stack, and every discard, is judged by dealing the
+    unseen cards at random and averaging how well the hand does with the
+    card that comes next.  Sampling continues until the budget is spent.
+    """
+
+    def __init__(self, budget: float = 0.5, mistake_rate: float = 0.0, min_samples: int = 4):
+        """
+        Args:
+            budget: Seconds to spend on each decision
+            mistake_rate: Chance of making a random choice instead, for easier bots
+            min_samples: Samples per option taken even if the budget runs out
+        """
+        self.budget = budget
+        self.mistake_rate = mistake_rate
+        self.min_samples = min_samples
+
+    def choose_draw(self, view: PlayerView, rng: random.Random) -> Optional[Card]:
+        hand_mask = view.hand_mask
+        options: List[Optional[Card]] = list(view.discard_pile)
+        if view.stack_size > 0:
+            options.append(None)
+        if rng.random() < self.mistake_rate:
+            return rng.choice([None, view.discard_pile[-1]] if view.stack_size > 0 else [view.discard_pile[-1]])
+        values: Dict[Optional[Card], float] = {}
+        for depth, card in enumerate(view.discard_pile):
+            values[card] = view.best_after_discard(hand_mask | mask_of(view.discard_pile[depth:]))
+        if view.stack_size > 0:
+            unseen = cards_in(view.unseen_mask)
+            values[None] = self._sample(lambda: view.best_after_discard(hand_mask | rng.choice(unseen).mask))
+        return max(options, key=lambda option: values[option])
+
+    def choose_discard(self, view: PlayerView, rng: random.Random) -> Card:
+        hand_mask = view.hand_mask
+        if rng.random() < self.mistake_rate or len(view.hand) == 1:
+            return rng.choice(view.hand)
+        unseen = cards_in(view.unseen_mask)
+        totals = {card: 0.0 for card in view.hand}
+        samples = 0
+        deadline = time.perf_counter() + self.budget
+        while samples < self.min_samples or (time.perf_counter() < deadline and samples < len(unseen)):
+            # The same next card for every candidate, so they are compared on equal terms
+            drawn = rng.choice(unseen).mask if unseen else 0
+            for card in view.hand:
+                kept = hand_mask & ~card.mask
+                totals[card] += max(view.score(kept), view.best_after_discard(kept | drawn))
+            samples += 1
+        return max(view.hand, key=lambda card: (totals[card], card_points(card)))
+
+    def _sample(self, value) -> float:
+        """Average value over as many samples as the budget allows."""
+        total, samples = 0.0, 0
+        deadline = time.perf_counter() + self.budget / 2
+        while samples < self.min_samples or time.perf_counter() < deadline:
+            total += value()
+            samples += 1
+        return total / samples
+
+
+def make_strategy(difficulty: str, budget: float) -> Strategy:
+    """
+    The strategy for a difficulty level.
+
+    Args:
+        difficulty: "easy", "medium" or "hard"
+        budget: Seconds the bot may think per decision
+    """
+    mistake_rates = {"easy": 0.3, "medium": 0.05, "hard": 0.0}
+    return MonteCarloStrategy(budget, mistake_rates.get(difficulty, 0.0))
+
+
+def decide(strategy: Strategy, view: PlayerView, phase: str, seed: Optional[int] = None) -> Decision:
+    """
+    Work out one step of a bot's turn; runs in a worker process.
+
+    Args:
+        strategy: The bot's strategy
+        view: What the bot can see
+        phase: "draw" to choose where to draw from, "play" to choose melds and a discard
+        seed: Seed for the strategy's random choices
+
+    Returns:
+        For "draw", the id of the discard pile card to draw from, or None for the stack.
+        For "play", the melds as lists of card ids, and the id of the card to discard
+        (None if the melds use up the hand).
+    """
+    rng = random.Random(seed)
+    if phase == "draw":
+        card = strategy.choose_draw(view, rng)
+        return card.id if card is not None else None
+    plays = strategy.choose_plays(view, rng)
+    after_melds = _after_plays(view, plays)
+    if not after_melds.hand:
+        return [[card.id for card in play] for play in plays], None
+    discard = strategy.choose_discard(after_melds, rng)
+    return [[card.id for card in play] for play in plays], discard.id
+
+
+def _after_plays(view: PlayerView, plays: List[List[Card]]) -> PlayerView:
+    """What the seat will see once the given melds are laid down."""
+    hand_mask, set_mask, run_mask, high_ace_mask = view.hand_mask, view.set_mask, view.run_mask, view.high_ace_mask
+    for play in plays:
+        mask = mask_of(play)
+        meld_type, ace_high = classify_meld(mask, set_mask, run_mask, high_ace_mask)
+        new = mask & hand_mask
+        if meld_type == MeldType.SET:
+            set_mask |= new
+        elif meld_type == MeldType.RUN:
+            run_mask |= new
+        else:
+            continue
+        if ace_high:
+            high_ace_mask |= new & ACE_MASK
+        hand_mask &= ~new
+    hand = tuple(card for card in view.hand if card.mask & hand_mask)
+    return PlayerView(hand, view.discard_pile, set_mask, run_mask, high_ace_mask, view.stack_size)
+
+
+def apply_decision(game: RummyGame, player_id: str, phase: str, decision: Decision) -> None:
+    """Make the moves a decision calls for."""
+    if phase == "draw":
+        if decision is None and game.stack:
+            game.draw_from_stack(player_id)
+        elif game.discard_pile:
+            card = card_from_id(decision) if decision is not None else game.discard_pile[-1]
+            game.draw_from_discard(player_id, card)
+        return
+    plays, discard = decision
+    round_number = game.round
+    for play in plays:
+        game.play_meld(player_id, [card_from_id(card_id) for card_id in play])
+        if game.round != round_number or game.winner is not None:
+            return  # went out
+    if discard is not None and game.players_hands[player_id]:
+        card = card_from_id(discard)
+        if card not in game.players_hands[player_id]:
+            card = game.players_hands[player_id][-1]
+        game.discard_card(player_id, card)
+
+
+def take_turn(game: RummyGame, strategy: Strategy, rng: Optional[random.Random] = None) -> None:
+    """Play the current player's whole turn in-process, for headless games."""
+    rng = rng or random.Random()
+    player_id = game.get_current_player()
+    for phase in ("draw", "play"):
+        decision = decide(strategy, view_for(game, player_id), phase, rng.getrandbits(32))
+        apply_decision(game, player_id, phase, decision)
@@ -0,0 +1,171 @@
+import json
+import os
+import tempfile
+import weakref
+from collections import deque
+from enum import Enum
+from itertools import islice
+from typing import Callable, Deque, List, NamedTuple, Optional, Tuple
+
+
+class EventType(Enum):
+    """Kinds of things that can happen in a game."""
+    DREW_STACK = 1
+    DREW_DISCARD = 2
+    ALREADY_DREW_STACK = 3
+    ALREADY_DREW_DISCARD = 4
+    INVALID_MELD = 5
+    PLAYED_MELD = 6
+    ADDED_TO_MELD = 7
+    DISCARD_BEFORE_DRAW = 8
+    DISCARDED = 9
+    OUT_OF_CARDS = 10
+    ROUND_SCORE = 11
+    WON = 12
+    PLAY_CONTINUES = 13
+    LEFT = 14
+
+
+class Event(NamedTuple):
+    """
+    A single game event, kept compact so long games stay cheap to hold.
+
+    The human-readable text is rendered only when a client asks for it
+    (see RummyGame.describe_event).
+    """
+    seq: int  # 1-based position in the game's log; doubles as the paging cursor
+    kind: EventType
+    actor: Optional[int]  # index of the player involved, if any
+    cards: Tuple[int, ...]  # card ids involved, if any
+    round: int
+    values: Tuple[int, ...]  # kind-specific numbers (meld type, points, ...)
+
+
+class EventLog:
+    """
+    Append-only event log holding only the most recent events in memory.
+
+    Once more than `capacity` events are held, the oldest half is spilled to a
+    temporary JSON-lines file, which is read back only when a client asks for
+    events older than those still in memory.
+    """
+
+    def __init__(self, capacity: int = 256, spill_dir: Optional[str] = None):
+        """
+        Args:
+            capacity: Number of events kept in memory
+            spill_dir: Directory for the spill file (defaults to the system temp dir)
+        """
+        self.capacity = max(capacity, 2)
+        self.spill_dir = spill_dir
+        self.recent: Deque[Event] = deque()
+        self.spilled = 0  # number of events no longer in memory
+        self.dropped = 0  # of those, how many were left behind by restore and are in no spill file
+        # Reads back events left behind by restore, if they are kept somewhere: (cursor, end) -> events with cursor < seq <= end
+        self.load_dropped: Optional[Callable[[int, int], List[Event]]] = None
+        self.spill_path: Optional[str] = None
+        self._finalizer = None
+
+    def append(self, kind: EventType, actor: Optional[int] = None, cards: Tuple[int, ...] = (),
+               round: int = 0, values: Tuple[int, ...] = ()) -> Event:
+        """Record an event and return it."""
+        event = Event(self.cursor + 1, kind, actor, tuple(cards), round, tuple(values))
+        self.recent.append(event)
+        if len(self.recent) > self.capacity:
+            self._spill(len(self.recent) // 2)
+        return event
+
+    @property
+    def cursor(self) -> int:
+        """Sequence number of the latest event (0 if there are none)."""
+        return self.recent[-1].seq if self.recent else self.spilled
+
+    def __len__(self) -> int:
+        return self.cursor
+
+    def since(self, cursor: int = 0) -> List[Event]:
+        """
+        Get every event after the given cursor, oldest first.
+
+        Args:
+            cursor: Sequence number of the last event the caller already has
+
+        Returns:
+            List of events with seq > cursor
+        """
+        cursor = max(cursor, 0)
+        events: List[Event] = []
+        if cursor < self.spilled:
+            events.extend(self._read_spilled(cursor))
+            cursor = self.spilled
+        first = self.recent[0].seq if self.recent else cursor + 1
+        events.extend(islice(self.recent, max(cursor + 1 - first, 0), None))
+        return events
+
+    def snapshot(self) -> List:
+        """The events held in memory, as JSON-ready data for restore."""
+        return [self.spilled, [pack_event(event) for event in self.recent]]
+
+    @classmethod
+    def restore(cls, data: List, capacity: int = 256, spill_dir: Optional[str] = None) -> "EventLog":
+        """
+        Rebuild a log from a snapshot.
+
+        Events that had been spilled are not brought back, so since() starts
+        at the first event the snapshot held (unless load_dropped is set to
+        read them from wherever they are kept), but sequence numbers carry
+        on from where the old log left off.
+        """
+        spilled, rows = data
+        log = cls(capacity, spill_dir)
+        log.spilled = log.dropped = spilled
+        for seq, row in enumerate(rows, start=spilled + 1):
+            log.recent.append(unpack_event(seq, row))
+        return log
+
+    def close(self) -> None:
+        """Delete the spill file, if any."""
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def _spill(self, count: int) -> None:
+        """Move the oldest count events from memory to the spill file."""
+        if self.spill_path is None:
+            fd, self.spill_path = tempfile.mkstemp(prefix="rummy-events-", suffix=".jsonl", dir=self.spill_dir)
+            os.close(fd)
+            self._finalizer = weakref.finalize(self, _remove_file, self.spill_path)
+        with open(self.spill_path, "a") as f:
+            for _ in range(count):
+                event = self.recent.popleft()
+                f.write(json.dumps(pack_event(event)) + "\n")
+        self.spilled += count
+
+    def _read_spilled(self, cursor: int) -> List[Event]:
+        """Read back spilled events after the given cursor (skipping those dropped by restore, unless they can be loaded)."""
+        events = []
+        if cursor < self.dropped and self.load_dropped is not None:
+            events = self.load_dropped(cursor, self.dropped)
+        cursor = max(cursor, self.dropped)
+        if cursor >= self.spilled or self.spill_path is None or not os.path.exists(self.spill_path):
+            return events
+        with open(self.spill_path) as f:  # the file starts after the dropped events
+            for seq, line in enumerate(islice(f, cursor - self.dropped, self.spilled - self.dropped), start=cursor + 1):
+                events.append(unpack_event(seq, json.loads(line)))
+        return events
+
+
+def pack_event(event: Event) -> List:
+    """An event as JSON-ready data, without its sequence number."""
+    return [event.kind.value, event.actor, event.cards, event.round, event.values]
+
+
+def unpack_event(seq: int, data: List) -> Event:
+    kind, actor, cards, round, values = data
+    return Event(seq, EventType(kind), actor, tuple(cards), round, tuple(values))
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,331 @@
+"""
+Load test: many synthetic players playing through a running server's HTTP
+API, to size hardware and to check a server change before it ships.
+
+Players come in tables.  Each joins (/join), the first at the table starts
+the game (/start-game), and then every player behaves like the web client
+polling for updates: it asks for /game_state once a second (sending the
+version and event cursor it has, as the client does) until it is its turn,
+then draws, lays down whatever melds its hand holds and discards, one /game
+request per move.  When the run's time is up every player quits (/quit).
+
+Everything runs on one asyncio event loop, one keep-alive connection per
+player, so a single machine can simulate thousands of players:
+
+    python loadtest.py --url http://127.0.0.1:5000 --players 2000 --duration 120
+
+Prints throughput, p50/p95/p99 latency and error rates per endpoint as
+JSON.  Run from the backend folder; needs nothing beyond the standard
+library and the engine's own modules.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from rummy import MELDS, Rank, Suit, card_points, cards_in, get_card
+from wire import BY_CODE, CODES
+
+ENDPOINTS = ("/join", "/start-game", "/game_state", "/game", "/quit")
+
+
+class HttpError(Exception):
+    """A response that couldn't be read."""
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection to the server, reopened when the server closes it."""
+
+    def __init__(self, host: str, port: int, timeout: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def post(self, path: str, payload: Dict) -> Tuple[int, bytes]:
+        """
+        POST JSON and read the response.
+
+        Returns:
+            The status code and the body
+        """
+        body = json.dumps(payload).encode()
+        head = (f"POST {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n").encode()
+        return await asyncio.wait_for(self._send(head + body), self.timeout)
+
+    async def _send(self, request: bytes) -> Tuple[int, bytes]:
+        reused = self.writer is not None
+        if not reused:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            self.writer.write(request)
+            await self.writer.drain()
+            return await self._read()
+        except (ConnectionError, asyncio.IncompleteReadError, HttpError):
+            self.close()
+            if not reused:
+                raise
+        # The server had closed the idle connection; try once more on a fresh one
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(request)
+        await self.writer.drain()
+        return await self._read()
+
+    async def _read(self) -> Tuple[int, bytes]:
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise HttpError("Connection closed before a response")
+        version, status = status_line.split(b" ", 2)[:2]
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        status = int(status)
+        if "content-length" in headers:
+            body = await self.reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+            body = b"".join(chunks)
+        elif status in (204, 304) or 100 <= status < 200:
+            body = b""
+        else:
+            body = await self.reader.read()
+            headers["connection"] = "close"
+        if headers.get("connection", "").lower() == "close" or version == b"HTTP/1.0":
+            self.close()
+        return status, body
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Recorder:
+    """Latencies and outcomes of every request, by endpoint."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.games_finished = 0
+        self.turns = 0
+
+    def record(self, endpoint: str, seconds: float, status: Optional[int], ok: bool) -> None:
+        self.latencies[endpoint].append(seconds)
+        if status is not None:
+            self.statuses[endpoint][status] += 1
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def report(self, elapsed: float) -> Dict:
+        def percentile(ordered: List[float], fraction: float) -> float:
+            return round(ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] * 1000, 2)
+        endpoints = {}
+        for endpoint in ENDPOINTS:
+            ordered = sorted(self.latencies.get(endpoint, ()))
+            if not ordered:
+                continue
+            endpoints[endpoint] = {
+                "requests": len(ordered),
+                "per_second": round(len(ordered) / elapsed, 1),
+                "p50_ms": percentile(ordered, 0.5),
+                "p95_ms": percentile(ordered, 0.95),
+                "p99_ms": percentile(ordered, 0.99),
+                "max_ms": round(ordered[-1] * 1000, 2),
+                "errors": self.errors[endpoint],
+                "error_rate": round(self.errors[endpoint] / len(ordered), 4),
+                "statuses": dict(sorted(self.statuses[endpoint].items())),
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            "seconds": round(elapsed, 1),
+            "requests": total,
+            "per_second": round(total / elapsed, 1),
+            "errors": sum(self.errors.values()),
+            "turns": self.turns,
+            "games_finished": self.games_finished,
+            "endpoints": endpoints,
+        }
+
+
+def read_cards(cards: Any) -> List:
+    """Cards from a state in either format: a string of compact codes, or verbose card objects."""
+    if isinstance(cards, str):
+        return [BY_CODE[cards[i:i + 2]] for i in range(0, len(cards), 2)]
+    return [get_card(Suit(card["suit"]), Rank[card["rank"]]) for card in cards]
+
+
+def hand_meld(hand_mask: int) -> int:
+    """The largest meld made only of cards in a hand (0 if none); such a meld is always legal."""
+    best = 0
+    for mask in MELDS:
+        if mask & hand_mask == mask and mask.bit_count() > best.bit_count():
+            best = mask
+    return best
+
+
+class SimulatedPlayer:
+    """A player following the web client's behaviour."""
+
+    def __init__(self, name: str, connection: Connection, recorder: Recorder, card_format: str, poll: float, counts_games: bool = False):
+        self.name = name
+        self.counts_games = counts_games  # whether this player counts the game as finished (one per table)
+        self.connection = connection
+        self.recorder = recorder
+        self.card_format = card_format
+        self.poll = poll
+        self.player_id: Optional[str] = None
+        self.state: Optional[Dict] = None  # the last game state received
+        self.lobby_version = -1
+
+    async def call(self, endpoint: str, payload: Dict) -> Optional[Dict]:
+        """Make a request, recording how it went; the answer, or None if it failed."""
+        started = time.perf_counter()
+        status = None
+        try:
+            status, body = await self.connection.post(endpoint, payload)
+            answer = json.loads(body) if body else {}
+        except (OSError, asyncio.TimeoutError, HttpError, ValueError):
+            self.connection.close()
+            self.recorder.record(endpoint, time.perf_counter() - started, status, False)
+            return None
+        ok = status < 400 and (answer.get("success", True) is not False)
+        self.recorder.record(endpoint, time.perf_counter() - started, status, ok)
+        return answer if ok else None
+
+    async def join(self) -> bool:
+        answer = await self.call("/join", {"name": self.name})
+        if answer is not None:
+            self.player_id = answer["player_id"]
+        return answer is not None
+
+    def take_state(self, answer: Optional[Dict]) -> None:
+        if answer is None:
+            return
+        if "game_state" in answer:
+            self.state = answer["game_state"]
+        elif "lobby_version" in answer:
+            self.lobby_version = answer["lobby_version"]
+
+    async def poll_state(self) -> None:
+        payload = {"player_id": self.player_id, "lobby_version": self.lobby_version, "format": self.card_format}
+        if self.state is not None:
+            payload.update(version=self.state["version"], event_cursor=self.state["eventCursor"])
+        self.take_state(await self.call("/game_state", payload))
+
+    async def move(self, move: str, data: Optional[Dict] = None) -> bool:
+        answer = await self.call("/game", {"game_id": self.state["gameID"], "player_id": self.player_id, "move": move,
+                                           "data": data or {}, "event_cursor": self.state["eventCursor"],
+                                           "format": self.card_format})
+        self.take_state(answer)
+        return answer is not None
+
+    async def take_turn(self) -> None:
+        """Draw, lay down every meld in hand, then discard the card worth most."""
+        self.recorder.turns += 1
+        discards = read_cards(self.state["discards"])
+        if self.state["stack"] or not discards:
+            drew = await self.move("draw-stack")
+        else:
+            drew = await self.move("draw-discard", {"card": CODES[discards[-1].id]})
+        while drew:
+            hand_mask = sum(card.mask for card in read_cards(self.state["hand"]))
+            meld = hand_meld(hand_mask)
+            if not meld or not await self.move("play-meld", {"cards": [CODES[card.id] for card in cards_in(meld)]}):
+                break
+            if sum(card.mask for card in read_cards(self.state["hand"])) != hand_mask & ~meld:
+                return  # that meld went out, and the next round has been dealt
+        hand = read_cards(self.state["hand"])
+        if drew and hand:
+            await self.move("discard", {"card": CODES[max(hand, key=card_points).id]})
+
+    async def play(self, deadline: float) -> None:
+        """Poll and play until the game ends or the run's time is up, then quit."""
+        while time.monotonic() < deadline:
+            await self.poll_state()
+            if self.state is not None and self.state["gameOver"]:
+                self.recorder.games_finished += self.counts_games
+                break
+            if self.state is not None and self.state["activePlayerName"] == self.name:
+                await self.take_turn()
+            else:
+                await asyncio.sleep(self.poll * random.uniform(0.9, 1.1))
+        await self.call("/quit", {"player_id": self.player_id})
+        self.connection.close()
+
+
+async def run_table(number: int, seats: int, args, recorder: Recorder, deadline: float, run_id: str) -> None:
+    """Seat a table's players, start their game and play it."""
+    host, port = args.host, args.port
+    players = [SimulatedPlayer(f"load-{run_id}-{number}-{seat}", Connection(host, port, args.timeout), recorder,
+                               args.format, args.poll, seat == 0) for seat in range(seats)]
+    if not all(await asyncio.gather(*(player.join() for player in players))):
+        return
+    if await players[0].call("/start-game", {"player_names": [player.name for player in players]}) is None:
+        return
+    await asyncio.gather(*(player.play(deadline) for player in players))
+
+
+async def run(args) -> Dict:
+    recorder = Recorder()
+    run_id = uuid.uuid4().hex[:6]
+    started = time.monotonic()
+    deadline = started + args.ramp + args.duration
+    tables = []
+    remaining = args.players
+    while remaining >= 2:
+        seats = min(args.seats, remaining) if remaining - args.seats != 1 else 2
+        tables.append(seats)
+        remaining -= seats
+    async def start(number: int, seats: int) -> None:
+        await asyncio.sleep(args.ramp * number / max(len(tables), 1))  # spread the tables' arrival over the ramp
+        await run_table(number, seats, args, recorder, deadline, run_id)
+    await asyncio.gather(*(start(number, seats) for number, seats in enumerate(tables)))
+    report = recorder.report(time.monotonic() - started)
+    report.update(players=args.players, tables=len(tables), url=args.url)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Drive a running rummy server with synthetic players")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="the server to load")
+    parser.add_argument("--players", type=int, default=100)
+    parser.add_argument("--seats", type=int, default=2, choices=(2, 3, 4), help="players per table")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to play once every table has started")
+    parser.add_argument("--ramp", type=float, default=10, help="seconds over which the tables start")
+    parser.add_argument("--poll", type=float, default=1.0, help="seconds between polls while waiting for a turn")
+    parser.add_argument("--format", default="verbose", choices=("verbose", "compact"), help="card format to ask for")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds before a request counts as failed")
+    parser.add_argument("--out", help="write the JSON report here instead of to stdout")
+    args = parser.parse_args()
+    url = urlsplit(args.url)
+    args.host, args.port = url.hostname or "127.0.0.1", url.port or 80
+
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Automatic matchmaking: players who ask to be matched are seated together
+as soon as enough of them are waiting, rather than someone starting a game
+by hand.
+
+Each player may name the table size they would like (2-4 seats) or take
+any.  A table of a given size fills from the players who asked for that
+size, oldest first, then from those who take any; a player left waiting
+longer than the relax time is treated as taking any.  Every operation
+touches only the heads of a few queues, so a large waiting room costs no
+more per join than a small one.
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+TABLE_SIZES = (2, 3, 4)
+
+
+class Matchmaker:
+    """Queues of players waiting to be matched, by the table size they want."""
+
+    def __init__(self, relax_seconds: float):
+        """
+        Args:
+            relax_seconds: How long a player waits for their preferred table size before taking any
+        """
+        self.relax_seconds = relax_seconds
+        # Preferred size (None for any) -> player ID -> when they were queued, oldest first
+        self.queues: Dict[Optional[int], "OrderedDict[str, float]"] = {size: OrderedDict() for size in (*TABLE_SIZES, None)}
+        self.preferences: Dict[str, Optional[int]] = {}  # player ID -> the queue they are in
+        self.lock = threading.Lock()
+
+    def add(self, player_id: str, seats: Optional[int], now: float) -> Optional[List[str]]:
+        """
+        Queue a player for a table.
+
+        Args:
+            player_id: The player, who should be in the waiting room
+            seats: The table size they would like, or None for any
+            now: The current time
+
+        Returns:
+            The IDs of a table's players, oldest first, if this player completed one
+        """
+        if seats is not None and seats not in TABLE_SIZES:
+            raise ValueError(f"Tables have {TABLE_SIZES[0]}-{TABLE_SIZES[-1]} seats")
+        with self.lock:
+            self._remove(player_id)
+            self.queues[seats][player_id] = now
+            self.preferences[player_id] = seats
+            return self._fill((seats,) if seats is not None else reversed(TABLE_SIZES))
+
+    def remove(self, player_id: str) -> None:
+        """Take a player out of the queues, if they are in one (they left, or were seated by hand)."""
+        with self.lock:
+            self._remove(player_id)
+
+    def relax(self, now: float) -> List[List[str]]:
+        """
+        Let players who have waited longer than the relax time take any table.
+
+        Returns:
+            The tables that could then be filled, as lists of player IDs
+        """
+        with self.lock:
+            anyone = self.queues[None]
+            relaxed = []
+            for size in TABLE_SIZES:
+                queue = self.queues[size]
+                while queue:
+                    player_id, queued = next(iter(queue.items()))
+                    if now - queued < self.relax_seconds:
+                        break
+                    del queue[player_id]
+                    relaxed.append((queued, player_id))
+            # Merged in queueing order, so the longest waiting are still seated first
+            merged = sorted([*((queued, player_id) for player_id, queued in anyone.items()), *relaxed])
+            anyone.clear()
+            for queued, player_id in merged:
+                anyone[player_id] = queued
+                self.preferences[player_id] = None
+            tables = []
+            while True:
+                table = self._fill(reversed(TABLE_SIZES))
+                if table is None:
+                    return tables
+                tables.append(table)
+
+    def __len__(self) -> int:
+        return len(self.preferences)
+
+    def _remove(self, player_id: str) -> None:
+        if player_id in self.preferences:
+            del self.queues[self.preferences.pop(player_id)][player_id]
+
+    def _fill(self, sizes) -> Optional[List[str]]:
+        """Take out the first table, of the first of the sizes, that the queues can fill."""
+        anyone = self.queues[None]
+        for size in sizes:
+            preferring = self.queues[size]
+            if len(preferring) + len(anyone) < size:
+                continue
+            table = []
+            for queue in (preferring, anyone):
+                while queue and len(table) < size:
+                    player_id, _ = queue.popitem(last=False)
+                    del self.preferences[player_id]
+                    table.append(player_id)
+            return table
+        return None
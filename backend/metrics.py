@@ -0,0 +1,140 @@
+"""
+Counters, gauges and histograms kept in memory, for the server's /metrics
+route to write out in Prometheus's text format (version 0.0.4).
+
+Each server process keeps its own, so with several worker processes each
+is scraped (or summed) separately.  Updating a metric takes one lock held
+for a few operations, cheap enough to do on every request.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # seconds
+SIZE_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536)  # bytes
+COUNT_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+Labels = Tuple[str, ...]
+
+
+def escape(value: str) -> str:
+    """A label value as the text format writes it inside quotes."""
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named metric with a value per combination of its labels' values."""
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, label_names: Labels = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.lock = threading.Lock()
+
+    def label_text(self, values: Labels, extra: str = "") -> str:
+        pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(self.label_names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """A count that only goes up."""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, label_names: Labels = ()):
+        super().__init__(name, help, label_names)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f"{self.name}{self.label_text(labels)} {number(value)}" for labels, value in values]
+
+
+class Gauge(Metric):
+    """A value read when the metrics are written out, from a function returning it."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        super().__init__(name, help)
+        self.read = read
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {number(self.read())}"]
+
+
+class Histogram(Metric):
+    """Observations counted into buckets by size, with their sum."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: Labels = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Labels -> (observations in each bucket and above the last, not cumulative), sum of observations
+        self.values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(labels) or self.values.setdefault(labels, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """Observe how long the block takes, in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = sorted((labels, (list(counts), total[0])) for labels, (counts, total) in self.values.items())
+        lines = []
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = 'le="' + number(bound) + '"'
+                lines.append(f"{self.name}_bucket{self.label_text(labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self.label_text(labels)} {number(total)}")
+            lines.append(f"{self.name}_count{self.label_text(labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics a process keeps, written out together."""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Every metric in the text format."""
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
@@ -0,0 +1,82 @@
+"""
+Moves as plain records, so they can be journaled, shared between server
+processes and replayed.
+
+A move is (player ID, kind, data): data is the card id the move takes (a
+list of ids for "play-meld"), a bot's decision for "bot-draw" and
+"bot-play", a list of [kind, data] moves for "turn", or None.
+"""
+from typing import Any, List, Tuple
+
+from bots import apply_decision
+from rummy import RummyGame, card_from_id
+
+Move = Tuple[str, str, Any]  # (player ID, kind, data)
+
+KINDS = ("draw-stack", "draw-discard", "play-meld", "discard", "sort", "left", "bot-draw", "bot-play", "turn")
+TURN_KINDS = ("draw-stack", "draw-discard", "play-meld", "discard", "sort")  # moves a "turn" can be made of
+
+
+class IllegalMove(Exception):
+    """A move in a turn couldn't be made, so none of the turn was."""
+
+    def __init__(self, index: int, kind: str):
+        super().__init__(f"Move {index + 1} ({kind}) can't be made")
+        self.index = index
+        self.kind = kind
+
+
+def apply_move(game: RummyGame, player_id: str, move: str, data: Any = None) -> bool:
+    """
+    Make a move in a game.
+
+    Args:
+        game: The game to move in
+        player_id: Who is moving
+        move: One of KINDS
+        data: The move's data, as described above
+
+    Returns:
+        Whether the move was made; one the rules don't allow changes nothing
+        but, for some, the game's log
+
+    Raises:
+        IllegalMove: For a "turn" with a move that can't be made, leaving the game untouched
+    """
+    if move == "draw-stack":
+        return game.draw_from_stack(player_id) is not None
+    elif move == "draw-discard":
+        return bool(game.draw_from_discard(player_id, card_from_id(data)))
+    elif move == "play-meld":
+        return game.play_meld(player_id, [card_from_id(card_id) for card_id in data])
+    elif move == "discard":
+        return game.discard_card(player_id, card_from_id(data))
+    elif move == "sort":
+        game.sort_hand(player_id)
+    elif move == "left":
+        game.player_left(player_id)
+    elif move.startswith("bot-"):
+        apply_decision(game, player_id, move[len("bot-"):], data)
+    elif move == "turn":
+        # Tried on a copy first, so a move that fails partway leaves nothing behind
+        play_turn(RummyGame.restore(game.snapshot(events=False, recording=False)), player_id, data)
+        play_turn(game, player_id, data)
+    return True
+
+
+def play_turn(game: RummyGame, player_id: str, moves: List[List[Any]]) -> None:
+    """
+    Make a player's moves in order, each of which must be theirs to make.
+
+    Args:
+        game: The game to move in
+        player_id: Whose turn it should be
+        moves: [kind, data] pairs, each kind one of TURN_KINDS
+
+    Raises:
+        IllegalMove: At the first move that can't be made, after making the ones before it
+    """
+    for index, (kind, data) in enumerate(moves):
+        if (kind not in TURN_KINDS or game.is_game_over() or game.get_current_player() != player_id
+                or not apply_move(game, player_id, kind, data)):
+            raise IllegalMove(index, kind)
@@ -0,0 +1,192 @@
+"""
+Durable storage for games in progress, so a restart doesn't lose them.
+
+Every move is appended to a journal in SQLite (in WAL mode), and every so
+often the whole game is written as a snapshot and the journal behind it
+is dropped.  On startup each game is loaded from its latest snapshot and
+the moves journaled since are replayed on top.
+
+Writes happen on a background thread: a request only queues its journal
+row, and the writer commits whatever has queued up in one transaction.
+"""
+import json
+import queue
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from moves import apply_move
+from rummy import RummyGame
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    game_id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,  -- last journaled move the snapshot includes
+    snapshot TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS moves (
+    game_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    player_id TEXT NOT NULL,
+    move TEXT NOT NULL,
+    data TEXT,  -- JSON arguments, if the move takes any
+    PRIMARY KEY (game_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS players (
+    player_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    game_id TEXT,  -- NULL while in the waiting room
+    bot TEXT,  -- difficulty, for seats played by the computer
+    joined INTEGER NOT NULL  -- orders the waiting room
+);
+"""
+
+
+@dataclass
+class SavedPlayer:
+    player_id: str
+    name: str
+    game_id: Optional[str]
+    bot: Optional[str]
+
+
+class GameJournal:
+    """
+    Journal and snapshots of active games, plus the players in them.
+
+    A game saved before games carried a seed re-deals differently each time
+    a move that re-deals is replayed, so the caller snapshots the game after
+    such a move instead.
+    """
+
+    def __init__(self, path: str, snapshot_every: int = 20):
+        """
+        Args:
+            path: SQLite database file, created if missing
+            snapshot_every: Moves journaled for a game before it is snapshotted again
+        """
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.seqs: Dict[str, int] = {}  # game ID -> last journaled move
+        self.since_snapshot: Dict[str, int] = {}  # game ID -> moves journaled since its snapshot
+        self.joined = 0
+        self.writes: "queue.Queue[Optional[Tuple[str, tuple]]]" = queue.Queue()
+        self.connection = self._connect()
+        self.connection.executescript(SCHEMA)
+        self.writer = threading.Thread(target=self._write, name="rummy-journal", daemon=True)
+        self.writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")  # durable across a crashed process; a lost OS can cost the last few moves
+        return connection
+
+    def load(self) -> Tuple[Dict[str, RummyGame], List[SavedPlayer]]:
+        """
+        Read back every saved game and player.
+
+        Returns:
+            Games by ID, each restored from its snapshot with the moves journaled
+            since replayed on top, and every player, waiting room first in the
+            order they joined
+        """
+        self.flush()
+        games: Dict[str, RummyGame] = {}
+        for game_id, seq, snapshot in self.connection.execute("SELECT game_id, seq, snapshot FROM games"):
+            games[game_id] = RummyGame.restore(json.loads(snapshot))
+            self.seqs[game_id] = seq
+            self.since_snapshot[game_id] = 0
+        rows = self.connection.execute(
+            "SELECT moves.game_id, moves.seq, player_id, move, data FROM moves JOIN games USING (game_id)"
+            " WHERE moves.seq > games.seq ORDER BY moves.game_id, moves.seq")
+        for game_id, seq, player_id, move, data in rows:
+            apply_move(games[game_id], player_id, move, json.loads(data) if data is not None else None)
+            self.seqs[game_id] = seq
+            self.since_snapshot[game_id] += 1
+        players = [SavedPlayer(*row) for row in self.connection.execute(
+            "SELECT player_id, name, game_id, bot FROM players ORDER BY game_id IS NOT NULL, joined")]
+        self.joined = self.connection.execute("SELECT COALESCE(MAX(joined), 0) FROM players").fetchone()[0]
+        return games, players
+
+    def save_game(self, game_id: str, game: RummyGame) -> None:
+        """Snapshot a game, replacing its journal so far."""
+        seq = self.seqs.setdefault(game_id, 0)
+        self.since_snapshot[game_id] = 0
+        self._queue("INSERT OR REPLACE INTO games (game_id, seq, snapshot) VALUES (?, ?, ?)",
+                    (game_id, seq, json.dumps(game.snapshot(), separators=(",", ":"))))
+        self._queue("DELETE FROM moves WHERE game_id = ? AND seq <= ?", (game_id, seq))
+
+    def append_move(self, game_id: str, game: RummyGame, player_id: str, move: str, data: Any = None) -> None:
+        """
+        Journal a move that has just been made, snapshotting instead if one is due.
+
+        Args:
+            game_id: The game the move was made in
+            game: The game after the move
+            player_id: Who made the move
+            move: What kind of move it was (see moves.apply_move)
+            data: The move's arguments, JSON-ready
+        """
+        seq = self.seqs.get(game_id, 0) + 1
+        self.seqs[game_id] = seq
+        if self.since_snapshot.get(game_id, 0) + 1 >= self.snapshot_every:
+            self.save_game(game_id, game)
+            return
+        self.since_snapshot[game_id] = self.since_snapshot.get(game_id, 0) + 1
+        self._queue("INSERT INTO moves (game_id, seq, player_id, move, data) VALUES (?, ?, ?, ?, ?)",
+                    (game_id, seq, player_id, move, json.dumps(data, separators=(",", ":")) if data is not None else None))
+
+    def remove_game(self, game_id: str) -> None:
+        """Forget a finished or abandoned game."""
+        self.seqs.pop(game_id, None)
+        self.since_snapshot.pop(game_id, None)
+        self._queue("DELETE FROM moves WHERE game_id = ?", (game_id,))
+        self._queue("DELETE FROM games WHERE game_id = ?", (game_id,))
+
+    def save_player(self, player_id: str, name: str, game_id: Optional[str] = None, bot: Optional[str] = None) -> None:
+        """Record a player (or a bot's seat), or update where they are."""
+        self.joined += 1
+        self._queue("INSERT INTO players (player_id, name, game_id, bot, joined) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT (player_id) DO UPDATE SET name = excluded.name, game_id = excluded.game_id, bot = excluded.bot",
+                    (player_id, name, game_id, bot, self.joined))
+
+    def remove_player(self, player_id: str) -> None:
+        self._queue("DELETE FROM players WHERE player_id = ?", (player_id,))
+
+    def flush(self) -> None:
+        """Wait until everything queued so far is committed."""
+        self.writes.join()
+
+    def close(self) -> None:
+        """Commit what is queued, stop the writer and close the database."""
+        self.writes.put(None)
+        self.writer.join()
+        self.connection.close()
+
+    def _queue(self, sql: str, params: tuple) -> None:
+        self.writes.put((sql, params))
+
+    def _write(self) -> None:
+        """Writer thread: commit queued statements, batching whatever has built up."""
+        while True:
+            batch = [self.writes.get()]
+            while True:
+                try:
+                    batch.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            try:
+                with self.connection:
+                    self.connection.execute("BEGIN")
+                    for item in batch:
+                        if item is not None:
+                            self.connection.execute(*item)
+            except sqlite3.Error as e:
+                print(f"Error writing game journal: {str(e)}")
+            for _ in batch:
+                self.writes.task_done()
+            if stop:
+                return
@@ -0,0 +1,151 @@
+"""
+Profiling a sample of live requests, to find what is slow under real
+traffic without restarting the server or attaching anything to it.
+
+Two profilers, chosen by the server's PROFILER setting:
+
+- "cprofile" runs cProfile over each sampled request and adds its timings
+  up per route; the result is a pstats file (python -m pstats, snakeviz).
+- "stack" has a background thread look at the stacks of threads in sampled
+  requests every few milliseconds and counts the stacks it sees per route;
+  the result is in the collapsed-stack format flame graph tools read
+  ("route;outer;...;inner count" per line).  It costs the request itself
+  next to nothing, but sees only what runs for longer than its interval.
+"""
+import cProfile
+import marshal
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+PROFILERS = ("cprofile", "stack")
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})"
+
+
+class CallProfiles:
+    """cProfile timings of sampled requests, added up per route."""
+
+    def __init__(self):
+        self.stats: Dict[str, pstats.Stats] = {}
+        self.lock = threading.Lock()
+
+    def start(self, route: str) -> Optional[cProfile.Profile]:
+        """Start profiling the current thread's request; None if another profiler has it (as on 3.12+, one at a time)."""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return None
+        return profile
+
+    def stop(self, route: str, profile: cProfile.Profile) -> None:
+        profile.disable()
+        with self.lock:
+            if route in self.stats:
+                self.stats[route].add(profile)
+            else:
+                self.stats[route] = pstats.Stats(profile)
+
+    def dump(self, route: Optional[str] = None, reset: bool = False) -> Optional[bytes]:
+        """
+        The timings for a route (or all routes together) as a pstats file.
+
+        Returns:
+            The file's contents, or None if no request to the route has been profiled
+        """
+        with self.lock:
+            profiled = [stats for name, stats in self.stats.items() if route is None or name == route]
+            if not profiled:
+                return None
+            total = pstats.Stats()
+            total.add(*profiled)
+            if reset:
+                self._clear(route)
+        return marshal.dumps(total.stats)  # what pstats.Stats.dump_stats writes
+
+    def _clear(self, route: Optional[str]) -> None:
+        for name in [name for name in self.stats if route is None or name == route]:
+            del self.stats[name]
+
+
+class StackSampler:
+    """Call stacks of threads in sampled requests, counted per route by a background thread."""
+
+    def __init__(self, interval: float):
+        """
+        Args:
+            interval: Seconds between looks at the stacks
+        """
+        self.interval = interval
+        self.active: Dict[int, str] = {}  # thread ID -> route of the sampled request it is in
+        self.counts: Dict[str, Counter] = {}  # route -> collapsed stack -> times seen
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self, route: str) -> Optional[int]:
+        thread_id = threading.get_ident()
+        with self.lock:
+            self.active[thread_id] = route
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.sample_forever, name="rummy-profiler", daemon=True)
+                self.thread.start()
+        return thread_id
+
+    def stop(self, route: str, thread_id: int) -> None:
+        with self.lock:
+            self.active.pop(thread_id, None)
+
+    def sample_forever(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    continue
+                active = dict(self.active)
+            frames = sys._current_frames()
+            seen = []
+            for thread_id, route in active.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                if stack:
+                    seen.append((route, ";".join([route, *reversed(stack)])))
+            with self.lock:
+                for route, stack in seen:
+                    self.counts.setdefault(route, Counter())[stack] += 1
+
+    def dump(self, route: Optional[str] = None, reset: bool = False) -> Optional[bytes]:
+        """
+        The stacks seen in a route's requests (or all routes') in the collapsed-stack format.
+
+        Returns:
+            The file's contents, or None if no stacks have been seen for the route
+        """
+        with self.lock:
+            counted = [counts for name, counts in self.counts.items() if route is None or name == route]
+            lines = [f"{stack} {count}" for counts in counted for stack, count in counts.items()]
+            if reset:
+                for name in [name for name in self.counts if route is None or name == route]:
+                    del self.counts[name]
+        return "\n".join(lines).encode() + b"\n" if lines else None
+
+
+def make_profiler(kind: str, interval: float):
+    """
+    Raises:
+        ValueError: If the kind isn't one of PROFILERS
+    """
+    if kind == "cprofile":
+        return CallProfiles()
+    if kind == "stack":
+        return StackSampler(interval)
+    raise ValueError(f"Unknown profiler: {kind} (expected one of {', '.join(PROFILERS)})")
@@ -0,0 +1,284 @@
+"""
+Game recordings, and playing them back to any point.
+
+Every game records its moves as it goes (see rummy.RECORDED_MOVES), and its
+shuffles all follow from its seed, so the seed, the seats and the moves are
+enough to rebuild the game exactly as it was after any move.  A recording
+is written as:
+
+    b"NRRR", format version (1 byte), seed (8 bytes), seat count (1 byte),
+    then each seat's name and ID (2-byte length + UTF-8 each),
+    then one 8-byte record per move
+
+all little-endian.  Replay seeks by restoring the nearest keyframe (a
+snapshot taken every so many moves on the way through) and playing the
+moves after it.
+
+Finished games can be kept in an archive: a file of recordings back to
+back, each after its length (4 bytes, little-endian).  The server appends
+to one as it drops games (see ARCHIVE in app.py); analytics.py reads them.
+
+To look into a game saved in a server's database:
+
+    python recording.py rummy.db GAME_ID --at 120 --out game.nrr
+"""
+import argparse
+import bisect
+import json
+import os
+import sqlite3
+import struct
+import sys
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from rummy import CARDS, RECORD_SIZE, RECORDED_MOVES, RummyGame, cards_in
+
+MAGIC = b"NRRR"
+FORMAT = 1
+CARD_BITS = (1 << len(CARDS)) - 1
+
+
+class BadRecording(ValueError):
+    """Data that isn't a recording, or one that doesn't play back."""
+
+
+@dataclass
+class Recording:
+    """A game's seed and seats, and the moves made in it."""
+    seed: int
+    player_names: List[str]
+    player_ids: List[str]
+    moves: bytes  # RECORD_SIZE bytes per move
+
+    @classmethod
+    def of(cls, game: RummyGame) -> "Recording":
+        """
+        The recording a game has made so far.
+
+        Raises:
+            BadRecording: If the game wasn't recorded (it was saved before games were)
+        """
+        if game.recording is None:
+            raise BadRecording("This game has no recording")
+        return cls(game.seed, list(game.player_names), list(game.player_ids), bytes(game.recording))
+
+    def __len__(self) -> int:
+        return len(self.moves) // RECORD_SIZE
+
+    def move(self, index: int) -> Tuple[int, str, int]:
+        """A move, as (the mover's seat, one of RECORDED_MOVES, the bitset of the cards it took)."""
+        record = int.from_bytes(self.moves[index * RECORD_SIZE:(index + 1) * RECORD_SIZE], "little")
+        kind = (record >> 52) & 0xF
+        if kind >= len(RECORDED_MOVES) or record >> 56 >= len(self.player_ids):
+            raise BadRecording(f"Move {index} is not a move")
+        return record >> 56, RECORDED_MOVES[kind], record & CARD_BITS
+
+    def to_bytes(self) -> bytes:
+        header = [MAGIC, struct.pack("<BQB", FORMAT, self.seed, len(self.player_ids))]
+        for name, player_id in zip(self.player_names, self.player_ids):
+            for text in (name.encode(), player_id.encode()):
+                header += [struct.pack("<H", len(text)), text]
+        return b"".join(header) + self.moves
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Recording":
+        """
+        Raises:
+            BadRecording: If the data isn't a recording this version can read
+        """
+        try:
+            if data[:4] != MAGIC:
+                raise BadRecording("Not a game recording")
+            format, seed, seats = struct.unpack_from("<BQB", data, 4)
+            if format != FORMAT:
+                raise BadRecording(f"Recording format {format} is not supported")
+            offset = 4 + struct.calcsize("<BQB")
+            texts = []
+            for _ in range(2 * seats):
+                (length,) = struct.unpack_from("<H", data, offset)
+                texts.append(data[offset + 2:offset + 2 + length].decode())
+                offset += 2 + length
+        except (struct.error, UnicodeDecodeError) as e:
+            raise BadRecording(f"Damaged recording header: {e}") from None
+        moves = data[offset:]
+        if len(moves) % RECORD_SIZE:
+            raise BadRecording("Recording ends partway through a move")
+        return cls(seed, texts[0::2], texts[1::2], moves)
+
+
+def archive(path: str, recording: Recording) -> None:
+    """Append a recording to an archive, creating it if need be."""
+    data = recording.to_bytes()
+    # One write of the whole entry, so entries appended by several processes don't interleave
+    with open(path, "ab") as f:
+        f.write(struct.pack("<I", len(data)) + data)
+
+
+def archive_offsets(path: str) -> Iterator[int]:
+    """
+    Where each recording in an archive starts, found by hopping from length to length.
+
+    Raises:
+        BadRecording: If the archive ends partway through a recording
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset < size:
+            prefix = f.read(4)
+            end = offset + 4 + (struct.unpack("<I", prefix)[0] if len(prefix) == 4 else size)
+            if end > size:
+                raise BadRecording(f"{path} ends partway through a recording at byte {offset}")
+            yield offset
+            offset = f.seek(end)
+
+
+def read_archive(path: str, offset: int = 0, count: Optional[int] = None) -> Iterator[Recording]:
+    """
+    The recordings in an archive, read one at a time.
+
+    Args:
+        path: The archive
+        offset: Where to start, from archive_offsets
+        count: How many recordings to read (default: to the end)
+
+    Raises:
+        BadRecording: If the archive is damaged
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while count is None or count > 0:
+            prefix = f.read(4)
+            if not prefix:
+                return
+            length = struct.unpack("<I", prefix)[0] if len(prefix) == 4 else None
+            data = f.read(length) if length is not None else b""
+            if length is None or len(data) < length:
+                raise BadRecording(f"{path} ends partway through a recording")
+            yield Recording.from_bytes(data)
+            if count is not None:
+                count -= 1
+
+
+def play_move(game: RummyGame, player_id: str, kind: str, mask: int) -> None:
+    """Make a recorded move."""
+    if kind == "draw-stack":
+        game.draw_from_stack(player_id)
+    elif kind == "draw-discard":
+        game.draw_from_discard(player_id, cards_in(mask)[0])
+    elif kind == "play-meld":
+        game.play_meld(player_id, cards_in(mask))
+    elif kind == "discard":
+        game.discard_card(player_id, cards_in(mask)[0])
+    elif kind == "sort":
+        game.sort_hand(player_id)
+    elif kind == "left":
+        game.player_left(player_id)
+
+
+class Replay:
+    """Plays a recording back to any move, keeping keyframes so seeking again is quick."""
+
+    def __init__(self, recording: Recording, keyframe_every: int = 64):
+        """
+        Args:
+            recording: The game to play back
+            keyframe_every: Moves between keyframes; fewer make seeking quicker and take more memory
+        """
+        self.recording = recording
+        self.keyframe_every = max(keyframe_every, 1)
+        start = RummyGame(len(recording.player_ids), recording.player_names, recording.player_ids, seed=recording.seed)
+        # Move index -> snapshot of the game after that many moves, without its recording
+        self.keyframes: Dict[int, Dict] = {0: start.snapshot(recording=False)}
+        self.indexes = [0]
+
+    def __len__(self) -> int:
+        return len(self.recording)
+
+    def game_at(self, index: int) -> RummyGame:
+        """
+        The game as it was after the first index moves (without a recording of its own).
+
+        Raises:
+            IndexError: If the recording has fewer moves
+            BadRecording: If a move doesn't change the game the way it did when it was recorded
+        """
+        if not 0 <= index <= len(self.recording):
+            raise IndexError(f"The recording has {len(self.recording)} moves")
+        start = self.indexes[bisect.bisect_right(self.indexes, index) - 1]
+        game = RummyGame.restore(self.keyframes[start])
+        for position in range(start, index):
+            seat, kind, mask = self.recording.move(position)
+            version = game.version
+            play_move(game, game.player_ids[seat], kind, mask)
+            if game.version == version:
+                raise BadRecording(f"Move {position} ({kind}) changed nothing on playback")
+            if (position + 1) % self.keyframe_every == 0 and position + 1 not in self.keyframes:
+                self.keyframes[position + 1] = game.snapshot(recording=False)
+                bisect.insort(self.indexes, position + 1)
+        return game
+
+    def matches(self, game: RummyGame) -> bool:
+        """Whether playing the whole recording back ends with the given game, as a check on the engine."""
+        played = self.game_at(len(self.recording)).snapshot(events=False, recording=False)
+        return played == game.snapshot(events=False, recording=False)
+
+
+def load_game(database: str, game_id: str) -> Optional[RummyGame]:
+    """A game saved in a server's database, by the journal (with its journaled moves replayed) or the shared store."""
+    from moves import apply_move
+    from store import unpack_game
+
+    connection = sqlite3.connect(database)
+    try:
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "games" in tables:
+            row = connection.execute("SELECT seq, snapshot FROM games WHERE game_id = ?", (game_id,)).fetchone()
+            if row is not None:
+                game = RummyGame.restore(json.loads(row[1]))
+                for player_id, move, data in connection.execute(
+                        "SELECT player_id, move, data FROM moves WHERE game_id = ? AND seq > ? ORDER BY seq", (game_id, row[0])):
+                    apply_move(game, player_id, move, json.loads(data) if data is not None else None)
+                return game
+        if "shared_games" in tables:
+            row = connection.execute("SELECT data FROM shared_games WHERE game_id = ?", (game_id,)).fetchone()
+            if row is not None:
+                return unpack_game(row[0])
+    finally:
+        connection.close()
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Play back a recorded game and print it as it was after a move.")
+    parser.add_argument("source", help="a recording (.nrr), or a server database holding the game")
+    parser.add_argument("game_id", nargs="?", help="the game, when reading a database")
+    parser.add_argument("--at", type=int, help="move to stop after (default: the last)")
+    parser.add_argument("--out", help="also write the recording to this file")
+    args = parser.parse_args()
+
+    if args.game_id is None:
+        with open(args.source, "rb") as f:
+            recording = Recording.from_bytes(f.read())
+    else:
+        game = load_game(args.source, args.game_id)
+        if game is None:
+            sys.exit(f"No game {args.game_id} in {args.source}")
+        recording = Recording.of(game)
+    if args.out:
+        with open(args.out, "wb") as f:
+            f.write(recording.to_bytes())
+
+    replay = Replay(recording)
+    at = len(replay) if args.at is None else args.at
+    game = replay.game_at(at)
+    state = game.snapshot(recording=False)
+    state["hands"] = {name: [str(CARDS[card_id]) for card_id in hand] for name, hand in zip(game.player_names, state["hands"])}
+    state.pop("events")
+    print(json.dumps({"moves": len(replay), "at": at, "state": state,
+                      "events": game.get_events(max(game.event_log.cursor - 20, 0))}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
+import base64
+import functools
 import random
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, NamedTuple, Optional, Tuple
 from dataclasses import dataclass
 from enum import Enum
+from itertools import combinations
+from events import EventLog, EventType, Event
 
 
 class Suit(Enum):
@@ -35,60 +39,235 @@ class MeldType(Enum):
     RUN = 2
 
 
-@dataclass
+class Place(Enum):
+    """Where in a game a card can be."""
+    STACK = 0
+    HAND = 1
+    MELD = 2
+    DISCARD = 3
+
+
+class Location(NamedTuple):
+    """Where a card is in a game."""
+    place: Place
+    player_id: Optional[str] = None  # whose hand or meld
+    meld_index: int = -1  # which of the player's melds
+    position: int = -1  # index within the stack, meld or discard pile (hands are reordered freely, so not tracked)
+
+
 class Card:
-    """Represents a playing card."""
-    suit: Suit
-    rank: Rank
-    meld_type: MeldType
-    
+    """
+    Represents a playing card.
+
+    There is exactly one instance of each of the 52 cards (see CARDS and
+    get_card), so cards compare and hash by identity.  Cards never change:
+    whether a card is melded, and whether a melded ace counts high, is
+    recorded on the Meld holding it.
+    """
+    __slots__ = ("id", "mask", "suit", "rank")
+
+    def __init__(self, card_id: int, suit: Suit, rank: Rank):
+        object.__setattr__(self, "id", card_id)  # 0-51, suit-major
+        object.__setattr__(self, "mask", 1 << card_id)  # the card's bit in a card bitset
+        object.__setattr__(self, "suit", suit)
+        object.__setattr__(self, "rank", rank)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Cards are immutable")
+
     def __str__(self) -> str:
         return f"{self.rank.name.lower()} of {self.suit.value}"
-    
-    def __eq__(self, other) -> bool:
-        if not isinstance(other, Card):
-            return False
-        return self.suit == other.suit and self.rank == other.rank and self.meld_type == other.meld_type
-    
+
+    def __repr__(self) -> str:
+        return f"Card({self.rank.name}, {self.suit.name})"
+
     def __hash__(self) -> int:
-        return hash((self.suit, self.rank))
+        return self.id
+
+    def __reduce__(self):
+        # Copies and pickles resolve back to the canonical instance
+        return (card_from_id, (self.id,))
+
+
+CARDS: Tuple[Card, ...] = tuple(
+    Card(suit_index * 13 + rank_index, suit, rank)
+    for suit_index, suit in enumerate(Suit)
+    for rank_index, rank in enumerate(r for r in Rank if r != Rank.HIGH_ACE)
+)
+
+
+def card_from_id(card_id: int) -> Card:
+    """Get the card with the given id."""
+    return CARDS[card_id]
+
+
+_SUIT_INDEX = {suit: i for i, suit in enumerate(Suit)}
+
+# Shared locations for every pile position, so indexing a game doesn't build them afresh
+_STACK_LOCATIONS = tuple(Location(Place.STACK, position=position) for position in range(len(CARDS)))
+_DISCARD_LOCATIONS = tuple(Location(Place.DISCARD, position=position) for position in range(len(CARDS)))
+
+
+def get_card(suit: Suit, rank: Rank) -> Card:
+    """Get the card with the given suit and rank (HIGH_ACE is the ace)."""
+    return CARDS[_SUIT_INDEX[suit] * 13 + (rank.value - 1) % 13]
+
 
 @dataclass
 class Meld:
     """Represents a meld (set or run) of cards."""
     cards: List[Card]
-    meld_type: MeldType 
+    meld_type: MeldType
+    ace_high: bool = False  # aces in this meld rank above the king
+
+    def rank_of(self, card: Card) -> Rank:
+        """The rank a card counts as within this meld."""
+        return Rank.HIGH_ACE if self.ace_high and card.rank == Rank.ACE else card.rank
+
+
+def card_points(card: Card, ace_high: bool = False) -> int:
+    """
+    Points for a single card.
+
+    Args:
+        card: The card to score
+        ace_high: Whether the card is in a meld where aces count high
+
+    Returns:
+        15 for a high ace, 10 for face cards, 5 for number cards and low aces
+    """
+    if card.rank == Rank.ACE and ace_high:
+        return 15
+    elif card.rank in (Rank.JACK, Rank.QUEEN, Rank.KING):
+        return 10
+    else:
+        return 5
+
+# Sets of cards are also handled as 52-bit integers with bit card.id set for each card
+
+ACE_MASK = sum(1 << (suit_index * 13) for suit_index in range(4))
+
+
+def mask_of(cards: List[Card]) -> int:
+    """Bitset of the given cards."""
+    mask = 0
+    for card in cards:
+        mask |= card.mask
+    return mask
+
+
+def cards_in(mask: int) -> List[Card]:
+    """The cards in a bitset, in id order (by suit, then ace to king)."""
+    cards = []
+    while mask:
+        low = mask & -mask
+        cards.append(CARDS[low.bit_length() - 1])
+        mask ^= low
+    return cards
+
+
+def _build_meld_table() -> Dict[int, Tuple[MeldType, bool]]:
+    """Every legal set and run, as bitset -> (meld type, whether its aces count high)."""
+    melds: Dict[int, Tuple[MeldType, bool]] = {}
+    for rank_index in range(13):
+        same_rank = [1 << (suit_index * 13 + rank_index) for suit_index in range(4)]
+        for size in (3, 4):
+            for combo in combinations(same_rank, size):
+                melds[sum(combo)] = (MeldType.SET, rank_index == 0)
+    for suit_index in range(4):
+        # Positions 0-13 run ace (low) to ace (high); a run can't use both aces
+        for start in range(14):
+            for end in range(start + 3, min(start + 13, 14) + 1):
+                mask = sum(1 << (suit_index * 13 + position % 13) for position in range(start, end))
+                ace_high = end == 14
+                if ace_high or mask not in melds:  # a whole suit counts its ace high
+                    melds[mask] = (MeldType.RUN, ace_high)
+    return melds
+
+
+MELDS = _build_meld_table()
+
+
+def classify_meld(mask: int, set_mask: int = 0, run_mask: int = 0, high_ace_mask: int = 0) -> Tuple[MeldType, bool]:
+    """
+    Look up whether a bitset of cards forms a meld.
+
+    Args:
+        mask: The cards, from a hand and/or melds already on the table
+        set_mask: Cards on the table in sets (can't be reused in a run)
+        run_mask: Cards on the table in runs (can't be reused in a set)
+        high_ace_mask: Aces on the table that count high
+
+    Returns:
+        The type of meld formed (MeldType.NONE if none), and whether its aces count high
+    """
+    meld_type, ace_high = MELDS.get(mask, (MeldType.NONE, False))
+    if meld_type == MeldType.SET:
+        if mask & run_mask:
+            return MeldType.NONE, False
+    elif meld_type == MeldType.RUN:
+        if mask & set_mask:
+            return MeldType.NONE, False
+        # An ace already on the table keeps its rank, unless the run covers the whole suit
+        table_aces = mask & ACE_MASK & run_mask
+        if table_aces and mask.bit_count() < 13 and ace_high != bool(table_aces & high_ace_mask):
+            return MeldType.NONE, False
+    return meld_type, ace_high
 
-def forms_meld(cards: List[Card]) -> MeldType:
-    if (len(cards) < 3):
-        return MeldType.NONE 
-    
-    rank = cards[0].rank 
-    if all(card.rank == rank and card.meld_type != MeldType.RUN for card in cards):
-        if (rank == Rank.ACE):
-            for card in cards:
-                card.rank = Rank.HIGH_ACE
-        return MeldType.SET
-    
-    suit = cards[0].suit 
-    if not all(card.suit == suit and card.meld_type != MeldType.SET for card in cards):
-        return MeldType.NONE
-    
-    cards.sort(key=lambda c: c.rank.value)
-    for i in range(1, len(cards)):
-        if (not ((cards[i].rank.value == cards[i - 1].rank.value + 1) or (i == 1 and cards[0].rank == Rank.ACE and cards[0].meld_type == MeldType.NONE and cards[-1].rank == Rank.KING))):
-            return MeldType.NONE
-    
-    if (cards[0].rank == Rank.ACE and cards[-1].rank == Rank.KING):
-        cards[0].rank = Rank.HIGH_ACE
-    
-    return MeldType.RUN
+
+def meld_order(cards: List[Card], ace_high: bool) -> List[Card]:
+    """Sort a meld's cards for display, with high aces after the king."""
+    return sorted(cards, key=lambda c: (c.suit != cards[0].suit, 14 if ace_high and c.rank == Rank.ACE else c.rank.value, c.id))
+
+
+def forms_meld(cards: List[Card], set_mask: int = 0, run_mask: int = 0, high_ace_mask: int = 0) -> Tuple[MeldType, bool]:
+    """
+    Check whether cards form a meld, sorting them into meld order.
+
+    Args:
+        cards: Cards from the player's hand and/or melds already on the table
+        set_mask, run_mask, high_ace_mask: The table's melded cards, as for classify_meld
+
+    Returns:
+        The type of meld formed (MeldType.NONE if none), and whether its aces count high
+    """
+    mask = mask_of(cards)
+    if mask.bit_count() != len(cards):
+        return MeldType.NONE, False
+    meld_type, ace_high = classify_meld(mask, set_mask, run_mask, high_ace_mask)
+    if meld_type != MeldType.NONE:
+        cards[:] = meld_order(cards, ace_high)
+    return meld_type, ace_high
+
+
+# A game records each move that changed it in RECORD_SIZE bytes (little-endian):
+# the cards the move took as a bitset in bits 0-51, the kind of move as an index
+# into RECORDED_MOVES in bits 52-55, and the mover's seat in bits 56-57.  With the
+# game's seed that is enough to play it back (see recording.py).
+RECORDED_MOVES = ("draw-stack", "draw-discard", "play-meld", "discard", "sort", "left")
+RECORD_SIZE = 8
+
+
+def _recorded(kind: str):
+    """Make a move method record the move in the game's recording, if the move changed the game."""
+    code = RECORDED_MOVES.index(kind) << 52
+    def decorate(method):
+        @functools.wraps(method)
+        def move(self, player_id, *cards):
+            version = self.version
+            result = method(self, player_id, *cards)
+            if self.version != version and self.recording is not None:
+                mask = (mask_of(cards[0]) if isinstance(cards[0], list) else cards[0].mask) if cards else 0
+                self.recording += (self.player_ids.index(player_id) << 56 | code | mask).to_bytes(RECORD_SIZE, "little")
+            return result
+        return move
+    return decorate
 
 
 class RummyGame:
     """A complete Rummy game implementation."""
     
-    def __init__(self, num_players: int, player_names: List[str], player_ids: List[str]):
+    def __init__(self, num_players: int, player_names: List[str], player_ids: List[str], seed: Optional[int] = None):
         """
         Initialize a new Rummy game.
         
@@ -96,6 +275,8 @@ class RummyGame:
             num_players: Number of players (2-4)
             player_names: Optional list of player names. If not provided, 
                          names will be "Player 1", "Player 2", etc.
+            seed: Seed for the game's shuffles (0 to 2**64 - 1), so the same
+                  seed and moves always play out the same; random if not given
         
         Raises:
             ValueError: If num_players is not between 2 and 4
@@ -116,6 +297,15 @@ class RummyGame:
         self.players_melds: Dict[str, List[Meld]] = {}
         self.stack: List[Card] = []
         self.discard_pile: List[Card] = []
+        # The same cards as bitsets, kept in step with the lists above
+        self.hand_masks: Dict[str, int] = {}
+        self.stack_mask = 0
+        self.discard_mask = 0
+        self.set_mask = 0  # cards melded in sets
+        self.run_mask = 0  # cards melded in runs
+        self.high_ace_mask = 0  # melded aces that count high
+        # Where each card is, indexed by card id
+        self.locations: List[Location] = [Location(Place.STACK)] * len(CARDS)
         self.current_player = 0
         self.current_player_has_drawn = False
         self.round = 0
@@ -124,21 +314,20 @@ class RummyGame:
         self.scores: Dict[str, int] = {}
         for pid in player_ids:
             self.scores[pid] = 0
-        self.event_log: List[str] = []
+        self.event_log = EventLog()
+        self.version = 0  # bumped by every change a client could see
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.recording: Optional[bytearray] = bytearray()  # every move so far (see RECORDED_MOVES); None if not recorded
         
         # Create and shuffle deck
-        self._create_deck()
+        self._create_deck(0)
 
         self._deal_cards()
     
-    def _create_deck(self) -> None:
-        """Create a standard 52-card deck and shuffle it."""
-        self.stack = []
-        for suit in Suit:
-            for rank in Rank:
-                if rank != Rank.HIGH_ACE:
-                    self.stack.append(Card(suit, rank, MeldType.NONE))
-        random.shuffle(self.stack)
+    def _create_deck(self, round_number: int) -> None:
+        """Create a standard 52-card deck and shuffle it, the same way every time for the game's seed and a round."""
+        self.stack = list(CARDS)
+        random.Random(self.seed << 16 | round_number).shuffle(self.stack)
     
     def _deal_cards(self) -> None:
         """Deal 10 cards to each player."""
@@ -159,7 +348,104 @@ class RummyGame:
         self.discard_pile = []
         if self.stack:
             self.discard_pile.append(self.stack.pop())
-    
+
+        self._index_cards()
+
+    def _index_cards(self) -> None:
+        """Rebuild the card bitsets and location index from the hands, melds and piles."""
+        self.hand_masks = {player_id: mask_of(hand) for player_id, hand in self.players_hands.items()}
+        self.stack_mask = mask_of(self.stack)
+        self.discard_mask = mask_of(self.discard_pile)
+        self.set_mask = self.run_mask = self.high_ace_mask = 0
+        for position, card in enumerate(self.stack):
+            self.locations[card.id] = _STACK_LOCATIONS[position]
+        for player_id, hand in self.players_hands.items():
+            in_hand = Location(Place.HAND, player_id)
+            for card in hand:
+                self.locations[card.id] = in_hand
+        for position, card in enumerate(self.discard_pile):
+            self.locations[card.id] = _DISCARD_LOCATIONS[position]
+        for player_id, melds in self.players_melds.items():
+            for meld_index, meld in enumerate(melds):
+                meld_mask = mask_of(meld.cards)
+                if meld.meld_type == MeldType.SET:
+                    self.set_mask |= meld_mask
+                else:
+                    self.run_mask |= meld_mask
+                if meld.ace_high:
+                    self.high_ace_mask |= meld_mask & ACE_MASK
+                for position, card in enumerate(meld.cards):
+                    self.locations[card.id] = Location(Place.MELD, player_id, meld_index, position)
+
+    def snapshot(self, events: bool = True, recording: bool = True) -> Dict[str, any]:
+        """
+        Capture the whole game as plain JSON-ready data, with cards as ids.
+
+        Args:
+            events: Whether to keep the events still held in memory (older
+                ones are always dropped); without them a restored game's log
+                starts empty but carries on the numbering
+            recording: Whether to keep the game's recording; without it a
+                restored game doesn't record
+        """
+        return {
+            "player_names": self.player_names,
+            "player_ids": self.player_ids,
+            "hands": [[card.id for card in self.players_hands[pid]] for pid in self.player_ids],
+            "melds": [[[[card.id for card in meld.cards], meld.meld_type.value, meld.ace_high] for meld in self.players_melds[pid]]
+                      for pid in self.player_ids],
+            "stack": [card.id for card in self.stack],
+            "discard_pile": [card.id for card in self.discard_pile],
+            "scores": [self.scores[pid] for pid in self.player_ids],
+            "current_player": self.current_player,
+            "has_drawn": self.current_player_has_drawn,
+            "round": self.round,
+            "game_over": self.game_over,
+            "winner": self.winner,
+            "version": self.version,
+            "events": self.event_log.snapshot() if events else [self.event_log.cursor, []],
+            "seed": self.seed,
+            "recording": base64.b64encode(self.recording).decode() if recording and self.recording is not None else None,
+        }
+
+    @classmethod
+    def restore(cls, data: Dict[str, any]) -> "RummyGame":
+        """
+        Rebuild a game from a snapshot.
+
+        Args:
+            data: What snapshot returned
+
+        Returns:
+            The game as it was when the snapshot was taken
+        """
+        game = cls.__new__(cls)
+        game.num_players = len(data["player_ids"])
+        game.player_names = list(data["player_names"])
+        game.player_ids = list(data["player_ids"])
+        game.players_hands = {pid: [CARDS[card_id] for card_id in hand] for pid, hand in zip(game.player_ids, data["hands"])}
+        game.players_melds = {
+            pid: [Meld([CARDS[card_id] for card_id in cards], MeldType(meld_type), ace_high) for cards, meld_type, ace_high in melds]
+            for pid, melds in zip(game.player_ids, data["melds"])
+        }
+        game.stack = [CARDS[card_id] for card_id in data["stack"]]
+        game.discard_pile = [CARDS[card_id] for card_id in data["discard_pile"]]
+        game.locations = [Location(Place.STACK)] * len(CARDS)
+        game._index_cards()
+        game.scores = dict(zip(game.player_ids, data["scores"]))
+        game.current_player = data["current_player"]
+        game.current_player_has_drawn = data["has_drawn"]
+        game.round = data["round"]
+        game.game_over = data["game_over"]
+        game.winner = data["winner"]
+        game.version = data["version"]
+        game.event_log = EventLog.restore(data["events"])
+        # Games saved before they had seeds can't be played back
+        game.seed = data.get("seed", random.getrandbits(64))
+        game.recording = bytearray(base64.b64decode(data["recording"])) if data.get("recording") is not None else None
+        return game
+
+    @_recorded("draw-stack")
     def draw_from_stack(self, player_id: int) -> Optional[Card]:
         """
         Draw a card from the stack.
@@ -180,15 +466,19 @@ class RummyGame:
             return None
         
         if self.current_player_has_drawn:
-            self.event_log.append(f"{self.player_names[self.player_ids.index(player_id)]} attempted to draw from the stack after having already drawn")
+            self._log(EventType.ALREADY_DREW_STACK, player_id)
             return None
         
         card = self.stack.pop()
         self.players_hands[player_id].append(card)
-        self.event_log.append(f"{self.player_names[self.player_ids.index(player_id)]} drew a card from the stack")
+        self.stack_mask &= ~card.mask
+        self.hand_masks[player_id] |= card.mask
+        self.locations[card.id] = Location(Place.HAND, player_id)
         self.current_player_has_drawn = True
+        self._log(EventType.DREW_STACK, player_id)
         return card
     
+    @_recorded("draw-discard")
     def draw_from_discard(self, player_id: int, card: Card) -> bool:
         """
         Draw a specific card from the discard pile.
@@ -210,29 +500,28 @@ class RummyGame:
             return False
         
         if self.current_player_has_drawn:
-            self.event_log.append(f"{self.player_names[self.player_ids.index(player_id)]} attempted to draw from the discard pile after having already drawn")
+            self._log(EventType.ALREADY_DREW_DISCARD, player_id)
             return None
         
         # Find the card in the discard pile
-        try:
-            card_index = self.discard_pile.index(card)
-            drawn_cards = self.discard_pile[card_index:]
-            self.discard_pile = self.discard_pile[:card_index]
-            self.players_hands[player_id] += drawn_cards
-            match len(drawn_cards):
-                case 1:
-                    self.event_log.append(f"{self.player_names[self.player_ids.index(player_id)]} drew the {drawn_cards[0]} from the discard pile")
-                case 2:
-                    self.event_log.append(f"{self.player_names[self.player_ids.index(player_id)]} drew the {drawn_cards[0]} and the {drawn_cards[1]} from the discard pile")
-                case 3:
-                    self.event_log.append(f"{self.player_names[self.player_ids.index(player_id)]} drew the {drawn_cards[0]}, the {drawn_cards[1]}, and the {drawn_cards[2]} from the discard pile")
-                case _:
-                    self.event_log.append(f"{self.player_names[self.player_ids.index(player_id)]} drew {len(drawn_cards)} cards from the discard pile, beginning with the {drawn_cards[0]}")
-            self.current_player_has_drawn = True
-            return True
-        except ValueError:
+        location = self.locations[card.id]
+        if location.place != Place.DISCARD:
             return False
+        card_index = location.position
+        drawn_cards = self.discard_pile[card_index:]
+        drawn_mask = mask_of(drawn_cards)
+        self.discard_pile = self.discard_pile[:card_index]
+        self.players_hands[player_id] += drawn_cards
+        self.discard_mask &= ~drawn_mask
+        self.hand_masks[player_id] |= drawn_mask
+        in_hand = Location(Place.HAND, player_id)
+        for drawn in drawn_cards:
+            self.locations[drawn.id] = in_hand
+        self.current_player_has_drawn = True
+        self._log(EventType.DREW_DISCARD, player_id, drawn_cards)
+        return True
     
+    @_recorded("play-meld")
     def play_meld(self, player_id: int, cards: List[Card]) -> bool:
         """
         Play a meld (set or run) of cards.
@@ -251,49 +540,49 @@ class RummyGame:
         if player_id not in self.player_ids:
             raise ValueError(f"Invalid player ID: {player_id}")
         
-        # Check if all cards are in player's hand or existing melds
+        # Check if all cards are in player's hand or existing melds, at least one from the hand
         player_hand = self.players_hands[player_id]
-        existing_melds = [c for melds in self.players_melds.values() for m in melds for c in m.cards]
-        for card in cards:
-            if card.meld_type == MeldType.NONE:
-                if card not in player_hand:
-                    return False
-            else:
-                if card not in existing_melds:
-                    return False
+        hand_mask = self.hand_masks[player_id]
+        mask = mask_of(cards)
+        if mask.bit_count() != len(cards):
+            return False
+        if mask & ~(hand_mask | self.set_mask | self.run_mask):
+            return False
+        new_mask = mask & hand_mask
+        if not new_mask:
+            return False
         
         # Check if cards form valid meld
-        meld_type = forms_meld(cards)
+        meld_type, ace_high = classify_meld(mask, self.set_mask, self.run_mask, self.high_ace_mask)
         if meld_type == MeldType.NONE:
-            self.event_log.append(f"{self.player_names[self.player_ids.index(player_id)]} attempted to play an invalid meld")
+            self._log(EventType.INVALID_MELD, player_id)
             return False
         
         # Remove cards from player's hand and add to player's melds
-        cards.sort(key=lambda x: x.rank.value) # sort meld
-        meld = Meld([], meld_type)
-        allNewCards = True
-        for card in cards:
-            if card in player_hand:
-                player_hand.remove(card)
-                card.meld_type = meld_type
-                meld.cards.append(card)
-            elif card.rank == Rank.HIGH_ACE and card.meld_type == MeldType.NONE:
-                player_hand.remove(Card(card.suit, Rank.ACE, MeldType.NONE))
-                card.meld_type = meld_type
-                meld.cards.append(card)
-            else:
-                allNewCards = False
+        meld = Meld(meld_order(cards_in(new_mask), ace_high), meld_type, ace_high)
+        allNewCards = new_mask == mask
+        player_hand[:] = [card for card in player_hand if not card.mask & new_mask]
+        self.hand_masks[player_id] = hand_mask & ~new_mask
+        if meld_type == MeldType.SET:
+            self.set_mask |= new_mask
+        else:
+            self.run_mask |= new_mask
+        if ace_high:
+            self.high_ace_mask |= new_mask & ACE_MASK
+        meld_index = len(self.players_melds[player_id])
+        for position, card in enumerate(meld.cards):
+            self.locations[card.id] = Location(Place.MELD, player_id, meld_index, position)
         
         self.players_melds[player_id].append(meld)
-        meld_cards_info = f"{len(meld.cards)} card{'s' if len(meld.cards) > 1 else ''}"
-        self.event_log.append(f"{self.player_names[self.player_ids.index(player_id)]} {f'played a {meld.meld_type.name} of {meld_cards_info}' if allNewCards else f'added {meld_cards_info} to a {meld.meld_type.name}'}")
+        self._log(EventType.PLAYED_MELD if allNewCards else EventType.ADDED_TO_MELD, player_id, meld.cards, (meld.meld_type.value,))
         # Check if player's hand is empty (game end condition)
         if len(player_hand) == 0:
-            self.event_log.append(f"{self.player_names[self.player_ids.index(player_id)]} is out of cards!")
+            self._log(EventType.OUT_OF_CARDS, player_id)
             self._end_game()
         
         return True
     
+    @_recorded("discard")
     def discard_card(self, player_id: int, card: Card) -> bool:
         """
         Discard a card from a player's hand to the discard pile.
@@ -305,6 +594,7 @@ class RummyGame:
             
         Returns:
             True if the card was successfully discarded, False otherwise
+            (including when the player hasn't drawn yet)
             
         Raises:
             ValueError: If player_id is invalid
@@ -313,21 +603,24 @@ class RummyGame:
             raise ValueError(f"Invalid player ID: {player_id}")
         
         player_hand = self.players_hands[player_id]
-        if card not in player_hand:
+        if self.locations[card.id] != Location(Place.HAND, player_id):
             return False
         
         if not self.current_player_has_drawn:
-            self.event_log.append(f"{self.player_names[self.player_ids.index(player_id)]} attempted to discard before drawing a card")
-            return True
+            self._log(EventType.DISCARD_BEFORE_DRAW, player_id)
+            return False
         
         # Remove card from player's hand and add to discard pile
         player_hand.remove(card)
         player_hand.sort(key=lambda x: x.rank.value)
         self.discard_pile.append(card)
-        self.event_log.append(f"{self.player_names[self.player_ids.index(player_id)]} discarded the {card}")
+        self.hand_masks[player_id] &= ~card.mask
+        self.discard_mask |= card.mask
+        self.locations[card.id] = Location(Place.DISCARD, position=len(self.discard_pile) - 1)
+        self._log(EventType.DISCARDED, player_id, [card])
         # Check if player's hand is empty (game end condition)
         if len(player_hand) == 0:
-            self.event_log.append(f"{self.player_names[self.player_ids.index(player_id)]} is out of cards!")
+            self._log(EventType.OUT_OF_CARDS, player_id)
             self._end_game()
         else:
             # End the turn (move to next player)
@@ -335,9 +628,91 @@ class RummyGame:
         
         return True
     
+    @_recorded("sort")
     def sort_hand(self, player_id: int):
         player_hand = self.players_hands[player_id]
         player_hand.sort(key=lambda x: x.rank.value)
+        self._touch()
+
+    @_recorded("left")
+    def player_left(self, player_id: int) -> None:
+        """
+        Record that a player has left the game.
+
+        Args:
+            player_id: ID of the player who left
+        """
+        self._log(EventType.LEFT, player_id)
+
+    def _touch(self) -> None:
+        """Bump the state version so clients holding an older copy refetch it."""
+        self.version += 1
+
+    def _log(self, kind: EventType, player_id: Optional[str] = None, cards: List[Card] = (), values: Tuple[int, ...] = ()) -> None:
+        """Record an event in the game's log; this is a change clients can see, so it bumps the version."""
+        actor = self.player_ids.index(player_id) if player_id is not None else None
+        self.event_log.append(kind, actor, tuple(card.id for card in cards), self.round, values)
+        self._touch()
+
+    def get_events(self, cursor: int = 0) -> List[str]:
+        """
+        Get the human-readable text of every event after a cursor.
+
+        Args:
+            cursor: Sequence number of the last event the caller already has
+
+        Returns:
+            List of event descriptions, oldest first
+        """
+        return [self.describe_event(event) for event in self.event_log.since(cursor)]
+
+    def describe_event(self, event: Event) -> str:
+        """Render an event as the sentence shown in the client's log."""
+        name = self.player_names[event.actor] if event.actor is not None else ""
+        cards = [card_from_id(card_id) for card_id in event.cards]
+        match event.kind:
+            case EventType.DREW_STACK:
+                return f"{name} drew a card from the stack"
+            case EventType.DREW_DISCARD:
+                match len(cards):
+                    case 1:
+                        return f"{name} drew the {cards[0]} from the discard pile"
+                    case 2:
+                        return f"{name} drew the {cards[0]} and the {cards[1]} from the discard pile"
+                    case 3:
+                        return f"{name} drew the {cards[0]}, the {cards[1]}, and the {cards[2]} from the discard pile"
+                    case _:
+                        return f"{name} drew {len(cards)} cards from the discard pile, beginning with the {cards[0]}"
+            case EventType.ALREADY_DREW_STACK:
+                return f"{name} attempted to draw from the stack after having already drawn"
+            case EventType.ALREADY_DREW_DISCARD:
+                return f"{name} attempted to draw from the discard pile after having already drawn"
+            case EventType.INVALID_MELD:
+                return f"{name} attempted to play an invalid meld"
+            case EventType.PLAYED_MELD | EventType.ADDED_TO_MELD:
+                meld_cards_info = f"{len(cards)} card{'s' if len(cards) > 1 else ''}"
+                meld_type = MeldType(event.values[0]).name
+                if event.kind == EventType.PLAYED_MELD:
+                    return f"{name} played a {meld_type} of {meld_cards_info}"
+                return f"{name} added {meld_cards_info} to a {meld_type}"
+            case EventType.DISCARD_BEFORE_DRAW:
+                return f"{name} attempted to discard before drawing a card"
+            case EventType.DISCARDED:
+                return f"{name} discarded the {cards[0]}"
+            case EventType.OUT_OF_CARDS:
+                return f"{name} is out of cards!"
+            case EventType.ROUND_SCORE:
+                round_score, total = event.values
+                return f"{name} gets {round_score} points, for a total of {total}"
+            case EventType.WON:
+                return f"{name} wins!"
+            case EventType.PLAY_CONTINUES:
+                if event.values and event.values[0]:
+                    return "Players are tied at or above 500 - play continues"
+                return "No one has 500 points - play continues"
+            case EventType.LEFT:
+                return f"{name} left the game."
+        return event.kind.name
     
     def get_player_hand(self, player_id: int) -> List[Card]:
         """
@@ -357,6 +732,10 @@ class RummyGame:
         
         return self.players_hands[player_id].copy()
     
+    def get_card_location(self, card: Card) -> Location:
+        """Get where a card currently is."""
+        return self.locations[card.id]
+
     def get_stack_size(self) -> int:
         """Get the number of cards remaining in the stack."""
         return len(self.stack)
@@ -418,22 +797,18 @@ class RummyGame:
         
         return len(self.players_hands[player_id]) == 0
     
-    def _calculate_card_points(self, card: Card) -> int:
+    def _calculate_card_points(self, card: Card, ace_high: bool = False) -> int:
         """
         Calculate points for a single card.
         
         Args:
             card: The card to calculate points for
+            ace_high: Whether the card is in a meld where aces count high
             
         Returns:
-            Points for the card (15 for ace, 10 for face cards, 5 for number cards)
+            Points for the card (15 for high ace, 10 for face cards, 5 for number cards and low aces)
         """
-        if card.rank == Rank.HIGH_ACE:
-            return 15
-        elif card.rank in [Rank.JACK, Rank.QUEEN, Rank.KING]:
-            return 10
-        else:
-            return 5
+        return card_points(card, ace_high)
     
     def _calculate_player_score(self, player_id: int) -> int:
         """
@@ -450,7 +825,7 @@ class RummyGame:
         # Add points for cards in melds
         for meld in self.players_melds[player_id]:
             for card in meld.cards:
-                score += self._calculate_card_points(card)
+                score += self._calculate_card_points(card, meld.ace_high)
         
         # Subtract points for cards remaining in hand
         for card in self.players_hands[player_id]:
@@ -459,17 +834,14 @@ class RummyGame:
         return score
     
     def _end_game(self) -> None:
-        """End the game and calculate final scores."""
-        self.game_over = True
-        
+        """End the round and calculate scores; the game is over once someone reaches 500."""
         # Calculate scores for all players
         maxScore = 499 # if score is broken, in "winning" territory.  Will never be equal to this score b/c cards worth fives
         tied = False
         for player_id in self.player_ids:
             round_score = self._calculate_player_score(player_id)
-            name = self.player_names[self.player_ids.index(player_id)]
             self.scores[player_id] += round_score
-            self.event_log.append(f"{name} gets {round_score} points, for a total of {self.scores[player_id]}")
+            self._log(EventType.ROUND_SCORE, player_id, values=(round_score, self.scores[player_id]))
             if (self.scores[player_id] > maxScore):
                 maxScore = self.scores[player_id]
                 tied = False 
@@ -478,17 +850,16 @@ class RummyGame:
  
         if (maxScore >= 500 and not tied):
             # Find the winner (highest score)
-            self.winner = self.player_names[self.player_ids.index(max(self.player_ids, key=lambda pid: self.scores[pid]))]
-            self.event_log.append(f"{self.winner} wins!")
+            winner_id = max(self.player_ids, key=lambda pid: self.scores[pid])
+            self.winner = self.player_names[self.player_ids.index(winner_id)]
+            self.game_over = True
+            self._log(EventType.WON, winner_id)
             return
         
-        if (maxScore < 500 ):
-            self.event_log.append("No one has 500 points - play continues")
-        else:
-            self.event_log.append("Players are tied at or above 500 - play continues")
+        self._log(EventType.PLAY_CONTINUES, values=(int(maxScore >= 500),))
 
         # Create and shuffle deck
-        self._create_deck()
+        self._create_deck(self.round + 1)
 
         self._deal_cards()
 
@@ -502,6 +873,7 @@ class RummyGame:
     def end_turn(self) -> None:
         """End the current player's turn and move to the next player."""
         self.current_player_has_drawn = False
+        self._touch()
         self.current_player = (self.current_player + 1) % self.num_players
     
     def get_current_player(self) -> int:
@@ -0,0 +1,336 @@
+"""
+Headless batch simulator for rule-balance studies.
+
+Plays thousands of games at once as NumPy arrays, instead of one RummyGame
+object per game: every game's deck is a row of a permutation matrix, every
+hand is a row of booleans over the 52 card ids used by rummy.py, and melds
+are found for the whole batch with array operations.
+
+All seats play the same simple policy: take the top discard if it melds,
+otherwise draw from the stack; lay down every run, then every set, then lay
+off whatever extends the table; discard the highest-scoring card left.
+Rounds the engine would let drag on after the stack runs out are scored as
+they stand.
+
+Needs NumPy.  Run from the backend folder:
+
+    python simulate.py --games 10000 --players 4 --seed 1
+"""
+import argparse
+import json
+import time
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+SUITS = 4
+RANKS = 13
+DECK = SUITS * RANKS
+
+
+@dataclass
+class Rules:
+    """The house rules being simulated (defaults are the ones RummyGame plays)."""
+    players: int = 2
+    hand_size: int = 10
+    target: int = 500  # a game ends when one player alone has at least this many points
+    ace_points: int = 5  # aces in hand or in low runs
+    high_ace_points: int = 15  # aces in sets or above the king
+    face_points: int = 10
+    number_points: int = 5
+    max_turns: int = 500  # per round, a backstop for rounds where nobody can go out
+
+    def __post_init__(self):
+        """
+        Raises:
+            ValueError: If there are fewer than two players, or the deck can't deal every hand and a card to start the discards
+        """
+        if self.players < 2:
+            raise ValueError(f"Need at least 2 players, not {self.players}")
+        if self.hand_size < 1 or self.players * self.hand_size >= DECK:
+            raise ValueError(f"Can't deal {self.players} hands of {self.hand_size} from a {DECK}-card deck and have a card left to discard")
+
+
+def card_points(rules: Rules) -> np.ndarray:
+    """Points for each card id when not counting high."""
+    by_rank = np.array([rules.ace_points] + [rules.number_points] * 9 + [rules.face_points] * 3)
+    return np.tile(by_rank, SUITS)
+
+
+def find_runs(cards: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find every card that belongs to a run of three or more.
+
+    Args:
+        cards: (games, 52) booleans
+
+    Returns:
+        (games, 52) booleans for cards in runs, and (games, 52) booleans for
+        aces in those runs that count high.  An ace that could go either way
+        goes low.
+    """
+    h = cards.reshape(-1, SUITS, RANKS)
+    low_window = h[:, :, 0] & h[:, :, 1] & h[:, :, 2]
+    # Column 13 is the ace again, counting high, unless it is already needed low
+    h14 = np.concatenate([h, (h[:, :, 0] & ~low_window)[:, :, None]], axis=2)
+    windows = h14[:, :, :-2] & h14[:, :, 1:-1] & h14[:, :, 2:]
+    in_run = np.zeros_like(h14)
+    in_run[:, :, :-2] |= windows
+    in_run[:, :, 1:-1] |= windows
+    in_run[:, :, 2:] |= windows
+    high = in_run[:, :, 13] & ~in_run[:, :, 0]
+    runs = in_run[:, :, :RANKS].copy()
+    runs[:, :, 0] |= high
+    high_aces = np.zeros_like(runs)
+    high_aces[:, :, 0] = high
+    return runs.reshape(-1, DECK), high_aces.reshape(-1, DECK)
+
+
+def find_sets(cards: np.ndarray) -> np.ndarray:
+    """Find every card that belongs to a set of three or four, as (games, 52) booleans."""
+    h = cards.reshape(-1, SUITS, RANKS)
+    full = h.sum(axis=1) >= 3
+    return (h & full[:, None, :]).reshape(-1, DECK)
+
+
+def find_layoffs(cards: np.ndarray, table_runs: np.ndarray, table_sets: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find cards that extend melds already on the table.
+
+    Returns:
+        (games, 52) booleans for cards that extend runs, for aces among them
+        that count high, and for cards that extend sets
+    """
+    t = table_runs.reshape(-1, SUITS, RANKS)
+    t14 = np.concatenate([t, t[:, :, :1]], axis=2)
+    padded = np.pad(t14, ((0, 0), (0, 0), (2, 2)))
+    below1, below2 = padded[:, :, 1:-3], padded[:, :, :-4]
+    above1, above2 = padded[:, :, 3:-1], padded[:, :, 4:]
+    fits = (below1 & below2) | (above1 & above2) | (below1 & above1)
+    high = fits[:, :, 13] & ~fits[:, :, 0]
+    run_fits = fits[:, :, :RANKS].copy()
+    run_fits[:, :, 0] |= fits[:, :, 13]
+    h = cards.reshape(-1, SUITS, RANKS)
+    runs = h & run_fits
+    high_aces = np.zeros_like(runs)
+    high_aces[:, :, 0] = h[:, :, 0] & high
+    set_fits = table_sets.reshape(-1, SUITS, RANKS).sum(axis=1) >= 2
+    sets = h & ~run_fits & set_fits[:, None, :]
+    return runs.reshape(-1, DECK), high_aces.reshape(-1, DECK), sets.reshape(-1, DECK)
+
+
+def meld_hands(hands: np.ndarray, table_runs: np.ndarray, table_sets: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Lay down everything the policy would from each hand.
+
+    Returns:
+        (games, 52) booleans for cards melded into runs, into sets, and for
+        melded aces that count high
+    """
+    runs, high_aces = find_runs(hands)
+    sets = find_sets(hands & ~runs)
+    high_aces |= sets & _ACES
+    left = hands & ~runs & ~sets
+    table_runs = table_runs | runs
+    table_sets = table_sets | sets
+    for _ in range(3):  # each layoff can make room for another
+        more_runs, more_high, more_sets = find_layoffs(left, table_runs, table_sets)
+        if not (more_runs.any() or more_sets.any()):
+            break
+        runs |= more_runs
+        sets |= more_sets
+        high_aces |= more_high | (more_sets & _ACES)
+        left &= ~(more_runs | more_sets)
+        table_runs |= more_runs
+        table_sets |= more_sets
+    return runs, sets, high_aces
+
+
+_ACES = np.zeros(DECK, dtype=bool)
+_ACES[::RANKS] = True
+
+
+def play_rounds(rng: np.random.Generator, rules: Rules, start_seats: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Play one round in each of a batch of games.
+
+    Args:
+        rng: Random generator for the deal and discard tie-breaks
+        rules: The rules being simulated
+        start_seats: (games,) seat that plays first in each game
+
+    Returns:
+        (games, players) round scores, (games,) turns taken, and (games,)
+        whether the round ended because the stack ran out
+    """
+    n, players = len(start_seats), rules.players
+    rows = np.arange(n)
+    points = card_points(rules)
+    bonus = rules.high_ace_points - rules.ace_points
+
+    deck = rng.permuted(np.broadcast_to(np.arange(DECK), (n, DECK)), axis=1)
+    dealt = rules.hand_size * players
+    hands = np.zeros((n, players, DECK), dtype=bool)
+    seats_dealt = np.arange(dealt) % players
+    hands[rows[:, None], seats_dealt[None, :], deck[:, :dealt]] = True
+    discards = np.full((n, DECK), -1)
+    discards[:, 0] = deck[:, dealt]
+    discard_count = np.ones(n, dtype=int)
+    next_card = np.full(n, dealt + 1)
+    table_runs = np.zeros((n, DECK), dtype=bool)
+    table_sets = np.zeros((n, DECK), dtype=bool)
+    melded_points = np.zeros((n, players), dtype=int)
+
+    seat = start_seats.copy()
+    active = np.ones(n, dtype=bool)
+    exhausted = np.zeros(n, dtype=bool)
+    turns = np.zeros(n, dtype=int)
+    for _ in range(rules.max_turns):
+        idx = np.nonzero(active)[0]
+        if idx.size == 0:
+            break
+        k = np.arange(idx.size)
+        s = seat[idx]
+        hand = hands[idx, s]
+        runs_on_table, sets_on_table = table_runs[idx], table_sets[idx]
+
+        # Draw: the top discard if it would be melded, otherwise the stack
+        top = discards[idx, discard_count[idx] - 1]
+        with_top = hand.copy()
+        with_top[k, top] = True
+        runs, sets, _ = meld_hands(with_top, runs_on_table, sets_on_table)
+        take = (runs | sets)[k, top]
+        out_of_stack = ~take & (next_card[idx] >= DECK)
+        exhausted[idx[out_of_stack]] = True
+        active[idx[out_of_stack]] = False
+        keep = ~out_of_stack
+        idx, k, s, hand, top, take = idx[keep], np.arange(keep.sum()), s[keep], hand[keep], top[keep], take[keep]
+        runs_on_table, sets_on_table = runs_on_table[keep], sets_on_table[keep]
+        drawn = np.where(take, top, deck[idx, np.minimum(next_card[idx], DECK - 1)])
+        discard_count[idx] -= take
+        next_card[idx] += ~take
+        hand[k, drawn] = True
+
+        # Meld
+        runs, sets, high_aces = meld_hands(hand, runs_on_table, sets_on_table)
+        melded = runs | sets
+        melded_points[idx, s] += (melded * points).sum(axis=1) + high_aces.sum(axis=1) * bonus
+        table_runs[idx] |= runs
+        table_sets[idx] |= sets
+        hand &= ~melded
+        out = ~hand.any(axis=1)
+
+        # Discard the most expensive card left, breaking ties at random
+        cost = np.where(hand, points + rng.random((idx.size, DECK)), -1.0)
+        discard = cost.argmax(axis=1)
+        discarding = ~out
+        hand[k[discarding], discard[discarding]] = False
+        discards[idx[discarding], discard_count[idx[discarding]]] = discard[discarding]
+        discard_count[idx] += discarding
+        out |= ~hand.any(axis=1)
+
+        hands[idx, s] = hand
+        turns[idx] += 1
+        seat[idx] = (s + 1) % players
+        active[idx[out]] = False
+
+    scores = melded_points - (hands * points).sum(axis=2)
+    return scores, turns, exhausted
+
+
+def simulate(games: int, rules: Rules, seed: int = 0, batch_size: int = 4096) -> Dict:
+    """
+    Play whole games to the target score and summarize them.
+
+    Args:
+        games: Number of games to play
+        rules: The rules being simulated
+        seed: Seed for the random generator, so runs can be repeated
+        batch_size: Number of games played at once
+
+    Returns:
+        Throughput and score distributions
+    """
+    rng = np.random.default_rng(seed)
+    round_scores: List[np.ndarray] = []
+    final_scores: List[np.ndarray] = []
+    rounds_per_game: List[np.ndarray] = []
+    winners: List[np.ndarray] = []
+    turns_per_round: List[np.ndarray] = []
+    exhausted_rounds = 0
+    started = time.perf_counter()
+    for first in range(0, games, batch_size):
+        n = min(batch_size, games - first)
+        totals = np.zeros((n, rules.players), dtype=int)
+        rounds = np.zeros(n, dtype=int)
+        playing = np.arange(n)
+        while playing.size:
+            scores, turns, exhausted = play_rounds(rng, rules, rounds[playing] % rules.players)
+            totals[playing] += scores
+            rounds[playing] += 1
+            round_scores.append(scores.ravel())
+            turns_per_round.append(turns)
+            exhausted_rounds += int(exhausted.sum())
+            best = totals[playing].max(axis=1)
+            unique = (totals[playing] == best[:, None]).sum(axis=1) == 1
+            playing = playing[~((best >= rules.target) & unique)]
+        final_scores.append(totals.ravel())
+        rounds_per_game.append(rounds)
+        winners.append(totals.argmax(axis=1))
+    elapsed = time.perf_counter() - started
+
+    round_scores_all = np.concatenate(round_scores)
+    final_scores_all = np.concatenate(final_scores)
+    rounds_all = np.concatenate(rounds_per_game)
+    winners_all = np.concatenate(winners)
+    turns_all = np.concatenate(turns_per_round)
+    return {
+        "rules": asdict(rules),
+        "games": games,
+        "rounds": int(rounds_all.sum()),
+        "seconds": round(elapsed, 3),
+        "games_per_second": round(games / elapsed, 1),
+        "rounds_per_second": round(rounds_all.sum() / elapsed, 1),
+        "rounds_per_game": _distribution(rounds_all),
+        "turns_per_round": _distribution(turns_all),
+        "exhausted_rounds": round(exhausted_rounds / rounds_all.sum(), 4),
+        "round_score": _distribution(round_scores_all),
+        "final_score": _distribution(final_scores_all),
+        "win_rate_by_seat": [round(float(rate), 4) for rate in np.bincount(winners_all, minlength=rules.players) / games],
+    }
+
+
+def _distribution(values: np.ndarray) -> Dict[str, float]:
+    percentiles = np.percentile(values, [1, 10, 50, 90, 99])
+    return {
+        "mean": round(float(values.mean()), 2),
+        "std": round(float(values.std()), 2),
+        "min": int(values.min()),
+        "p1": float(percentiles[0]),
+        "p10": float(percentiles[1]),
+        "p50": float(percentiles[2]),
+        "p90": float(percentiles[3]),
+        "p99": float(percentiles[4]),
+        "max": int(values.max()),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simulate many games of rummy at once")
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=4096)
+    defaults = Rules()
+    for field, value in asdict(defaults).items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=int, default=value)
+    args = parser.parse_args()
+    try:
+        rules = Rules(**{field: getattr(args, field) for field in asdict(defaults)})
+    except ValueError as e:
+        parser.error(str(e))
+    print(json.dumps(simulate(args.games, rules, args.seed, args.batch_size), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,609 @@
+"""
+Where the server keeps its games and players.
+
+MemoryStore keeps them in this process (optionally journaled to SQLite so
+they survive a restart, see persistence.py).  SqliteStore keeps them in a
+SQLite database in WAL mode that every worker process shares, so the server
+can run as several processes.  Moves go through make_move, which in the
+shared store reads the game, makes the move and writes it back only if
+nobody else saved the game in between, trying again if someone did.  The
+shared store keeps each game's whole event log in a table beside it, since
+a game read back from its snapshot only holds the latest events.
+"""
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from events import Event, pack_event, unpack_event
+from moves import apply_move
+from persistence import GameJournal
+from rummy import RummyGame
+
+MOVE_ATTEMPTS = 5  # times a move is retried in the shared store when another process saves the game first
+LOBBY_STRIPES = 64  # locks guarding the waiting room, shared out by player name
+TOUCH_INTERVAL = 5  # seconds between writes of a player's or game's activity time to the shared store
+BOT_CLAIM_SECONDS = 60  # after which a bot turn claimed by a process that never made it can be claimed again
+
+
+@dataclass
+class Player:
+    """A player, or the computer playing a seat."""
+    player_id: str
+    name: str
+    game_id: Optional[str] = None  # None while in the waiting room
+    bot: Optional[str] = None  # difficulty, for seats played by the computer
+
+
+class StoreConflict(Exception):
+    """A game kept changing under a move until it ran out of attempts, or changed under a move made for one version."""
+
+
+class LockStripes:
+    """
+    A fixed set of locks shared out by key.
+
+    Requests about different keys rarely wait on each other, yet there is no
+    lock per key to create or clean up.
+    """
+
+    def __init__(self, count: int = LOBBY_STRIPES):
+        self.locks = [threading.Lock() for _ in range(count)]
+
+    @contextmanager
+    def holding(self, keys: Iterable[str]) -> Iterator[None]:
+        """Hold the locks for all the given keys, taken in a fixed order so two callers can't deadlock."""
+        locks = [self.locks[i] for i in sorted({hash(key) % len(self.locks) for key in keys})]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+
+def pack_game(game: RummyGame) -> bytes:
+    """Serialize a game compactly: its snapshot as JSON, deflated."""
+    return zlib.compress(json.dumps(game.snapshot(), separators=(",", ":")).encode(), 1)
+
+
+def unpack_game(data: bytes) -> RummyGame:
+    return RummyGame.restore(json.loads(zlib.decompress(data)))
+
+
+class Store:
+    """Interface shared by the stores."""
+
+    shared = False  # whether other processes see and change the same games
+
+    def get_game(self, game_id: str) -> Optional[RummyGame]:
+        """A game, for reading only; changes go through make_move."""
+        raise NotImplementedError
+
+    def game_version(self, game_id: str) -> Optional[int]:
+        """A game's version, without loading the game."""
+        raise NotImplementedError
+
+    def game_ids(self) -> List[str]:
+        raise NotImplementedError
+
+    def start_game(self, game_id: str, game: RummyGame, players: List[Player]) -> bool:
+        """
+        Save a new game and seat its players.
+
+        Returns:
+            False (saving nothing) if one of the human players is no longer waiting
+        """
+        raise NotImplementedError
+
+    def make_move(self, game_id: str, player_id: str, move: str, data: Any = None,
+                  expected_version: Optional[int] = None) -> Optional[RummyGame]:
+        """
+        Make a move and save the game.
+
+        Args:
+            game_id: The game to move in
+            player_id, move, data: The move, as moves.apply_move takes it
+            expected_version: The version the move was worked out for, if it only makes sense there (a bot's move)
+
+        Returns:
+            The game after the move, or None if there is no such game
+
+        Raises:
+            StoreConflict: If the game kept changing under the move, or isn't at expected_version
+        """
+        raise NotImplementedError
+
+    def remove_game(self, game_id: str) -> None:
+        """Forget a game and every seat in it."""
+        raise NotImplementedError
+
+    def get_player(self, player_id: str) -> Optional[Player]:
+        raise NotImplementedError
+
+    def join_lobby(self, player: Player) -> bool:
+        """
+        Add a player to the waiting room.
+
+        Returns:
+            False (adding nobody) if someone with the same name is already waiting
+        """
+        raise NotImplementedError
+
+    def save_player(self, player: Player) -> None:
+        """Save changes to a player who is already stored."""
+        raise NotImplementedError
+
+    def remove_player(self, player_id: str) -> None:
+        raise NotImplementedError
+
+    def waiting_players(self) -> List[Player]:
+        """The waiting room, in the order players joined."""
+        raise NotImplementedError
+
+    def waiting_player(self, name: str) -> Optional[Player]:
+        """The player waiting under a name, ignoring case, if there is one."""
+        raise NotImplementedError
+
+    def lobby_version(self) -> int:
+        raise NotImplementedError
+
+    def touch_lobby(self) -> int:
+        """Bump the waiting room's version after it changes, and return the new one."""
+        raise NotImplementedError
+
+    def touch_player(self, player_id: str, now: float) -> None:
+        """Note that a player was active (moves note their game's activity themselves)."""
+        raise NotImplementedError
+
+    def touch_game(self, game_id: str, now: float) -> None:
+        raise NotImplementedError
+
+    def idle_players(self, before: float) -> List[str]:
+        """IDs of the human players not active since the given time."""
+        raise NotImplementedError
+
+    def games_by_activity(self) -> List[Tuple[str, float, bool]]:
+        """Every game as (ID, when it was last active, whether it is over), least recently active first."""
+        raise NotImplementedError
+
+    def claim_bot_turn(self, game_id: str, version: int) -> bool:
+        """
+        Claim working out the bot move due at a game's version, so only one process does.
+
+        Returns:
+            False if another process has claimed it
+        """
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStore(Store):
+    """
+    Games and players in this process's memory; only one server process can use them.
+
+    Each game is changed by one thread at a time (the server holds a lock
+    per game around moves), while the waiting room is guarded by locks
+    striped by player name, so joins under different names don't queue up.
+    """
+
+    def __init__(self, journal: Optional[GameJournal] = None):
+        """
+        Args:
+            journal: Where to journal moves so games survive a restart; saved games are loaded from it
+        """
+        self.journal = journal
+        self.games: Dict[str, RummyGame] = {}
+        self.players: Dict[str, Player] = {}
+        self.waiting: Dict[str, Player] = {}  # the waiting room, in joining order
+        self.waiting_names: Dict[str, str] = {}  # lowercased name -> ID of the player waiting under it
+        self.lobby_locks = LockStripes()
+        self.lobby = 0
+        self.lobby_lock = threading.Lock()
+        # When each game and player was last active, least recently active first
+        self.game_activity: "OrderedDict[str, float]" = OrderedDict()
+        self.player_activity: "OrderedDict[str, float]" = OrderedDict()
+        if journal is not None:
+            games, players = journal.load()
+            now = time.time()
+            self.games.update(games)
+            for game_id in games:
+                self.game_activity[game_id] = now
+            for saved in players:
+                player = Player(saved.player_id, saved.name, saved.game_id, saved.bot)
+                self.players[player.player_id] = player
+                self.player_activity[player.player_id] = now
+                if player.game_id is None:
+                    self.waiting[player.player_id] = player
+                    self.waiting_names[player.name.lower()] = player.player_id
+
+    def get_game(self, game_id: str) -> Optional[RummyGame]:
+        return self.games.get(game_id)
+
+    def game_version(self, game_id: str) -> Optional[int]:
+        game = self.games.get(game_id)
+        return game.version if game is not None else None
+
+    def game_ids(self) -> List[str]:
+        return list(self.games)
+
+    def start_game(self, game_id: str, game: RummyGame, players: List[Player]) -> bool:
+        humans = [player for player in players if player.bot is None]
+        with self.lobby_locks.holding(player.name.lower() for player in humans):
+            if any(player.player_id not in self.waiting for player in humans):
+                return False
+            self.games[game_id] = game
+            for player in players:
+                waiting = self.waiting.pop(player.player_id, None)
+                if waiting is not None:
+                    self.waiting_names.pop(waiting.name.lower(), None)
+                self.players[player.player_id] = player
+        now = time.time()
+        self.touch_game(game_id, now)
+        for player in players:
+            self.touch_player(player.player_id, now)
+        if self.journal is not None:
+            self.journal.save_game(game_id, game)
+            for player in players:
+                self.journal.save_player(player.player_id, player.name, game_id, player.bot)
+        return True
+
+    def make_move(self, game_id: str, player_id: str, move: str, data: Any = None,
+                  expected_version: Optional[int] = None) -> Optional[RummyGame]:
+        game = self.games.get(game_id)
+        if game is None:
+            return None
+        if expected_version is not None and game.version != expected_version:
+            raise StoreConflict(f"Game {game_id} moved on from version {expected_version}")
+        round_number = game.round
+        apply_move(game, player_id, move, data)
+        self.touch_game(game_id, time.time())
+        if self.journal is not None:
+            if game.round != round_number:
+                # Start again from a snapshot, as a game saved without a seed can't replay the new deal's shuffle
+                self.journal.save_game(game_id, game)
+            else:
+                self.journal.append_move(game_id, game, player_id, move, data)
+        return game
+
+    def remove_game(self, game_id: str) -> None:
+        game = self.games.pop(game_id, None)
+        self.game_activity.pop(game_id, None)
+        if game is None:
+            return
+        for player_id in game.player_ids:
+            self.players.pop(player_id, None)
+            self.player_activity.pop(player_id, None)
+        if self.journal is not None:
+            self.journal.remove_game(game_id)
+            for player_id in game.player_ids:
+                self.journal.remove_player(player_id)
+
+    def get_player(self, player_id: str) -> Optional[Player]:
+        return self.players.get(player_id)
+
+    def join_lobby(self, player: Player) -> bool:
+        name = player.name.lower()
+        with self.lobby_locks.holding([name]):
+            if name in self.waiting_names:
+                return False
+            self.players[player.player_id] = player
+            self.waiting[player.player_id] = player
+            self.waiting_names[name] = player.player_id
+        self.touch_player(player.player_id, time.time())
+        if self.journal is not None:
+            self.journal.save_player(player.player_id, player.name)
+        return True
+
+    def save_player(self, player: Player) -> None:
+        self.players[player.player_id] = player
+        if self.journal is not None:
+            self.journal.save_player(player.player_id, player.name, player.game_id, player.bot)
+
+    def remove_player(self, player_id: str) -> None:
+        player = self.players.get(player_id)
+        if player is None:
+            return
+        with self.lobby_locks.holding([player.name.lower()]):
+            self.players.pop(player_id, None)
+            if self.waiting.pop(player_id, None) is not None:
+                self.waiting_names.pop(player.name.lower(), None)
+        self.player_activity.pop(player_id, None)
+        if self.journal is not None:
+            self.journal.remove_player(player_id)
+
+    def waiting_players(self) -> List[Player]:
+        return list(self.waiting.values())
+
+    def waiting_player(self, name: str) -> Optional[Player]:
+        player_id = self.waiting_names.get(name.lower())
+        return self.waiting.get(player_id) if player_id is not None else None
+
+    def lobby_version(self) -> int:
+        return self.lobby
+
+    def touch_lobby(self) -> int:
+        with self.lobby_lock:
+            self.lobby += 1
+            return self.lobby
+
+    def touch_player(self, player_id: str, now: float) -> None:
+        if player_id in self.players:
+            self.player_activity[player_id] = now
+            self.player_activity.move_to_end(player_id)
+
+    def touch_game(self, game_id: str, now: float) -> None:
+        if game_id in self.games:
+            self.game_activity[game_id] = now
+            self.game_activity.move_to_end(game_id)
+
+    def idle_players(self, before: float) -> List[str]:
+        idle = []
+        for player_id, last_active in list(self.player_activity.items()):
+            if last_active >= before:
+                break
+            player = self.players.get(player_id)
+            if player is None:
+                self.player_activity.pop(player_id, None)  # removed while being touched
+            elif player.bot is None:
+                idle.append(player_id)
+        return idle
+
+    def games_by_activity(self) -> List[Tuple[str, float, bool]]:
+        games = []
+        for game_id, last_active in list(self.game_activity.items()):
+            game = self.games.get(game_id)
+            if game is None:
+                self.game_activity.pop(game_id, None)
+            else:
+                games.append((game_id, last_active, game.winner is not None))
+        return games
+
+    def close(self) -> None:
+        if self.journal is not None:
+            self.journal.close()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shared_games (
+    game_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    data BLOB NOT NULL,  -- pack_game
+    finished INTEGER NOT NULL DEFAULT 0,
+    last_active REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS shared_games_by_activity ON shared_games (last_active);
+CREATE TABLE IF NOT EXISTS shared_events (
+    game_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,  -- pack_event, as JSON
+    PRIMARY KEY (game_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS shared_bot_turns (
+    game_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,  -- of the game, when the bot move being worked out is due
+    claimed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shared_players (
+    player_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    game_id TEXT,
+    bot TEXT,
+    joined INTEGER NOT NULL,
+    last_active REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS shared_players_by_game ON shared_players (game_id);
+CREATE INDEX IF NOT EXISTS shared_players_by_activity ON shared_players (last_active);
+CREATE INDEX IF NOT EXISTS shared_players_waiting ON shared_players (joined) WHERE game_id IS NULL;
+CREATE INDEX IF NOT EXISTS shared_players_waiting_by_name ON shared_players (lower(name)) WHERE game_id IS NULL;
+CREATE TABLE IF NOT EXISTS shared_lobby (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO shared_lobby (id, version) VALUES (0, 0);
+"""
+
+
+class SqliteStore(Store):
+    """
+    Games and players in a SQLite database every server process shares.
+
+    Each thread has its own connection.  Games read for display are cached
+    per process and reused for as long as their version hasn't moved on.
+    Every event is saved to shared_events along with the move that made it,
+    and games read back load the events their snapshot left out from there.
+    A bot's move is worked out by whichever process claims it in
+    shared_bot_turns, and saved only if the game is still at the version
+    it was worked out for.
+    """
+
+    shared = True
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite database file, created if missing
+        """
+        self.path = path
+        self.local = threading.local()
+        self.cache: Dict[str, Tuple[int, RummyGame]] = {}  # game ID -> (version, game)
+        self.touched: Dict[Tuple[str, str], float] = {}  # (table, ID) -> when this process last wrote its activity
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def get_game(self, game_id: str) -> Optional[RummyGame]:
+        cached = self.cache.get(game_id)
+        row = self._connection().execute(
+            "SELECT version, CASE WHEN version = ? THEN NULL ELSE data END FROM shared_games WHERE game_id = ?",
+            (cached[0] if cached else -1, game_id)).fetchone()
+        if row is None:
+            self.cache.pop(game_id, None)
+            return None
+        version, data = row
+        if data is None:
+            return cached[1]
+        game = self._unpack(game_id, data)
+        self.cache[game_id] = (version, game)
+        return game
+
+    def _unpack(self, game_id: str, data: bytes) -> RummyGame:
+        game = unpack_game(data)
+        game.event_log.load_dropped = lambda cursor, end: self._read_events(game_id, cursor, end)
+        return game
+
+    def _read_events(self, game_id: str, cursor: int, end: int) -> List[Event]:
+        return [unpack_event(seq, json.loads(data)) for seq, data in self._connection().execute(
+            "SELECT seq, data FROM shared_events WHERE game_id = ? AND seq > ? AND seq <= ? ORDER BY seq", (game_id, cursor, end))]
+
+    def _save_events(self, connection: sqlite3.Connection, game_id: str, events: List[Event]) -> None:
+        connection.executemany("INSERT OR REPLACE INTO shared_events (game_id, seq, data) VALUES (?, ?, ?)",
+                               [(game_id, event.seq, json.dumps(pack_event(event), separators=(",", ":"))) for event in events])
+
+    def game_version(self, game_id: str) -> Optional[int]:
+        row = self._connection().execute("SELECT version FROM shared_games WHERE game_id = ?", (game_id,)).fetchone()
+        return row[0] if row else None
+
+    def game_ids(self) -> List[str]:
+        return [row[0] for row in self._connection().execute("SELECT game_id FROM shared_games")]
+
+    def start_game(self, game_id: str, game: RummyGame, players: List[Player]) -> bool:
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            for player in players:
+                if player.bot is not None:
+                    connection.execute("INSERT INTO shared_players (player_id, name, game_id, bot, joined, last_active) VALUES (?, ?, ?, ?, 0, ?)",
+                                       (player.player_id, player.name, game_id, player.bot, now))
+                elif connection.execute("UPDATE shared_players SET game_id = ?, last_active = ? WHERE player_id = ? AND game_id IS NULL",
+                                        (game_id, now, player.player_id)).rowcount == 0:
+                    connection.execute("ROLLBACK")
+                    return False
+            connection.execute("INSERT INTO shared_games (game_id, version, data, last_active) VALUES (?, ?, ?, ?)",
+                               (game_id, game.version, pack_game(game), now))
+            self._save_events(connection, game_id, game.event_log.since(0))
+        return True
+
+    def make_move(self, game_id: str, player_id: str, move: str, data: Any = None,
+                  expected_version: Optional[int] = None) -> Optional[RummyGame]:
+        connection = self._connection()
+        for _ in range(MOVE_ATTEMPTS):
+            row = connection.execute("SELECT version, data FROM shared_games WHERE game_id = ?", (game_id,)).fetchone()
+            if row is None:
+                return None
+            version, packed = row
+            if expected_version is not None and version != expected_version:
+                raise StoreConflict(f"Game {game_id} moved on from version {expected_version}")
+            game = self._unpack(game_id, packed)
+            cursor = game.event_log.cursor
+            apply_move(game, player_id, move, data)
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                saved = connection.execute(
+                    "UPDATE shared_games SET version = ?, data = ?, finished = ?, last_active = ? WHERE game_id = ? AND version = ?",
+                    (game.version, pack_game(game), game.winner is not None, time.time(), game_id, version)).rowcount
+                if saved:
+                    self._save_events(connection, game_id, game.event_log.since(cursor))
+            if saved:
+                self.cache[game_id] = (game.version, game)
+                return game
+            if expected_version is not None:
+                raise StoreConflict(f"Game {game_id} moved on from version {expected_version}")
+        raise StoreConflict(f"Game {game_id} kept changing during a move")
+
+    def remove_game(self, game_id: str) -> None:
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM shared_players WHERE game_id = ?", (game_id,))
+            connection.execute("DELETE FROM shared_games WHERE game_id = ?", (game_id,))
+            connection.execute("DELETE FROM shared_events WHERE game_id = ?", (game_id,))
+            connection.execute("DELETE FROM shared_bot_turns WHERE game_id = ?", (game_id,))
+        self.cache.pop(game_id, None)
+
+    def get_player(self, player_id: str) -> Optional[Player]:
+        row = self._connection().execute("SELECT player_id, name, game_id, bot FROM shared_players WHERE player_id = ?",
+                                         (player_id,)).fetchone()
+        return Player(*row) if row else None
+
+    def join_lobby(self, player: Player) -> bool:
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            taken = connection.execute("SELECT 1 FROM shared_players WHERE game_id IS NULL AND lower(name) = lower(?)",
+                                       (player.name,)).fetchone()
+            if taken:
+                return False
+            connection.execute("INSERT INTO shared_players (player_id, name, game_id, bot, joined, last_active)"
+                               " VALUES (?, ?, NULL, NULL, (SELECT COALESCE(MAX(joined), 0) + 1 FROM shared_players), ?)",
+                               (player.player_id, player.name, time.time()))
+        return True
+
+    def save_player(self, player: Player) -> None:
+        self._connection().execute("UPDATE shared_players SET name = ?, game_id = ?, bot = ? WHERE player_id = ?",
+                                   (player.name, player.game_id, player.bot, player.player_id))
+
+    def remove_player(self, player_id: str) -> None:
+        self._connection().execute("DELETE FROM shared_players WHERE player_id = ?", (player_id,))
+
+    def waiting_players(self) -> List[Player]:
+        return [Player(*row) for row in self._connection().execute(
+            "SELECT player_id, name, game_id, bot FROM shared_players WHERE game_id IS NULL ORDER BY joined")]
+
+    def waiting_player(self, name: str) -> Optional[Player]:
+        row = self._connection().execute("SELECT player_id, name, game_id, bot FROM shared_players"
+                                         " WHERE game_id IS NULL AND lower(name) = lower(?)", (name,)).fetchone()
+        return Player(*row) if row else None
+
+    def lobby_version(self) -> int:
+        return self._connection().execute("SELECT version FROM shared_lobby").fetchone()[0]
+
+    def touch_lobby(self) -> int:
+        return self._connection().execute("UPDATE shared_lobby SET version = version + 1 RETURNING version").fetchone()[0]
+
+    def touch_player(self, player_id: str, now: float) -> None:
+        self._touch("shared_players", "player_id", player_id, now)
+
+    def touch_game(self, game_id: str, now: float) -> None:
+        self._touch("shared_games", "game_id", game_id, now)
+
+    def _touch(self, table: str, column: str, key: str, now: float) -> None:
+        # Activity only needs to be roughly right, so each process writes it at most every TOUCH_INTERVAL
+        if now - self.touched.get((table, key), 0) < TOUCH_INTERVAL:
+            return
+        if len(self.touched) > 100000:
+            self.touched.clear()
+        self.touched[(table, key)] = now
+        self._connection().execute(f"UPDATE {table} SET last_active = ? WHERE {column} = ?", (now, key))
+
+    def claim_bot_turn(self, game_id: str, version: int) -> bool:
+        now = time.time()
+        return self._connection().execute(
+            "INSERT INTO shared_bot_turns (game_id, version, claimed) VALUES (?, ?, ?)"
+            " ON CONFLICT (game_id) DO UPDATE SET version = excluded.version, claimed = excluded.claimed"
+            " WHERE version < excluded.version OR claimed < ?",
+            (game_id, version, now, now - BOT_CLAIM_SECONDS)).rowcount > 0
+
+    def idle_players(self, before: float) -> List[str]:
+        return [row[0] for row in self._connection().execute(
+            "SELECT player_id FROM shared_players WHERE bot IS NULL AND last_active < ?", (before,))]
+
+    def games_by_activity(self) -> List[Tuple[str, float, bool]]:
+        return [(game_id, last_active, bool(finished)) for game_id, last_active, finished in self._connection().execute(
+            "SELECT game_id, last_active, finished FROM shared_games ORDER BY last_active")]
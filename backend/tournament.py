@@ -0,0 +1,297 @@
+"""
+Bot tournaments: strategies play each other in headless two-player games,
+spread over every core, and come out with ratings on the Elo scale.
+
+A match between two strategies is a number of deals, each played twice
+with the seats swapped.  Every game is shuffled from its deal's seed (see
+RummyGame's seed), so both strategies get exactly the same cards from
+each seat and the luck of the deal cancels out in each pair.  Round robins
+play every pair on the same deals; Swiss tournaments pair strategies with
+similar scores each round, on fresh deals.
+
+Ratings are the Bradley-Terry fit to every game's result (a draw counts
+half), on the Elo scale and centred on 1500, so they don't depend on the
+order games finished in.  One drawn game between every two strategies is
+added to the results, which keeps a strategy that never won (or never
+lost) at a finite rating.  Confidence intervals come from refitting on
+deal pairs resampled with replacement.
+
+Games where the stack runs out can go on forever (RandomStrategy never
+takes from the discard pile while it can't meld it away), so a game that
+reaches --max-turns is stopped and counted as a draw.
+
+Strategies are named as "random", "greedy", "easy", "medium" or "hard"
+(the server's bots; "hard:0.02" thinks for 0.02s a decision), or as
+"module:Class" for any Strategy subclass that takes no arguments:
+
+    python tournament.py random greedy hard:0.01 --deals 200
+    python tournament.py greedy mybots:CleverStrategy --swiss 5 --deals 50
+"""
+import argparse
+import importlib
+import json
+import math
+import os
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from bots import GreedyStrategy, RandomStrategy, Strategy, make_strategy, take_turn
+from rummy import RummyGame
+
+DIFFICULTIES = ("easy", "medium", "hard")
+DEFAULT_BUDGET = 0.05  # seconds a decision for the server's bots, unless a strategy names its own
+
+Game = Tuple[str, str, int]  # (strategy in the first seat, strategy in the second, deal seed)
+Result = Tuple[float, int, bool]  # (the first seat's score: 1 win, 0.5 draw, 0 loss; turns played; whether stopped at the turn limit)
+
+_strategies: Dict[str, Strategy] = {}  # name -> strategy, built once per worker process
+
+
+def make_entrant(name: str) -> Strategy:
+    """
+    The strategy a tournament entrant names.
+
+    Raises:
+        ValueError: If the name isn't a known strategy or an importable Strategy subclass
+    """
+    kind, _, argument = name.partition(":")
+    if kind == "random":
+        return RandomStrategy()
+    if kind == "greedy":
+        return GreedyStrategy()
+    if kind in DIFFICULTIES:
+        return make_strategy(kind, float(argument) if argument else DEFAULT_BUDGET)
+    if argument:
+        try:
+            strategy = getattr(importlib.import_module(kind), argument)()
+        except (ImportError, AttributeError, TypeError) as e:
+            raise ValueError(f"Can't load strategy {name}: {e}") from None
+        if isinstance(strategy, Strategy):
+            return strategy
+    raise ValueError(f"Unknown strategy: {name}")
+
+
+def play(game: Game, max_turns: int) -> Result:
+    """Play one game to the end (or the turn limit); what each worker process runs."""
+    first, second, seed = game
+    for name in (first, second):
+        if name not in _strategies:
+            _strategies[name] = make_entrant(name)
+    strategies = [_strategies[first], _strategies[second]]
+    ids = ["seat-0", "seat-1"]
+    rummy = RummyGame(2, [first, second], ids, seed=seed)
+    rng = random.Random(f"{seed}:{first}:{second}")  # the strategies' own choices, the same on every run
+    turns = 0
+    while not rummy.is_game_over() and turns < max_turns:
+        take_turn(rummy, strategies[rummy.current_player], rng)
+        turns += 1
+    if not rummy.is_game_over():
+        return 0.5, turns, True
+    return (1.0 if rummy.winner == first else 0.0), turns, False
+
+
+def play_all(pool: Optional[ProcessPoolExecutor], games: List[Game], max_turns: int) -> List[Result]:
+    """Play games across the pool (or in this process, without one), results in the games' order."""
+    if pool is None:
+        return [play(game, max_turns) for game in games]
+    chunk = max(1, len(games) // (8 * (os.cpu_count() or 1)))  # enough chunks to keep every worker busy to the end
+    return list(pool.map(play, games, [max_turns] * len(games), chunksize=chunk))
+
+
+class Results:
+    """Every game's result, kept by pair of strategies and deal so ratings can be refitted on resamples."""
+
+    def __init__(self, entrants: List[str]):
+        self.entrants = entrants
+        # (a, b) with a before b in entrants -> deal seed -> a's scores in the deal's games
+        self.deals: Dict[Tuple[str, str], Dict[int, List[float]]] = defaultdict(lambda: defaultdict(list))
+        self.turns = 0
+        self.games = 0
+        self.capped = 0
+
+    def add(self, game: Game, result: Result) -> None:
+        first, second, seed = game
+        score, turns, capped = result
+        if self.entrants.index(first) > self.entrants.index(second):
+            first, second, score = second, first, 1 - score
+        self.deals[(first, second)][seed].append(score)
+        self.games += 1
+        self.turns += turns
+        self.capped += capped
+
+    def points(self) -> Dict[str, float]:
+        """Each strategy's total score (1 a win, 0.5 a draw)."""
+        points = {name: 0.0 for name in self.entrants}
+        for (a, b), deals in self.deals.items():
+            for scores in deals.values():
+                points[a] += sum(scores)
+                points[b] += len(scores) - sum(scores)
+        return points
+
+    def tallies(self, rng: Optional[random.Random] = None) -> Tuple[Dict[Tuple[str, str], float], Dict[Tuple[str, str], int]]:
+        """
+        Each pair's score and games, the first of the pair's score counted;
+        over deals resampled with replacement if given an rng.
+        """
+        wins: Dict[Tuple[str, str], float] = {}
+        games: Dict[Tuple[str, str], int] = {}
+        for pair, deals in self.deals.items():
+            chosen = list(deals.values())
+            if rng is not None:
+                chosen = [chosen[rng.randrange(len(chosen))] for _ in chosen]
+            wins[pair] = sum(sum(scores) for scores in chosen)
+            games[pair] = sum(len(scores) for scores in chosen)
+        return wins, games
+
+
+def fit_ratings(entrants: List[str], wins: Dict[Tuple[str, str], float], games: Dict[Tuple[str, str], int],
+                iterations: int = 500) -> Dict[str, float]:
+    """
+    Bradley-Terry strengths fitted to pairwise results (by Hunter's MM
+    iteration), as Elo-scale ratings averaging 1500.
+    """
+    count = len(entrants)
+    index = {name: i for i, name in enumerate(entrants)}
+    won = [[0.5] * count for _ in range(count)]  # the added draw between every pair
+    played = [[1.0] * count for _ in range(count)]
+    for (a, b), score in wins.items():
+        i, j = index[a], index[b]
+        won[i][j] += score
+        won[j][i] += games[(a, b)] - score
+        played[i][j] += games[(a, b)]
+        played[j][i] += games[(a, b)]
+    strength = [1.0] * count
+    for _ in range(iterations):
+        previous = strength
+        strength = []
+        for i in range(count):
+            total = sum(won[i][j] for j in range(count) if j != i)
+            weight = sum(played[i][j] / (previous[i] + previous[j]) for j in range(count) if j != i)
+            strength.append(total / weight)
+        mean = math.exp(sum(math.log(s) for s in strength) / count)
+        strength = [s / mean for s in strength]
+        if max(abs(s - p) for s, p in zip(strength, previous)) < 1e-9:
+            break
+    return {name: 1500 + 400 * math.log10(strength[index[name]]) for name in entrants}
+
+
+def round_robin_games(entrants: List[str], seeds: List[int]) -> List[Game]:
+    """Every pair on every deal, each deal from both seats."""
+    games = []
+    for i, a in enumerate(entrants):
+        for b in entrants[i + 1:]:
+            for seed in seeds:
+                games += [(a, b, seed), (b, a, seed)]
+    return games
+
+
+def swiss_pairs(entrants: List[str], points: Dict[str, float], met: set) -> List[Tuple[str, str]]:
+    """
+    Pair strategies with similar scores, avoiding rematches where it can;
+    with an odd number the lowest scorer not yet paired sits the round out.
+    """
+    standing = sorted(entrants, key=lambda name: -points[name])
+    pairs = []
+    while len(standing) > 1:
+        a = standing.pop(0)
+        opponent = next((b for b in standing if frozenset((a, b)) not in met), standing[0])
+        standing.remove(opponent)
+        pairs.append((a, opponent))
+    return pairs
+
+
+def run(entrants: List[str], deals: int, swiss_rounds: int, max_turns: int, workers: Optional[int],
+        seed: int, bootstrap: int) -> Dict:
+    rng = random.Random(seed)
+    results = Results(entrants)
+    started = time.perf_counter()
+    pool = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        if swiss_rounds:
+            met: set = set()
+            for _ in range(swiss_rounds):
+                seeds = [rng.getrandbits(64) for _ in range(deals)]
+                games = []
+                for a, b in swiss_pairs(entrants, results.points(), met):
+                    met.add(frozenset((a, b)))
+                    games += round_robin_games([a, b], seeds)
+                for game, result in zip(games, play_all(pool, games, max_turns)):
+                    results.add(game, result)
+        else:
+            games = round_robin_games(entrants, [rng.getrandbits(64) for _ in range(deals)])
+            for game, result in zip(games, play_all(pool, games, max_turns)):
+                results.add(game, result)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    elapsed = time.perf_counter() - started
+
+    ratings = fit_ratings(entrants, *results.tallies())
+    resampled = [fit_ratings(entrants, *results.tallies(rng)) for _ in range(bootstrap)]
+    points = results.points()
+    played = {name: 0 for name in entrants}
+    for (a, b), deals_played in results.deals.items():
+        for scores in deals_played.values():
+            played[a] += len(scores)
+            played[b] += len(scores)
+    table = []
+    for name in sorted(entrants, key=lambda name: -ratings[name]):
+        samples = sorted(sample[name] for sample in resampled)
+        low, high = (samples[int(0.025 * len(samples))], samples[min(int(0.975 * len(samples)), len(samples) - 1)]) if samples else (None, None)
+        table.append({
+            "strategy": name,
+            "rating": round(ratings[name], 1),
+            "ci95": [round(low, 1), round(high, 1)] if samples else None,
+            "games": played[name],
+            "score": points[name],
+        })
+    head_to_head = {f"{a} vs {b}": {"score": sum(sum(s) for s in deals_played.values()),
+                                    "games": sum(len(s) for s in deals_played.values())}
+                    for (a, b), deals_played in results.deals.items()}
+    return {
+        "schedule": f"swiss, {swiss_rounds} rounds" if swiss_rounds else "round robin",
+        "deals_per_match": deals,
+        "seed": seed,
+        "games": results.games,
+        "games_at_turn_limit": results.capped,
+        "mean_turns": round(results.turns / results.games, 1) if results.games else None,
+        "seconds": round(elapsed, 1),
+        "games_per_second": round(results.games / elapsed, 1) if elapsed else None,
+        "ratings": table,
+        "head_to_head": head_to_head,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rate bot strategies by playing them against each other")
+    parser.add_argument("strategies", nargs="+", help="random, greedy, easy/medium/hard[:seconds], or module:Class")
+    parser.add_argument("--deals", type=int, default=100, help="deals per match, each played from both seats")
+    parser.add_argument("--swiss", type=int, default=0, help="play this many Swiss rounds instead of a round robin")
+    parser.add_argument("--max-turns", type=int, default=1000, help="turns after which a game is stopped as a draw")
+    parser.add_argument("--workers", type=int, default=None, help="processes to use (default: one per core)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bootstrap", type=int, default=200, help="resamples for the confidence intervals")
+    parser.add_argument("--out", help="write the JSON report here instead of to stdout")
+    args = parser.parse_args()
+    if len(set(args.strategies)) != len(args.strategies) or len(args.strategies) < 2:
+        parser.error("name at least two different strategies")
+    for name in args.strategies:
+        try:
+            make_entrant(name)
+        except ValueError as e:
+            parser.error(str(e))
+
+    report = json.dumps(run(args.strategies, args.deals, args.swiss, args.max_turns, args.workers,
+                            args.seed, args.bootstrap), indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+How cards and game states are written for clients, and cards read back.
+
+Each request picks one of two card formats:
+
+- "verbose" (the default, and what the web client reads): a card is
+  {"suit": "hearts", "rank": "QUEEN", "meld_type": "RUN"}
+- "compact": a card is a two-character code, rank then suit ("QH", "TD",
+  "AS"); a hand or the discard pile is its cards' codes run together into
+  one string, and a meld is [codes, meld type (1 set, 2 run), aces high]
+
+Clients that accept application/msgpack get either format as MessagePack
+rather than JSON, if the msgpack package is installed.
+
+Every card's encoding is worked out once up front, so writing a hand only
+joins ready-made fragments.  Objects are written as runs of encoded members
+(see encode_members) so a cached part of a state can be spliced into each
+player's response without being encoded again.
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+from rummy import CARDS, Card, Meld, MeldType, Rank, RummyGame, Suit, card_from_id, get_card
+
+try:
+    import msgpack
+except ImportError:  # JSON only
+    msgpack = None
+
+FORMATS = ("verbose", "compact")
+MSGPACK = "application/msgpack"
+
+RANK_CODES = "A23456789TJQK"
+SUIT_CODES = {Suit.HEARTS: "H", Suit.DIAMONDS: "D", Suit.CLUBS: "C", Suit.SPADES: "S"}
+
+
+class InvalidCard(ValueError):
+    """A client named a card that doesn't exist."""
+
+
+def convert_card(card: Card, meld: Optional[Meld] = None) -> Dict:
+    """A card in the verbose format, marked with the meld it is in, if any."""
+    if meld is None:
+        return {"suit": card.suit.value, "rank": card.rank.name, "meld_type": MeldType.NONE.name}
+    return {"suit": card.suit.value, "rank": meld.rank_of(card).name, "meld_type": meld.meld_type.name}
+
+
+CODES = [RANK_CODES[card.rank.value - 1] + SUIT_CODES[card.suit] for card in CARDS]  # card id -> compact code
+BY_CODE = {code: card for code, card in zip(CODES, CARDS)}
+VERBOSE_JSON = [json.dumps(convert_card(card), separators=(",", ":")).encode() for card in CARDS]  # card id -> unmelded card as JSON
+
+
+def codes(cards: List[Card]) -> str:
+    return "".join([CODES[card.id] for card in cards])
+
+
+def parse_card(data: Any) -> Card:
+    """
+    The card a client means, in either format: a verbose card (whose rank is
+    the rank's number), a compact code, or a card id.
+
+    Raises:
+        InvalidCard: If it isn't one of the 52 cards
+    """
+    if isinstance(data, str):
+        card = BY_CODE.get(data.upper())
+        if card is None:
+            raise InvalidCard(f"Invalid card: {data!r}")
+        return card
+    if isinstance(data, int) and not isinstance(data, bool):
+        if not 0 <= data < len(CARDS):
+            raise InvalidCard(f"Invalid card: {data!r}")
+        return card_from_id(data)
+    try:
+        return get_card(Suit(data["suit"]), Rank(int(data["rank"])))
+    except (KeyError, TypeError, ValueError):
+        raise InvalidCard(f"Invalid card: {data!r}") from None
+
+
+def public_members(game_id: str, game: RummyGame, card_format: str) -> Dict:
+    """The members of a game's state that are the same for every player."""
+    melds = [game.players_melds[i] for i in game.player_ids]
+    if card_format == "compact":
+        melds = [[[codes(meld.cards), meld.meld_type.value, meld.ace_high] for meld in p] for p in melds]
+        discards = codes(game.discard_pile)
+    else:
+        melds = [[[convert_card(card, meld) for card in meld.cards] for meld in p] for p in melds]
+        discards = [convert_card(card) for card in game.discard_pile]
+    return {
+        "gameID": game_id,
+        "playerNames": game.player_names,
+        "playerScores": [game.scores[i] for i in game.player_ids],
+        "handCts": [len(game.players_hands[i]) for i in game.player_ids],
+        "melds": melds,
+        "discards": discards,
+        "stack": len(game.stack),
+        "activePlayerName": game.player_names[game.current_player],
+        "playerCount": game.num_players,
+        "gameOver": game.is_game_over(),
+        "version": game.version
+    }
+
+
+def encode_members(members: Dict, binary: bool) -> bytes:
+    """
+    An object's members encoded to be spliced into it: JSON without the
+    braces, or MessagePack keys and values back to back.
+    """
+    if binary:
+        return b"".join([msgpack.packb(key) + msgpack.packb(value) for key, value in members.items()])
+    return json.dumps(members, separators=(",", ":")).encode()[1:-1]
+
+
+def encode_hand(hand: List[Card], card_format: str, binary: bool) -> bytes:
+    """The "hand" member of a player's state, as encode_members would write it."""
+    if binary:
+        return encode_members({"hand": codes(hand) if card_format == "compact" else [convert_card(card) for card in hand]}, binary)
+    if card_format == "compact":
+        return b'"hand":"' + codes(hand).encode() + b'"'  # codes never need escaping
+    return b'"hand":[' + b",".join([VERBOSE_JSON[card.id] for card in hand]) + b"]"
+
+
+def encode_object(parts: List[bytes], count: int, binary: bool) -> bytes:
+    """
+    Join runs of encoded members into an object.
+
+    Args:
+        parts: From encode_members, encode_hand and so on
+        count: How many members the parts hold between them (MessagePack's map header needs it)
+        binary: Whether the parts are MessagePack
+    """
+    if binary:
+        header = bytes([0x80 | count]) if count < 16 else b"\xde" + count.to_bytes(2, "big")
+        return header + b"".join(parts)
+    return b"{" + b",".join([part for part in parts if part]) + b"}"
+
+
+def encode_response(game_state: bytes, binary: bool) -> bytes:
+    """The body answering a request with a player's encoded game state."""
+    return encode_object([encode_members({"success": True}, binary),
+                          msgpack.packb("game_state") + game_state if binary else b'"game_state":' + game_state], 2, binary)
@@ -103,6 +103,7 @@ export class RummyGame {
     activePlayerName: string;
     playerCount: number;
     eventLog: string[];
+    version: number;
 
     constructor(
         gameID: string,
@@ -115,7 +116,8 @@ export class RummyGame {
         stack: number,
         activePlayerName: string,
         playerCount: number,
-        eventLog: string[]
+        eventLog: string[],
+        version: number
     ) {
         this.gameID = gameID;
         this.playerNames = playerNames;
@@ -128,5 +130,6 @@ export class RummyGame {
         this.activePlayerName = activePlayerName;
         this.playerCount = playerCount;
         this.eventLog = eventLog;
+        this.version = version;
     }
 }